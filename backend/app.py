@@ -1,22 +1,53 @@
 import os
+import json
+import math
+import time
 import hashlib
 import secrets
+import ipaddress
+from flask import g
 from flask import jsonify
+from flask import Response
+from pubsub import publish
+from functools import wraps
 from flask_cors import CORS
-from datetime import datetime
+from sqlalchemy import delete
+from logs import setup_logging
 from datetime import timedelta
 from dotenv import load_dotenv
-from config import SessionLocal
-from flask import Flask, request
 from encryption import Encryptor
 from flask import render_template
+from probing import validate_probe
 from contextlib import contextmanager
-from sqlalchemy.orm import scoped_session
 from flask_jwt_extended import JWTManager
+from passwords import HashingBusy, needs_rehash
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_jwt_extended import create_access_token
+from config import SessionLocal, get_engine, pool_stats
+from flask import Blueprint, Flask, current_app, request
+from pubsub import ENDPOINTS_CHANNEL, SUBSCRIPTIONS_CHANNEL
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from twilio.twiml.messaging_response import MessagingResponse
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from email_validator import validate_email, EmailNotValidError
+from cache import IdentityCache, ResponseCache, shared_counters
+from ratelimit import SlidingWindowLimiter, RATE_LIMIT_SHM_PATH
+from endpoints import AREA_PATTERN, DEFAULT_AREA, update_endpoints
+from history import (
+    GRANULARITIES,
+    HISTORY_MAX_BUCKETS,
+    load_history,
+    parse_timestamp,
+    pick_granularity,
+    utcnow,
+)
+from metrics import (
+    REQUEST_DB_TIME,
+    REQUEST_LATENCY,
+    render as render_metrics,
+    start_db_timer,
+    stop_db_timer,
+)
 from models import (
     ServiceStatus,
     EmailSubscription,
@@ -25,19 +56,29 @@ from models import (
     Superuser,
 )
 
-# Create a Flask application instance
-app = Flask(__name__)
-encryptor = Encryptor()
-jwt = JWTManager(app)
-
 load_dotenv()
-SUPERUSER_NAME = os.getenv("SUPERUSER_NAME")
-SUPERUSER_PASSWORD = os.getenv("SUPERUSER_PASSWORD")
-app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY")
-DEFAULT_ISP_ENDPOINTS = ["216.75.112.220", "216.75.120.220"]
+JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
+
+# Take the client address from the X-Forwarded-For entries added by nginx
+TRUSTED_PROXIES = int(os.getenv("TRUSTED_PROXIES", "1"))
+
+# Peers allowed to read the /internal/ routes, e.g. a Prometheus scraper on
+# another container; the loopback interface alone by default
+INTERNAL_NETWORKS = [
+    ipaddress.ip_network(network.strip())
+    for network in os.getenv("INTERNAL_NETWORKS", "127.0.0.0/8,::1/128").split(",")
+    if network.strip()
+]
+
+# Routes, registered on the application by create_app()
+api = Blueprint("api", __name__)
+encryptor = Encryptor()
+jwt = JWTManager()
+response_cache = ResponseCache(shared_counters)
+superuser_cache = IdentityCache(shared_counters, "superusers")
 
-# Allow requests from any origin during development
-CORS(app, resources={r"/api/*": {"origins": "*"}})
+# Throttles abusive clients before any validation, crypto or database work
+rate_limiter = SlidingWindowLimiter(RATE_LIMIT_SHM_PATH)
 
 
 # Context manager for handling database sessions
@@ -54,102 +95,364 @@ def get_session():
         session.close()
 
 
+@api.before_app_request
+def start_request_timers():
+    g.request_started = time.perf_counter()
+    start_db_timer()
+
+
+@api.after_app_request
+def observe_request(response):
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    REQUEST_LATENCY.labels(route, request.method, response.status_code).observe(
+        time.perf_counter() - g.request_started
+    )
+    REQUEST_DB_TIME.labels(route).observe(stop_db_timer())
+    return response
+
+
+def identity_hash(value):
+    """
+    Hashes a contact address for rate limiting, before it is validated.
+    """
+    return hashlib.sha256(value.strip().lower().encode()).hexdigest()
+
+
+def too_many_requests(retry_after):
+    response = jsonify({"message": "Too many requests, please try again later"})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(math.ceil(retry_after))
+    return response
+
+
+def cached_json_response(key, loader):
+    """
+    Serves a JSON response from the shared cache, answering conditional
+    GETs with 304 Not Modified.
+    """
+    entry = response_cache.get(key, loader)
+    response = current_app.response_class(entry.body, mimetype="application/json")
+    response.set_etag(entry.etag)
+    response.last_modified = entry.last_modified
+    # Clients may keep the response but must revalidate it on every use
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
 # Route to handle user login
-@app.route("/api/login", methods=["POST"])
+@api.route("/api/login", methods=["POST"])
 def login():
     username = request.json.get("username", None)
     password = request.json.get("password", None)
 
+    # Locked accounts and throttled clients are turned away before hashing
+    account = identity_hash(str(username))
+    retry_after = rate_limiter.check("login", ip=request.remote_addr)
+    if not retry_after:
+        retry_after = rate_limiter.exceeded("login_failures", account=account)
+    if retry_after:
+        return too_many_requests(retry_after)
+
     # Authenticate user
     with get_session() as session:
         user = session.query(Superuser).filter_by(username=username).first()
-        if user and user.check_password(password):
-            # Create JWT token
-            expires = timedelta(days=1)  # Token expires in one day
-            access_token = create_access_token(identity=username, expires_delta=expires)
-            return jsonify(access_token=access_token), 200
-        else:
+        try:
+            authenticated = user is not None and user.check_password(password)
+        except HashingBusy:
+            return too_many_requests(1)
+
+        if not authenticated:
+            rate_limiter.check("login_failures", account=account)
             return jsonify({"msg": "Bad username or password"}), 401
+        rate_limiter.reset("login_failures", account=account)
 
+        # Upgrade hashes made under an older cost policy
+        if needs_rehash(user.password_hash):
+            try:
+                user.set_password(password)
+                session.commit()
+            except HashingBusy:
+                pass
+
+        # Create JWT token
+        expires = timedelta(days=1)  # Token expires in one day
+        access_token = create_access_token(identity=username, expires_delta=expires)
+        return jsonify(access_token=access_token), 200
+
+
+def is_superuser(username):
+    """
+    Confirms a JWT identity still names a superuser, reading the database
+    only when the identity cache cannot.
+    """
+    known, generation = superuser_cache.lookup(username)
+    if known:
+        return True
 
-# Route to get all ISP endpoints
-@app.route("/api/isp_endpoints", methods=["GET"])
-def get_isp_endpoints():
+    with get_session() as session:
+        exists = (
+            session.query(Superuser.id).filter_by(username=username).first() is not None
+        )
+    if exists:
+        superuser_cache.add(username, generation)
+    return exists
+
+
+def load_isp_endpoints():
     with get_session() as session:
         # Fetch all ISP endpoints from the database
         endpoints = session.query(ISPEndpoint).all()
         # Extract the address from each endpoint
         isp_endpoints = [endpoint.address for endpoint in endpoints]
-        return jsonify({"endpoints": isp_endpoints})
+        areas = {endpoint.address: endpoint.area for endpoint in endpoints}
+        probe_intervals = {
+            endpoint.address: endpoint.probe_interval
+            for endpoint in endpoints
+            if endpoint.probe_interval
+        }
+        # Only endpoints probed other than by a default ICMP ping
+        probes = {
+            endpoint.address: {
+                "type": endpoint.probe_type,
+                "params": endpoint.probe_params or {},
+                "timeout": endpoint.probe_timeout,
+                "slo": endpoint.latency_slo,
+            }
+            for endpoint in endpoints
+            if endpoint.probe_type != "icmp"
+            or endpoint.probe_params
+            or endpoint.probe_timeout
+            or endpoint.latency_slo
+        }
+        last_modified = max(
+            (
+                endpoint.updated_at or endpoint.created_at
+                for endpoint in endpoints
+                if endpoint.updated_at or endpoint.created_at
+            ),
+            default=None,
+        )
+        body = current_app.json.dumps(
+            {
+                "endpoints": isp_endpoints,
+                "areas": areas,
+                "probe_intervals": probe_intervals,
+                "probes": probes,
+            }
+        )
+        return body + "\n", last_modified
+
+
+# Route to get all ISP endpoints
+@api.route("/api/isp_endpoints", methods=["GET"])
+def get_isp_endpoints():
+    return cached_json_response("isp_endpoints", load_isp_endpoints)
 
 
 # Route to update ISP endpoints
-@app.route("/api/isp_endpoints", methods=["POST"])
+@api.route("/api/isp_endpoints", methods=["POST"])
 @jwt_required()
 def update_isp_endpoints():
-    # Get the identity of the current user from the JWT
-    current_user_username = get_jwt_identity()
-
-    # Optional: You can add additional checks here to confirm that the current user is a superuser
-    with get_session() as session:
-        user = (
-            session.query(Superuser).filter_by(username=current_user_username).first()
-        )
-        if not user:
-            return jsonify({"message": "Unauthorized"}), 401
+    # Confirm the identity from the JWT is still a superuser
+    if not is_superuser(get_jwt_identity()):
+        return jsonify({"message": "Unauthorized"}), 401
 
     data = request.get_json()
     new_endpoints = data.get("endpoints")
     if not new_endpoints or not isinstance(new_endpoints, list):
         return jsonify({"message": "Bad Request. 'endpoints' must be a list."}), 400
 
-    with get_session() as session:
-        # Remove all current endpoints
-        session.query(ISPEndpoint).delete()
+    # Endpoints are addresses, or objects with an address, a probe interval
+    # and optionally a service area, a probe type, its params, a timeout and
+    # a latency SLO
+    endpoints = []
+    for item in new_endpoints:
+        if isinstance(item, str):
+            endpoints.append((item, {}))
+            continue
+        address = item.get("address") if isinstance(item, dict) else None
+        interval = item.get("interval") if isinstance(item, dict) else None
+        if not isinstance(address, str) or not (
+            interval is None or (isinstance(interval, int) and interval > 0)
+        ):
+            return (
+                jsonify(
+                    {
+                        "message": "Bad Request. Each endpoint must be an address "
+                        "or an object with an 'address' and a positive 'interval'."
+                    }
+                ),
+                400,
+            )
 
-        # Add new ISP endpoints
-        for address in new_endpoints:
-            new_endpoint = ISPEndpoint(address=address)
-            session.add(new_endpoint)
+        area = item.get("area") or DEFAULT_AREA
+        probe_type = item.get("type", "icmp")
+        params = item.get("params") or {}
+        error = validate_probe(probe_type, params)
+        if not isinstance(area, str) or not AREA_PATTERN.match(area):
+            error = "'area' must be lowercase letters, digits, '-' or '_'."
+        for field in ("timeout", "slo"):
+            value = item.get(field)
+            if value is not None and not (
+                isinstance(value, (int, float))
+                and not isinstance(value, bool)
+                and value > 0
+            ):
+                error = f"'{field}' must be a positive number of seconds."
+        if error:
+            return jsonify({"message": f"Bad Request. {address}: {error}"}), 400
+
+        endpoints.append(
+            (
+                address,
+                {
+                    "area": area,
+                    "interval": interval,
+                    "type": probe_type,
+                    "params": params,
+                    "timeout": item.get("timeout"),
+                    "slo": item.get("slo"),
+                },
+            )
+        )
 
-        session.commit()
+    # Apply only what changed, in one round trip; later duplicates of an
+    # address win. The monitor receives the same diff.
+    version = update_endpoints(get_engine(), ENDPOINTS_CHANNEL, dict(endpoints))
+
+    response_cache.invalidate("isp_endpoints")
+    return (
+        jsonify({"message": "ISP endpoints updated successfully", "version": version}),
+        200,
+    )
+
+
+def render_status(statuses):
+    """
+    Builds the /api/status body from the stored (area, status, updated_at)
+    rows, ordered by area. Shared with the ASGI tier so both serve identical
+    bodies and ETags.
+    """
+    # Default response if no status is found
+    if not statuses:
+        response_data = {
+            "message": "No status information available",
+            "status_code": 500,
+        }
+        last_modified = None
+    else:
+        # Construct response message based on service status; the service
+        # is down wherever any area is
+        last_modified = max(updated_at for _, _, updated_at in statuses)
+        formatted_timestamp = last_modified.strftime("%Y-%m-%d %H:%M:%S")
+        down = [area for area, status, _ in statuses if status != "online"]
+        if not down:
+            message_text = f"✅ Allo is online! Last updated at {formatted_timestamp}"
+        elif down == [DEFAULT_AREA] or len(down) == len(statuses):
+            message_text = f"⚠️ Allo is down! Last updated at {formatted_timestamp}"
+        else:
+            message_text = (
+                f"⚠️ Allo is down in {', '.join(down)}! "
+                f"Last updated at {formatted_timestamp}"
+            )
+        response_data = {
+            "message": message_text,
+            "areas": {area: status for area, status, _ in statuses},
+        }
+
+    # Sorted and ASCII-escaped like Flask's own JSON responses
+    return json.dumps(response_data, sort_keys=True) + "\n", last_modified
 
-        return jsonify({"message": "ISP endpoints updated successfully"}), 200
+
+def load_status():
+    with get_session() as session:
+        statuses = (
+            session.query(
+                ServiceStatus.area, ServiceStatus.status, ServiceStatus.updated_at
+            )
+            .order_by(ServiceStatus.area)
+            .all()
+        )
+        return render_status(statuses)
 
 
 # Route to get the current service status
-@app.route("/api/status", methods=["GET"])
+@api.route("/api/status", methods=["GET"])
 def get_status():
-    with get_session() as session:
-        service_status = session.query(ServiceStatus).first()
+    return cached_json_response("status", load_status)
 
-        # Default response if no status is found
-        if service_status is None:
-            response_data = {
-                "message": "No status information available",
-                "status_code": 500,
-            }
-        else:
-            # Construct response message based on service status
-            formatted_timestamp = service_status.updated_at.strftime(
-                "%Y-%m-%d %H:%M:%S"
-            )
-            message_text = (
-                f"✅ Allo is online! Last updated at {formatted_timestamp}"
-                if service_status.status == "online"
-                else f"⚠️ Allo is down! Last updated at {formatted_timestamp}"
-            )
-            response_data = {"message": message_text}
 
-        return jsonify(response_data)
+# Route to get uptime and latency history from the rollups
+@api.route("/api/history", methods=["GET"])
+def get_history():
+    try:
+        end = (
+            parse_timestamp(request.args["end"]) if "end" in request.args else utcnow()
+        )
+        start = (
+            parse_timestamp(request.args["start"])
+            if "start" in request.args
+            else end - timedelta(days=1)
+        )
+    except ValueError:
+        return jsonify({"message": "Bad Request. Use ISO 8601 timestamps."}), 400
+
+    if start >= end:
+        return jsonify({"message": "Bad Request. 'start' must be before 'end'."}), 400
+
+    granularity = request.args.get("granularity") or pick_granularity(start, end)
+    if granularity not in GRANULARITIES:
+        return (
+            jsonify({"message": "Bad Request. Use minute, hour or day granularity."}),
+            400,
+        )
+    if (end - start) / GRANULARITIES[granularity] > HISTORY_MAX_BUCKETS:
+        return jsonify({"message": "Bad Request. Range has too many buckets."}), 400
+
+    with get_session() as session:
+        history = load_history(
+            session, start, end, granularity, request.args.get("endpoint")
+        )
+        return jsonify(history)
+
+
+def parse_areas(session, value):
+    """
+    Parses a comma or space separated list of service areas, the default
+    area when empty. Returns (areas, unknown), where unknown lists the
+    names no endpoint is monitored in.
+    """
+    names = set(value.replace(",", " ").lower().split()) or {DEFAULT_AREA}
+    known = {DEFAULT_AREA}
+    # Most subscribers only want the default area, which always exists
+    if names - known:
+        query = session.query(ISPEndpoint.area).filter(ISPEndpoint.area.in_(names))
+        known.update(area for (area,) in query.distinct())
+    return sorted(names & known), sorted(names - known)
+
+
+def parse_sms_command(body):
+    """
+    Splits an SMS into its command, the first word in upper case, and the
+    rest of the message.
+    """
+    words = body.split(None, 1)
+    if not words:
+        return "", ""
+    return words[0].upper(), words[1] if len(words) > 1 else ""
 
 
 # Route to handle email subscription
-@app.route("/api/subscribe", methods=["POST"])
+@api.route("/api/subscribe", methods=["POST"])
 def subscribe():
-    with get_session() as session:
-        email = request.form["email"]
+    email = request.form["email"]
+    retry_after = rate_limiter.check(
+        "subscribe", ip=request.remote_addr, email=identity_hash(email)
+    )
+    if retry_after:
+        return too_many_requests(retry_after)
 
+    with get_session() as session:
         try:
             # Validate the email address
             valid = validate_email(email)
@@ -161,29 +464,52 @@ def subscribe():
         except EmailNotValidError as e:
             return jsonify({"message": str(e)}), 400
 
-        # Check for existing subscription
-        existing_subscription = (
-            session.query(EmailSubscription).filter_by(email_hash=email_hash).first()
-        )
-        if existing_subscription:
+        # Subscribers are only alerted about the areas they pick
+        areas, unknown = parse_areas(session, request.form.get("areas", ""))
+        if unknown:
+            return (
+                jsonify({"message": f"Unknown service areas: {', '.join(unknown)}"}),
+                400,
+            )
+
+        # Insert in one statement; a concurrent or earlier subscription with
+        # the same hash makes it a no-op rather than an IntegrityError
+        token = secrets.token_urlsafe(16)
+        inserted = session.execute(
+            pg_insert(EmailSubscription)
+            .values(
+                token=token,
+                encrypted_email=encrypted_email,
+                email_hash=email_hash,
+                areas=areas,
+            )
+            .on_conflict_do_nothing(index_elements=[EmailSubscription.email_hash])
+            .returning(EmailSubscription.token)
+        ).first()
+        if inserted is None:
             return (
                 jsonify({"message": "You're already subscribed to notifications"}),
                 409,
             )
 
-        # Create new subscription if not already subscribed
-        token = secrets.token_urlsafe(16)
-        subscription = EmailSubscription(
-            token=token, encrypted_email=encrypted_email, email_hash=email_hash
+        # The monitor adds the subscriber to its roster when this commits
+        publish(
+            session,
+            SUBSCRIPTIONS_CHANNEL,
+            {
+                "channel": "email",
+                "op": "add",
+                "token": token,
+                "encrypted": encrypted_email,
+            },
         )
-        session.add(subscription)
         session.commit()
 
         return jsonify({"message": "Successfully subscribed to notifications"}), 200
 
 
 # Route to handle email unsubscription
-@app.route("/api/unsubscribe", methods=["GET"])
+@api.route("/api/unsubscribe", methods=["GET"])
 def unsubscribe():
     token = request.args.get("token")
     if not token:
@@ -196,9 +522,13 @@ def unsubscribe():
         )
 
     with get_session() as session:
-        # Find the subscription by its token
-        subscription = session.query(EmailSubscription).filter_by(token=token).first()
-        if not subscription:
+        # Remove the subscription by its token in one statement
+        deleted = session.execute(
+            delete(EmailSubscription)
+            .where(EmailSubscription.token == token)
+            .returning(EmailSubscription.token)
+        ).first()
+        if deleted is None:
             return (
                 render_template(
                     "message.html",
@@ -207,8 +537,11 @@ def unsubscribe():
                 400,
             )
 
-        # Remove the subscription and update the database
-        session.delete(subscription)
+        publish(
+            session,
+            SUBSCRIPTIONS_CHANNEL,
+            {"channel": "email", "op": "remove", "token": token},
+        )
         session.commit()
 
         return (
@@ -220,7 +553,7 @@ def unsubscribe():
 
 
 # Route to handle SMS replies and subscriptions
-@app.route("/api/sms", methods=["POST"])
+@api.route("/api/sms", methods=["POST"])
 def sms_reply():
     """Respond to incoming messages with a friendly SMS."""
     body = request.values.get("Body", "").strip()
@@ -228,37 +561,67 @@ def sms_reply():
 
     resp = MessagingResponse()
 
+    # Throttled senders get no reply, which also avoids paying for one
+    if rate_limiter.check(
+        "sms", ip=request.remote_addr, phone=identity_hash(from_number)
+    ):
+        return str(resp)
+
+    command, argument = parse_sms_command(body)
     with get_session() as session:
-        # Handle subscription via SMS
-        if "SUBSCRIBE" in body.upper():
+        # Handle subscription via SMS, e.g. "SUBSCRIBE north, south"
+        if command == "SUBSCRIBE":
             phone_hash = hashlib.sha256(from_number.encode()).hexdigest()
-
-            # Check for existing subscription
-            existing_subscription = (
-                session.query(SMSSubscription).filter_by(phone_hash=phone_hash).first()
-            )
-            if existing_subscription:
+            areas, unknown = parse_areas(session, argument)
+            if unknown:
+                resp.message(f"Unknown service areas: {', '.join(unknown)}")
+                return str(resp)
+
+            encrypted_phone = encryptor.encrypt(from_number)
+            token = secrets.token_urlsafe(16)
+            inserted = session.execute(
+                pg_insert(SMSSubscription)
+                .values(
+                    token=token,
+                    encrypted_phone=encrypted_phone,
+                    phone_hash=phone_hash,
+                    areas=areas,
+                )
+                .on_conflict_do_nothing(index_elements=[SMSSubscription.phone_hash])
+                .returning(SMSSubscription.token)
+            ).first()
+            if inserted is None:
                 resp.message("You're already subscribed to SMS alerts!")
             else:
-                encrypted_phone = encryptor.encrypt(from_number)
-                token = secrets.token_urlsafe(16)
-                subscription = SMSSubscription(
-                    token=token, encrypted_phone=encrypted_phone, phone_hash=phone_hash
+                publish(
+                    session,
+                    SUBSCRIPTIONS_CHANNEL,
+                    {
+                        "channel": "sms",
+                        "op": "add",
+                        "token": token,
+                        "encrypted": encrypted_phone,
+                    },
                 )
-                session.add(subscription)
                 session.commit()
 
                 resp.message("Thank you for subscribing to SMS alerts!")
 
         # Handle unsubscription via SMS
-        elif "UNSUBSCRIBE" in body.upper():
+        elif command == "UNSUBSCRIBE":
             phone_hash = hashlib.sha256(from_number.encode()).hexdigest()
-            subscription = (
-                session.query(SMSSubscription).filter_by(phone_hash=phone_hash).first()
-            )
-
-            if subscription:
-                session.delete(subscription)
+            deleted = session.execute(
+                delete(SMSSubscription)
+                .where(SMSSubscription.phone_hash == phone_hash)
+                .returning(SMSSubscription.token)
+            ).first()
+
+            if deleted is not None:
+                publish(
+                    session,
+                    SUBSCRIPTIONS_CHANNEL,
+                    {"channel": "sms", "op": "remove", "token": deleted.token},
+                )
                 session.commit()
                 resp.message("You have been unsubscribed from SMS alerts.")
             else:
@@ -273,63 +636,72 @@ def sms_reply():
     return str(resp)
 
 
-def populate_default_isp_endpoints():
-    with get_session() as session:
-        # Check if any ISP endpoints already exist
-        if session.query(ISPEndpoint).first() is None:
-            # Add default endpoints
-            for endpoint in DEFAULT_ISP_ENDPOINTS:
-                new_endpoint = ISPEndpoint(address=endpoint)
-                session.add(new_endpoint)
-            session.commit()
-            print("Default ISP endpoints added to the database.")
-        else:
-            print("ISP endpoints already exist in the database.")
+def internal_only(view):
+    """
+    Hides a route from every peer outside INTERNAL_NETWORKS.
 
+    gunicorn listens on all interfaces, so the app port can be reached
+    without going through nginx. The peer address is the one the
+    connection came from, before ProxyFix applied X-Forwarded-For, which
+    any client can set.
+    """
 
-def create_default_superuser():
-    with get_session() as session:
-        superuser_exists = (
-            session.query(Superuser).filter_by(username=SUPERUSER_NAME).first()
-            is not None
-        )
-        if not superuser_exists:
-            superuser = Superuser(username=SUPERUSER_NAME)
-            superuser.set_password(SUPERUSER_PASSWORD)
-            session.add(superuser)
-            session.commit()
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        environ = request.environ
+        peer = environ.get("werkzeug.proxy_fix.orig", environ).get("REMOTE_ADDR")
+        try:
+            address = ipaddress.ip_address(peer)
+        except ValueError:
+            address = None
+        if address is None or not any(address in net for net in INTERNAL_NETWORKS):
+            return jsonify({"message": "Not found"}), 404
+        return view(*args, **kwargs)
 
+    return wrapper
 
-# Function to initialize the Flask application
-def start_flask_app():
-    # Create a scoped session
-    session = scoped_session(SessionLocal)
 
-    try:
-        # Check and set initial service status
-        service_status = session.query(ServiceStatus).first()
-
-        if not service_status:
-            new_status = ServiceStatus(status="online", updated_at=datetime.now())
-            session.add(new_status)
-            session.commit()
-            print("Service status set to online")
-        else:
-            print("Service status already exists")
+# Route to report connection pool statistics for this worker
+@api.route("/internal/pool", methods=["GET"])
+@internal_only
+def get_pool_stats():
+    return jsonify(pool_stats.snapshot(get_engine().pool))
 
-        # Additional Flask app startup code goes here...
 
-    except Exception as e:
-        print(f"Error setting service status: {e}")
-        session.rollback()
-    finally:
-        session.remove()
+# Route to expose Prometheus metrics for every worker
+@api.route("/internal/metrics", methods=["GET"])
+@internal_only
+def get_metrics():
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+
+def create_app():
+    """
+    Builds the Flask application.
+
+    Nothing here touches the database, so workers boot without waiting for
+    it; `python manage.py init` creates the schema and seed data.
+    """
+    # Structured logs written off the request path
+    setup_logging()
+
+    app = Flask(__name__)
+    app.config["JWT_SECRET_KEY"] = JWT_SECRET_KEY
+    jwt.init_app(app)
+
+    # Allow requests from any origin during development
+    CORS(app, resources={r"/api/*": {"origins": "*"}})
+
+    if TRUSTED_PROXIES:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+
+    app.register_blueprint(api)
+    return app
 
 
-# Start the Flask application
-start_flask_app()
-create_default_superuser()
-populate_default_isp_endpoints()
+# Application served by gunicorn and mounted by the ASGI tier
+app = create_app()
 
 if __name__ == "__main__":
     app.run(debug=False, use_reloader=False)
@@ -0,0 +1,266 @@
+import os
+import time
+import logging
+import asyncio
+import asyncpg
+from zoneinfo import ZoneInfo
+from datetime import timezone
+from a2wsgi import WSGIMiddleware
+from pubsub import STATUS_CHANNEL
+from metrics import REQUEST_LATENCY
+from starlette.requests import Request
+from contextlib import asynccontextmanager
+from starlette.routing import Mount, Route
+from config import DB_STATEMENT_TIMEOUT_MS
+from starlette.middleware import Middleware
+from starlette.applications import Starlette
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response, StreamingResponse
+from email.utils import format_datetime, parsedate_to_datetime
+from config import DATABASE_URL, DB_MAX_OVERFLOW, DB_POOL_SIZE
+from app import app as flask_app, render_status, response_cache
+
+logger = logging.getLogger(__name__)
+
+# Seconds between keep-alive comments on idle status streams
+SSE_HEARTBEAT = float(os.getenv("SSE_HEARTBEAT", "15"))
+
+# Threads serving the Flask routes mounted below the native ones
+ASGI_WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", "64"))
+
+# Created by lifespan() in each worker
+pool = None
+status_feed = None
+
+# One reload per key at a time, however many requests miss together
+load_locks = {"status": asyncio.Lock()}
+
+# Keeps notification tasks referenced until they finish
+background_tasks = set()
+
+
+class StatusFeed:
+    """
+    Holds the latest status body and wakes every waiting stream when it
+    changes.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.body = None
+        self.changed = asyncio.Event()
+
+    def publish(self, body):
+        self.version += 1
+        self.body = body
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    async def wait(self, version, timeout):
+        """
+        Waits for a body newer than version.
+
+        Returns (version, body), or None if the timeout expires first.
+        """
+        if self.version <= version:
+            try:
+                await asyncio.wait_for(self.changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        return self.version, self.body
+
+
+async def load_status():
+    async with pool.acquire() as connection:
+        rows = await connection.fetch(
+            "SELECT area, status, updated_at, current_setting('TimeZone') AS tz "
+            "FROM service_status ORDER BY area"
+        )
+
+    # asyncpg returns UTC; the Flask tier formats in the session time zone
+    statuses = []
+    for row in rows:
+        try:
+            updated_at = row["updated_at"].astimezone(ZoneInfo(row["tz"]))
+        except Exception:
+            updated_at = row["updated_at"]
+        statuses.append((row["area"], row["status"], updated_at))
+    return render_status(statuses)
+
+
+async def cached(key, loader):
+    """
+    Async counterpart of ResponseCache.get() sharing the same entries.
+    """
+    entry, _ = response_cache.lookup(key)
+    if entry is not None:
+        return entry
+
+    async with load_locks[key]:
+        entry, generation = response_cache.lookup(key)
+        if entry is None:
+            entry = response_cache.store(key, generation, *await loader())
+    return entry
+
+
+def not_modified(request, entry):
+    """
+    Evaluates conditional request headers the way Werkzeug does for Flask.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [
+            tag.strip().removeprefix("W/").strip('"')
+            for tag in if_none_match.split(",")
+        ]
+        return "*" in tags or entry.etag in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        last_modified = entry.last_modified
+        if last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def observe(route, request, response, started):
+    REQUEST_LATENCY.labels(route, request.method, response.status_code).observe(
+        time.perf_counter() - started
+    )
+    return response
+
+
+async def get_status(request: Request):
+    started = time.perf_counter()
+    entry = await cached("status", load_status)
+
+    last_modified = entry.last_modified
+    if last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    headers = {
+        "ETag": f'"{entry.etag}"',
+        "Last-Modified": format_datetime(
+            last_modified.astimezone(timezone.utc), usegmt=True
+        ),
+        # Clients may keep the response but must revalidate it on every use
+        "Cache-Control": "no-cache",
+    }
+
+    if not_modified(request, entry):
+        response = Response(status_code=304, headers=headers)
+    else:
+        response = Response(entry.body, media_type="application/json", headers=headers)
+    return observe("/api/status", request, response, started)
+
+
+async def stream_status(request: Request):
+    started = time.perf_counter()
+
+    async def events():
+        version = status_feed.version
+        entry = await cached("status", load_status)
+        yield f"retry: 3000\ndata: {entry.body.strip()}\n\n"
+
+        while True:
+            update = await status_feed.wait(version, SSE_HEARTBEAT)
+            if update is None:
+                # Comment lines keep proxies from closing idle streams
+                yield ": keep-alive\n\n"
+                continue
+            version, body = update
+            yield f"data: {body}\n\n"
+
+    response = StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    return observe("/api/status/stream", request, response, started)
+
+
+async def refresh_status():
+    # The monitor committed a new status, so reload it once for every stream
+    response_cache.discard("status")
+    entry = await cached("status", load_status)
+    status_feed.publish(entry.body.strip())
+
+
+def on_status_notification(connection, pid, channel, payload):
+    task = asyncio.create_task(refresh_status())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+async def listen_for_status(poll_interval=5, reconnect_delay=1):
+    """
+    Holds this worker's LISTEN connection for status changes, reconnecting
+    whenever it drops.
+    """
+    while True:
+        connection = None
+        try:
+            connection = await asyncpg.connect(DATABASE_URL)
+            await connection.add_listener(STATUS_CHANNEL, on_status_notification)
+
+            # Changes may have been missed while disconnected
+            await refresh_status()
+
+            # Notifications arrive on their own; this only detects a dead link
+            while True:
+                await asyncio.sleep(poll_interval)
+                await connection.execute("SELECT 1")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Status listener connection lost: %s", e)
+        finally:
+            if connection is not None:
+                connection.terminate()
+        await asyncio.sleep(reconnect_delay)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global pool, status_feed
+    pool = await asyncpg.create_pool(
+        DATABASE_URL,
+        min_size=1,
+        max_size=DB_POOL_SIZE + DB_MAX_OVERFLOW,
+        server_settings={"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)},
+    )
+    status_feed = StatusFeed()
+    listener = asyncio.create_task(listen_for_status())
+    try:
+        yield
+    finally:
+        listener.cancel()
+        await pool.close()
+
+
+# Same CORS policy as the Flask routes
+cors = [
+    Middleware(
+        CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]
+    )
+]
+
+# Status reads and streams are served natively; every other route, with
+# its JWT, CORS and Twilio handling, is still served by the Flask app
+app = Starlette(
+    routes=[
+        Route("/api/status", get_status, methods=["GET", "OPTIONS"], middleware=cors),
+        Route(
+            "/api/status/stream",
+            stream_status,
+            methods=["GET", "OPTIONS"],
+            middleware=cors,
+        ),
+        Mount("/", app=WSGIMiddleware(flask_app, workers=ASGI_WSGI_THREADS)),
+    ],
+    lifespan=lifespan,
+)
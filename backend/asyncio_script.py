@@ -1,186 +1,357 @@
 import os
-import boto3
-import aiohttp
+import logging
 import asyncio
-from ping3 import ping
+from outbox import enqueue
 from datetime import datetime
-from twilio.rest import Client
 from dotenv import load_dotenv
-from config import SessionLocal
-from encryption import Encryptor
+from scheduler import run_every
+from cache import shared_counters
+from pubsub import OUTBOX_CHANNEL
+from state_engine import AreaStates
+from sqlalchemy import delete, func
 from sqlalchemy.orm import scoped_session
-from models import ServiceStatus, EmailSubscription, SMSSubscription
+from probing import close as close_probes
+from logs import correlation, setup_logging
+from config import SessionLocal, DATABASE_URL
+from models import ServiceStatus, MonitorState
+from prometheus_client import start_http_server
+from endpoints import DEFAULT_AREA, EndpointProvider
+from cluster import Cluster, MONITOR_HEARTBEAT_INTERVAL
+from metrics import CHECK_DURATION, MONITOR_METRICS_PORT
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from history import HistoryWriter, HISTORY_FLUSH_INTERVAL, utcnow
+from pubsub import PgListener, publish, ENDPOINTS_CHANNEL, STATUS_CHANNEL
+from probing import probe_endpoint, within_slo, PROBE_CONCURRENCY, PROBE_TIMEOUT
+from notifications import (
+    SES_TEMPLATE_NAME,
+    create_ses_template,
+    email_roster,
+    listener_handlers,
+    run_delivery,
+    sms_roster,
+)
+
+logger = logging.getLogger(__name__)
 
 # Load environment variables from a .env file
 load_dotenv()
-encryptor = Encryptor()
-
-# AWS Simple Notification Service (SNS) configuration
-AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
-AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
-SNS_TOPIC_ARN = os.getenv("SNS_TOPIC_ARN")
-
-# Twilio configuration for sending SMS
-TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
-TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
-TWILIO_PHONE_NUMBER = os.getenv("TWILIO_PHONE_NUMBER")
-twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-
-# AWS Simple Email Service (SES) client configuration
-ses_client = boto3.client(
-    "ses",
-    region_name="us-east-1",
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-)
 
-# Variable to store the previous state of the ISP
-previous_state = None
+# Monitor schedule, in seconds
+MONITOR_INTERVAL = float(os.getenv("MONITOR_INTERVAL", "30"))
+PROBE_INTERVAL = float(os.getenv("PROBE_INTERVAL", "30"))
+ENDPOINT_SYNC_INTERVAL = float(os.getenv("ENDPOINT_SYNC_INTERVAL", "5"))
 
-def send_sms_notification(message, recipients):
-    """
-    Sends SMS notifications using Twilio.
-    """
-    for recipient in recipients:
-        decrypted_phone = None
-        try:
-            decrypted_phone = encryptor.decrypt(recipient.encrypted_phone)
-            twilio_client.messages.create(
-                body=message, from_=TWILIO_PHONE_NUMBER, to=decrypted_phone
-            )
-        except Exception as e:
-            print(f"Error sending SMS: {e}, to {decrypted_phone}")
+# Batched writer for probe history and rollups
+history_writer = HistoryWriter(SessionLocal)
+
+# Monitored endpoints, read from the database rather than through the API
+endpoint_provider = EndpointProvider(SessionLocal, PROBE_INTERVAL)
 
+# Probes sent per endpoint each tick; the tick succeeds on the first reply
+PROBE_ATTEMPTS = int(os.getenv("PROBE_ATTEMPTS", "3"))
 
-def generate_unsubscribe_link(token):
+# Hysteresis, quorum and flap suppression deciding the state of each area
+state_engine = AreaStates(DEFAULT_AREA)
+
+# Probe schedules per endpoint owned by this worker
+endpoint_tasks = {}
+
+# Endpoint ownership and leadership among the monitor workers
+cluster = Cluster(SessionLocal, DATABASE_URL)
+
+# Created inside the event loop by main()
+probe_semaphore = None
+
+
+async def probe_and_record(address, spec):
+    """
+    Probes one endpoint and records the result for the next state check.
+    Answers slower than the endpoint's latency SLO count as failures.
     """
-    Generates an unsubscribe link for email notifications.
+    # A single dropped packet should not count as a failed tick
+    for _ in range(PROBE_ATTEMPTS):
+        rtt = await probe_endpoint(
+            address,
+            probe_semaphore,
+            spec.timeout or PROBE_TIMEOUT,
+            spec.type,
+            spec.params,
+        )
+        if rtt is not None:
+            break
+    healthy = within_slo(address, rtt, spec.slo)
+
+    # Removed endpoints may still have a probe in flight
+    if address in endpoint_tasks:
+        state_engine.observe(spec.area, address, healthy)
+        history_writer.record(address, utcnow(), rtt)
+
+
+async def sync_endpoint_tasks():
     """
-    base_url = "http://www.allo.guru/api/unsubscribe"
-    unsubscribe_link = f"{base_url}?token={token}"
-    return unsubscribe_link
+    Starts a probe schedule for each new endpoint this worker owns and stops
+    the schedules of removed or handed-over endpoints; reconfigured endpoints
+    are restarted.
+    """
+    all_endpoints = await asyncio.get_running_loop().run_in_executor(
+        None, endpoint_provider.get
+    )
+    if all_endpoints is None:
+        return
+
+    # The hash ring spreads the endpoints over the live workers
+    endpoints = {
+        address: spec
+        for address, spec in all_endpoints.items()
+        if cluster.owns(address)
+    }
+    probed = set(endpoint_tasks)
+
+    for address in list(endpoint_tasks):
+        spec, task = endpoint_tasks[address]
+        if endpoints.get(address) != spec:
+            task.cancel()
+            del endpoint_tasks[address]
+
+    for address, spec in endpoints.items():
+        if address not in endpoint_tasks:
+            # Taken over from another worker: carry on from its last report
+            if address not in probed and address in cluster.reports:
+                state_engine.seed(spec.area, address, cluster.reports[address])
+            task = asyncio.create_task(
+                run_every(
+                    f"probe {address}",
+                    spec.interval,
+                    lambda address=address, spec=spec: probe_and_record(address, spec),
+                )
+            )
+            endpoint_tasks[address] = (spec, task)
+
+    # Includes endpoints restored from a previous run that are gone now
+    state_engine.prune(all_endpoints)
 
 
-def send_email_notification(subject, message, recipients):
+def read_state():
     """
-    Sends email notifications using Amazon SES.
+    Reads the persisted state engines and the published status of each
+    area.
     """
-    CHARSET = "UTF-8"
     session = scoped_session(SessionLocal)
 
     try:
-        subscribers = session.query(EmailSubscription).all()
-
-        for subscriber in subscribers:
-            decrypted_email = encryptor.decrypt(subscriber.encrypted_email)
-            unsubscribe_token = subscriber.token
-            unsubscribe_link = generate_unsubscribe_link(unsubscribe_token)
-
-            full_message = (
-                f"{message}\n\nTo unsubscribe, please click here: {unsubscribe_link}"
-            )
-
-            try:
-                ses_client.send_email(
-                    Destination={"ToAddresses": [decrypted_email]},
-                    Message={
-                        "Body": {"Text": {"Charset": CHARSET, "Data": full_message}},
-                        "Subject": {"Charset": CHARSET, "Data": subject},
-                    },
-                    Source="alerts@allo.guru",  # Replace with your verified SES email
-                )
-            except Exception as e:
-                print(f"Error sending email to {decrypted_email}: {e}")
-
-    except Exception as e:
-        print(f"Error fetching subscribers: {e}")
+        monitor_state = session.query(MonitorState).filter_by(name="isp").first()
+        statuses = dict(session.query(ServiceStatus.area, ServiceStatus.status))
+        return monitor_state.data if monitor_state else None, statuses
     finally:
         session.remove()
 
 
-async def fetch_isp_endpoints(api_url):
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(api_url) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return data.get(
-                        "endpoints", []
-                    )  # Assuming the API returns a JSON with an 'endpoints' key
-                else:
-                    print(
-                        f"Failed to fetch ISP endpoints. Status code: {response.status}"
-                    )
-                    return None
-        except Exception as e:
-            print(f"Error fetching ISP endpoints: {e}")
-            return None
+def apply_state(data, statuses):
+    """
+    Restores the state engines so a restart, or a new leader, does not
+    re-alert subscribers.
+    """
+    if data:
+        state_engine.restore(data)
+    else:
+        # First run: take the published statuses as already announced
+        state_engine.adopt(statuses)
 
 
-async def check_isp_and_publish(api_url):
+async def heartbeat():
+    """
+    Reports the state of the endpoints probed here and picks up the
+    leader's duties when this worker is elected.
     """
-    Checks the status of ISP endpoints and publishes updates.
+    loop = asyncio.get_running_loop()
+    promoted = await loop.run_in_executor(
+        None, cluster.heartbeat, state_engine.report(endpoint_tasks)
+    )
+    if promoted:
+        # Carry on from what the previous leader last saved, keeping the
+        # fresher state of the endpoints probed here
+        probed = state_engine.report(endpoint_tasks)
+        apply_state(*await loop.run_in_executor(None, read_state))
+        for address, values in probed.items():
+            state_engine.seed(endpoint_tasks[address][0].area, address, values)
+
+
+def save_state(statuses, notifications=()):
     """
-    global previous_state
-    current_state = True
+    Persists the state engines and stores the new status of every area in
+    `statuses`, dropping the status of areas that no longer exist, and
+    tells API workers about it, all in one transaction.
 
+    An (area, status, subject, message, correlation_id) notification is
+    queued in the outbox for every subscriber of its area on the same
+    transaction, so each committed transition is announced exactly once.
+    """
     session = scoped_session(SessionLocal)
 
     try:
-        new_endpoints = await fetch_isp_endpoints(api_url)
-        if new_endpoints:
-            for endpoint in new_endpoints:
-                if not ping(endpoint):
-                    current_state = False
-                    break
-
-        if current_state != previous_state:
-            formatted_timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            subject = "ISP Status Update"
-            message_text = (
-                f"✅ Allo is online! {formatted_timestamp}"
-                if current_state
-                else f"⚠️ Allo is down! {formatted_timestamp}"
+        monitor_state = session.query(MonitorState).filter_by(name="isp").first()
+        if monitor_state:
+            monitor_state.data = state_engine.to_dict()
+        else:
+            session.add(MonitorState(name="isp", data=state_engine.to_dict()))
+
+        for area, status in statuses.items():
+            session.execute(
+                pg_insert(ServiceStatus)
+                .values(area=area, status=status, updated_at=func.now())
+                .on_conflict_do_update(
+                    index_elements=[ServiceStatus.area],
+                    set_={"status": status, "updated_at": func.now()},
+                )
             )
 
-            service_status = session.query(ServiceStatus).first()
-            if service_status:
-                service_status.status = "online" if current_state else "offline"
-                service_status.updated_at = datetime.now()
-            else:
-                new_status = ServiceStatus(
-                    status="online" if current_state else "offline"
+        retired = []
+        if state_engine.areas:
+            retired = (
+                session.execute(
+                    delete(ServiceStatus)
+                    .where(ServiceStatus.area.not_in(list(state_engine.areas)))
+                    .returning(ServiceStatus.area)
                 )
-                session.add(new_status)
-
-            session.commit()
-
-            email_recipients = session.query(EmailSubscription).all()
-            send_email_notification(subject, message_text, email_recipients)
+                .scalars()
+                .all()
+            )
 
-            sms_recipients = session.query(SMSSubscription).all()
-            for recipient in sms_recipients:
-                send_sms_notification(message_text, [recipient])
+        status_changed = bool(statuses or retired)
+        if status_changed:
+            # Delivered to streaming API clients when the update commits
+            publish(session, STATUS_CHANNEL, {"statuses": statuses, "retired": retired})
 
-            previous_state = current_state
+        for notification in notifications:
+            enqueue(session, *notification)
+        if notifications:
+            publish(session, OUTBOX_CHANNEL, {})
 
-    except Exception as e:
-        print(f"Error checking ISP status: {e}")
+        session.commit()
+    except Exception:
         session.rollback()
+        raise
     finally:
         session.remove()
 
+    if status_changed:
+        # Let every API worker drop its cached /api/status response
+        shared_counters.bump("status")
+
+
+def describe_area(area):
+    # Deployments with a single area keep their original wording
+    return "" if area == DEFAULT_AREA else f" in {area}"
+
+
+async def check_isp_and_publish():
+    """
+    Checks the status of each area's ISP endpoints and publishes updates.
+    """
+    # Nothing is known until the endpoints have been loaded at least once;
+    # followers only probe, so transitions are announced once by the leader
+    if endpoint_provider.endpoints is None or not cluster.leader:
+        return
+
+    # Endpoints probed by other workers, as of their last heartbeat
+    endpoints = endpoint_provider.endpoints
+    for address, values in cluster.reports.items():
+        if address not in endpoint_tasks and address in endpoints:
+            state_engine.seed(endpoints[address].area, address, values)
+
+    # Transitions only count as announced once save_state has committed
+    checkpoint = state_engine.to_dict()
+    statuses = {}
+    notifications = []
+    formatted_timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    for area, changed, notify in state_engine.evaluate():
+        if changed:
+            statuses[area] = "online" if state_engine.areas[area].state else "offline"
+            logger.info("Area %s is now %s", area, statuses[area], extra={"area": area})
+        if notify is None:
+            continue
+
+        # Only the subscribers of the area that changed are alerted; the
+        # delivery workers log each batch under the same correlation id
+        with correlation() as correlation_id:
+            status = "online" if notify else "offline"
+            logger.warning(
+                "Notifying subscribers that area %s is %s",
+                area,
+                status,
+                extra={"area": area},
+            )
+        subject = "ISP Status Update"
+        message_text = (
+            f"✅ Allo is online{describe_area(area)}! {formatted_timestamp}"
+            if notify
+            else f"⚠️ Allo is down{describe_area(area)}! {formatted_timestamp}"
+        )
+        notifications.append((area, status, subject, message_text, correlation_id))
+
+    # Delivery workers pick the notifications up from the outbox
+    try:
+        await asyncio.get_running_loop().run_in_executor(
+            None, save_state, statuses, notifications
+        )
+    except Exception:
+        # Evaluated and announced again on the next check
+        state_engine.rollback(checkpoint)
+        raise
+
+
+async def flush_history():
+    await asyncio.get_running_loop().run_in_executor(None, history_writer.flush)
+
+
+async def check_isp_status():
+    with CHECK_DURATION.time():
+        await check_isp_and_publish()
 
-async def main(api_url):
+
+async def main():
     """
-    The main function to run the ISP check loop.
+    The main function to run the ISP monitor.
+
+    Endpoint probes, state checks, history writes and notification
+    delivery each run as independent tasks on their own schedules.
     """
-    while True:
-        await asyncio.sleep(30)  # Wait for 10 seconds before next check
-        await check_isp_and_publish(api_url)
-        print("Checked ISP status")
+    global probe_semaphore
+    probe_semaphore = asyncio.Semaphore(PROBE_CONCURRENCY)
+    loop = asyncio.get_running_loop()
+    apply_state(*await loop.run_in_executor(None, read_state))
+
+    # Join the cluster before taking endpoints so ownership is settled
+    await heartbeat()
+
+    # Endpoint and subscriber changes are pushed by the API as they are
+    # committed; the first connect also loads the rosters
+    PgListener(
+        DATABASE_URL,
+        {ENDPOINTS_CHANNEL: endpoint_provider.on_change, **listener_handlers()},
+    ).start()
+
+    try:
+        await asyncio.gather(
+            run_every("heartbeat", MONITOR_HEARTBEAT_INTERVAL, heartbeat),
+            run_every("endpoint sync", ENDPOINT_SYNC_INTERVAL, sync_endpoint_tasks),
+            run_every("state check", MONITOR_INTERVAL, check_isp_status),
+            run_every("history flush", HISTORY_FLUSH_INTERVAL, flush_history),
+            run_delivery(),
+        )
+    finally:
+        await close_probes()
+        await loop.run_in_executor(None, cluster.leave)
 
 
 if __name__ == "__main__":
-    api_url = "https://allo.guru/api/isp_endpoints"
-    asyncio.run(main(api_url))
+    setup_logging()
+    start_http_server(MONITOR_METRICS_PORT)
+    if SES_TEMPLATE_NAME:
+        create_ses_template()
+    try:
+        asyncio.run(main())
+    finally:
+        # Wipe decrypted addresses before the process exits
+        email_roster.clear()
+        sms_roster.clear()
@@ -0,0 +1,218 @@
+"""
+Load test for the API served by gunicorn.
+
+Starts the app with the production gunicorn settings against the database
+in --database-url (use a scratch database: subscribe and sms add rows), then
+drives each route at a fixed concurrency and reports latency percentiles
+and throughput.
+
+    python -m benchmarks.api_load --database-url postgresql://... \\
+        --concurrency 64 --duration 15
+"""
+
+import os
+import sys
+import time
+import socket
+import asyncio
+import aiohttp
+import argparse
+import tempfile
+import itertools
+import subprocess
+from cryptography.fernet import Fernet
+from benchmarks.common import summarize, write_results
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(args, port, scratch):
+    """
+    Starts the API the way start_services.py does, on a private port.
+    """
+    env = dict(os.environ)
+    env["DATABASE_URL"] = args.database_url
+    env["PROMETHEUS_MULTIPROC_DIR"] = os.path.join(scratch, "metrics")
+    env["CACHE_SHM_PATH"] = os.path.join(scratch, "cache")
+    env["RATE_LIMIT_SHM_PATH"] = os.path.join(scratch, "ratelimit")
+    if not args.rate_limits:
+        # Every request comes from one address, so the limits would dominate
+        env["RATE_LIMIT_ENABLED"] = "false"
+    env.setdefault("SUPERUSER_NAME", "bench")
+    env.setdefault("SUPERUSER_PASSWORD", "bench")
+    env.setdefault("JWT_SECRET_KEY", "bench")
+    if not (env.get("ENCRYPTION_KEYS") or env.get("ENCRYPTION_KEY")):
+        env["ENCRYPTION_KEY"] = Fernet.generate_key().decode()
+    os.makedirs(env["PROMETHEUS_MULTIPROC_DIR"])
+
+    # Workers expect the schema and the superuser to exist when they boot
+    subprocess.run(
+        [sys.executable, "manage.py", "init"], cwd=BACKEND_DIR, env=env, check=True
+    )
+
+    if args.tier == "asgi":
+        env["ASGI_WSGI_THREADS"] = str(args.threads)
+        worker = ["-k", "uvicorn_worker.UvicornWorker", "asgi:app"]
+    else:
+        worker = ["-k", "gthread", "--threads", str(args.threads), "app:app"]
+
+    command = [
+        sys.executable,
+        "-m",
+        "gunicorn",
+        "-c",
+        "gunicorn.conf.py",
+        "-w",
+        str(args.workers),
+        "-b",
+        f"127.0.0.1:{port}",
+        "--log-level",
+        "warning",
+        *worker,
+    ]
+    return subprocess.Popen(command, cwd=BACKEND_DIR, env=env)
+
+
+async def wait_until_ready(base_url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError("gunicorn exited during startup")
+            try:
+                async with session.get(f"{base_url}/api/status") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError("gunicorn did not become ready in time")
+
+
+def scenarios(run_id):
+    """
+    Request factories per route; each call returns (method, path, form data).
+    """
+    counter = itertools.count()
+    return {
+        "status": lambda: ("GET", "/api/status", None),
+        "isp_endpoints": lambda: ("GET", "/api/isp_endpoints", None),
+        "subscribe": lambda: (
+            "POST",
+            "/api/subscribe",
+            {"email": f"bench-{run_id}-{next(counter)}@example.com"},
+        ),
+        "sms": lambda: (
+            "POST",
+            "/api/sms",
+            {"Body": "SUBSCRIBE", "From": f"+1{run_id % 1000:03d}{next(counter):07d}"},
+        ),
+    }
+
+
+async def drive(base_url, make_request, concurrency, duration, warmup):
+    """
+    Runs `concurrency` clients back to back for `duration` seconds after a
+    warm-up, recording the latency of every completed request.
+    """
+    latencies = []
+    errors = 0
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+
+        async def client(until, record):
+            nonlocal errors
+            while time.monotonic() < until:
+                method, path, data = make_request()
+                started = time.perf_counter()
+                try:
+                    async with session.request(
+                        method, base_url + path, data=data
+                    ) as response:
+                        await response.read()
+                        ok = response.status < 400
+                except aiohttp.ClientError:
+                    ok = False
+                if record:
+                    latencies.append(time.perf_counter() - started)
+                    errors += not ok
+
+        if warmup:
+            until = time.monotonic() + warmup
+            await asyncio.gather(*(client(until, False) for _ in range(concurrency)))
+
+        started = time.monotonic()
+        until = started + duration
+        await asyncio.gather(*(client(until, True) for _ in range(concurrency)))
+        elapsed = time.monotonic() - started
+
+    return summarize(latencies, elapsed, errors)
+
+
+async def run(args):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    run_id = int(time.time())
+    factories = scenarios(run_id)
+
+    with tempfile.TemporaryDirectory() as scratch:
+        process = start_gunicorn(args, port, scratch)
+        try:
+            await wait_until_ready(base_url, process)
+            results = {}
+            for route in args.routes:
+                results[route] = await drive(
+                    base_url,
+                    factories[route],
+                    args.concurrency,
+                    args.duration,
+                    args.warmup,
+                )
+                print(f"{route}: {results[route]}")
+            return results
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the API under gunicorn.")
+    parser.add_argument(
+        "--database-url",
+        default=os.getenv("BENCH_DATABASE_URL"),
+        help="Scratch PostgreSQL database (default: $BENCH_DATABASE_URL)",
+    )
+    parser.add_argument(
+        "--routes",
+        type=lambda value: value.split(","),
+        default=["status", "isp_endpoints", "subscribe", "sms"],
+    )
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument(
+        "--tier",
+        choices=["asgi", "wsgi"],
+        default="asgi",
+        help="Uvicorn workers serving asgi:app, or gthread workers serving app:app",
+    )
+    parser.add_argument(
+        "--rate-limits", action="store_true", help="Keep the API rate limits on"
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=64)
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/)")
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("--database-url or BENCH_DATABASE_URL is required")
+
+    results = asyncio.run(run(args))
+    params = {key: value for key, value in vars(args).items() if key != "database_url"}
+    write_results("api_load", params, results, args.output)
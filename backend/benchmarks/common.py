@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import random
+import platform
+import threading
+import subprocess
+from urllib.parse import parse_qs
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Where results are written unless --output is given
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def percentile(values, q):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, round(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+def summarize(latencies, elapsed, errors=0):
+    """
+    Summarises request latencies, in seconds, measured over `elapsed` seconds.
+    """
+    latencies = sorted(latencies)
+
+    def in_ms(value):
+        return None if value is None else round(value * 1000, 3)
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": in_ms(percentile(latencies, 50)),
+        "p90_ms": in_ms(percentile(latencies, 90)),
+        "p99_ms": in_ms(percentile(latencies, 99)),
+        "max_ms": in_ms(latencies[-1] if latencies else None),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def write_results(name, params, results, output=None):
+    """
+    Stores one run as JSON, alongside what is needed to compare it with others.
+    """
+    started = datetime.now(timezone.utc)
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(
+            RESULTS_DIR, f"{name}-{started.strftime('%Y%m%dT%H%M%S')}.json"
+        )
+
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "benchmark": name,
+                "timestamp": started.isoformat(),
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cpus": os.cpu_count(),
+                "params": params,
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Results written to {output}")
+    return output
+
+
+class StubProviders:
+    """
+    Local HTTP server standing in for both Twilio and Amazon SES.
+
+    Point TWILIO_BASE_URL and SES_ENDPOINT_URL at `url`. Every call waits
+    `latency` seconds and fails with probability `failure_rate`.
+    """
+
+    def __init__(self, latency=0.0, failure_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.lock = threading.Lock()
+        self.sms = 0
+        self.emails = 0
+        self.calls = 0
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True  # Or keep-alive replies stall on ACKs
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                form = parse_qs(self.rfile.read(length).decode())
+                stub.handle(self, form)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def respond(self, handler, status, content_type, body):
+        body = body.encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def handle(self, handler, form):
+        if self.latency:
+            time.sleep(self.latency)
+        failed = random.random() < self.failure_rate
+
+        with self.lock:
+            self.calls += 1
+
+        if handler.path.endswith("/Messages.json"):
+            if failed:
+                self.respond(
+                    handler,
+                    500,
+                    "application/json",
+                    json.dumps({"code": 20500, "message": "Stub failure"}),
+                )
+                return
+            with self.lock:
+                self.sms += 1
+            self.respond(
+                handler,
+                201,
+                "application/json",
+                json.dumps({"sid": f"SM{self.sms:032d}", "status": "queued"}),
+            )
+            return
+
+        action = form.get("Action", [""])[0]
+        if failed:
+            self.respond(
+                handler,
+                500,
+                "text/xml",
+                "<ErrorResponse><Error><Type>Receiver</Type>"
+                "<Code>InternalFailure</Code><Message>Stub failure</Message>"
+                "</Error></ErrorResponse>",
+            )
+            return
+
+        if action == "SendBulkTemplatedEmail":
+            count = sum(
+                1
+                for key in form
+                if key.startswith("Destinations.member.")
+                and key.endswith(".Destination.ToAddresses.member.1")
+            )
+            with self.lock:
+                self.emails += count
+            statuses = "".join(
+                f"<member><Status>Success</Status><MessageId>{i}</MessageId></member>"
+                for i in range(count)
+            )
+            body = (
+                f"<SendBulkTemplatedEmailResponse><SendBulkTemplatedEmailResult>"
+                f"<Status>{statuses}</Status>"
+                f"</SendBulkTemplatedEmailResult></SendBulkTemplatedEmailResponse>"
+            )
+        else:
+            with self.lock:
+                self.emails += 1
+            body = (
+                "<SendEmailResponse><SendEmailResult><MessageId>stub</MessageId>"
+                "</SendEmailResult></SendEmailResponse>"
+            )
+        self.respond(handler, 200, "text/xml", body)
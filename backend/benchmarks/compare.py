@@ -0,0 +1,53 @@
+"""
+Compares two benchmark result files.
+
+    python -m benchmarks.compare benchmarks/results/old.json new.json
+"""
+
+import sys
+import json
+
+# Metrics where a larger value is an improvement
+HIGHER_IS_BETTER = {"rps", "per_second"}
+
+
+def flatten(results, prefix=""):
+    """
+    Yields (path, value) for every number in a nested result dict.
+    """
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from flatten(value, f"{path}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield path, value
+
+
+def compare(old, new):
+    old_values = dict(flatten(old["results"]))
+    rows = []
+    for path, value in flatten(new["results"]):
+        before = old_values.get(path)
+        if before is None:
+            continue
+        change = (value - before) / before * 100 if before else 0.0
+        better = (
+            change > 0 if path.rsplit(".", 1)[-1] in HIGHER_IS_BETTER else change < 0
+        )
+        flag = "" if abs(change) < 5 else (" better" if better else " WORSE")
+        rows.append(f"{path:45} {before:>12} {value:>12} {change:+8.1f}%{flag}")
+    return rows
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("usage: python -m benchmarks.compare OLD.json NEW.json")
+
+    with open(sys.argv[1]) as f:
+        old = json.load(f)
+    with open(sys.argv[2]) as f:
+        new = json.load(f)
+
+    print(f"{old['benchmark']}: {old['commit']} -> {new['commit']}")
+    for row in compare(old, new):
+        print(row)
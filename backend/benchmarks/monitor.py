@@ -0,0 +1,251 @@
+"""
+Micro-benchmarks for the monitor's alert path.
+
+For each subscriber count, seeds the database in --database-url, loads the
+rosters, times steady-state and transition runs of check_isp_and_publish
+with fake endpoints, then drains the outbox through stub SES and Twilio
+servers. The subscription and outbox tables are TRUNCATED, so only point
+this at a scratch database.
+
+    python -m benchmarks.monitor --database-url postgresql://... \\
+        --subscribers 10000,100000
+"""
+
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+from cryptography.fernet import Fernet
+from benchmarks.common import StubProviders, summarize, write_results
+
+# Tables rewritten by each run
+BENCH_TABLES = [
+    "notification_outbox",
+    "status_transitions",
+    "monitor_state",
+    "email_subscriptions",
+    "sms_subscriptions",
+]
+
+
+def configure(args, stub):
+    """
+    Points the monitor at the scratch database and the stub providers.
+
+    Must run before the monitor modules are imported, as they read their
+    settings at import time.
+    """
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ["CACHE_SHM_PATH"] = os.path.join(tempfile.mkdtemp(), "cache")
+    os.environ["TWILIO_BASE_URL"] = stub.url
+    os.environ["SES_ENDPOINT_URL"] = stub.url
+    os.environ.setdefault("TWILIO_ACCOUNT_SID", "AC" + "0" * 32)
+    os.environ.setdefault("TWILIO_AUTH_TOKEN", "bench")
+    os.environ.setdefault("TWILIO_PHONE_NUMBER", "+15550000000")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+    os.environ["SES_RATE_LIMIT"] = str(args.rate_limit)
+    os.environ["TWILIO_RATE_LIMIT"] = str(args.rate_limit)
+    if args.template:
+        os.environ["SES_TEMPLATE_NAME"] = "bench"
+    if not (os.getenv("ENCRYPTION_KEYS") or os.getenv("ENCRYPTION_KEY")):
+        os.environ["ENCRYPTION_KEY"] = Fernet.generate_key().decode()
+
+
+def seed(subscribers, sms_share, batch_size=5000):
+    """
+    Replaces the subscription tables with `subscribers` fake subscribers.
+    """
+    from manage import migrate
+    from sqlalchemy import insert, text
+    from config import SessionLocal
+    from notifications import encryptor
+    from models import EmailSubscription, SMSSubscription
+
+    migrate()
+    session = SessionLocal()
+    try:
+        session.execute(
+            text(f"TRUNCATE {', '.join(BENCH_TABLES)} RESTART IDENTITY CASCADE")
+        )
+        sms_count = int(subscribers * sms_share)
+        channels = [
+            (EmailSubscription, "email", subscribers - sms_count),
+            (SMSSubscription, "phone", sms_count),
+        ]
+        for model, kind, count in channels:
+            for start in range(0, count, batch_size):
+                if kind == "email":
+                    addresses = [
+                        f"bench-{i}@example.com"
+                        for i in range(start, min(count, start + batch_size))
+                    ]
+                else:
+                    addresses = [
+                        f"+1555{i:07d}"
+                        for i in range(start, min(count, start + batch_size))
+                    ]
+                encrypted = encryptor.encrypt_many(addresses)
+                session.execute(
+                    insert(model),
+                    [
+                        {
+                            "token": f"{kind}-{start + i}",
+                            f"encrypted_{kind}": value,
+                            f"{kind}_hash": f"{kind}-{start + i}",
+                        }
+                        for i, value in enumerate(encrypted)
+                    ],
+                )
+        session.commit()
+    finally:
+        session.close()
+
+
+def fake_endpoints(monitor, count):
+    """
+    Installs `count` fake endpoints, all up, with the ISP announced online.
+    """
+    from endpoints import DEFAULT_AREA, ProbeSpec
+
+    addresses = [f"192.0.2.{i + 1}" for i in range(count)]
+    monitor.endpoint_provider.endpoints = {
+        address: ProbeSpec(30) for address in addresses
+    }
+
+    # Every fake endpoint and subscriber is in the default area
+    monitor.state_engine.areas = {}
+    engine = monitor.state_engine.engine(DEFAULT_AREA)
+    for address in addresses:
+        for _ in range(engine.up_threshold):
+            engine.observe(address, True)
+    engine.evaluate()
+    engine.state = engine.notified_state = True
+
+    # A single bench process evaluates as the leader of its own cluster
+    monitor.cluster.leader = True
+
+    # Earlier runs must not count towards flap suppression
+    engine.penalty = 0.0
+    engine.suppressed = False
+    return addresses
+
+
+async def drain_outbox(notifications):
+    """
+    Delivers every message that is due, one worker per channel as in
+    production. Messages failed by the stub wait for their retry and are
+    not drained again.
+    """
+
+    async def drain(channel):
+        total = 0
+        while True:
+            claimed = await notifications.deliver_batch(channel)
+            if not claimed:
+                return total
+            total += claimed
+
+    email, sms = await asyncio.gather(drain("email"), drain("sms"))
+    return email + sms
+
+
+async def bench(args, subscribers, stub):
+    import notifications
+    import asyncio_script as monitor
+
+    seed(subscribers, args.sms_share)
+
+    started = time.perf_counter()
+    notifications.load_rosters()
+    roster_load = time.perf_counter() - started
+
+    addresses = fake_endpoints(monitor, args.endpoints)
+    engine = monitor.state_engine.engine(monitor.DEFAULT_AREA)
+
+    # Steady state: every endpoint up, nothing to announce
+    latencies = []
+    for _ in range(args.iterations):
+        for address in addresses:
+            engine.observe(address, True)
+        started = time.perf_counter()
+        await monitor.check_isp_and_publish()
+        latencies.append(time.perf_counter() - started)
+    steady = summarize(latencies, sum(latencies))
+
+    # Transition: every endpoint down, one alert queued per subscriber
+    for _ in range(engine.down_threshold):
+        for address in addresses:
+            engine.observe(address, False)
+    started = time.perf_counter()
+    await monitor.check_isp_and_publish()
+    transition = time.perf_counter() - started
+
+    stub_calls = stub.calls
+    started = time.perf_counter()
+    delivered = await drain_outbox(notifications)
+    delivery = time.perf_counter() - started
+
+    notifications.email_roster.clear()
+    notifications.sms_roster.clear()
+
+    return {
+        "roster_load_s": round(roster_load, 3),
+        "check_steady": steady,
+        "check_transition_s": round(transition, 3),
+        "delivery": {
+            "messages": delivered,
+            "elapsed_s": round(delivery, 3),
+            "per_second": round(delivered / delivery, 1) if delivery else None,
+            "provider_calls": stub.calls - stub_calls,
+        },
+    }
+
+
+async def run(args):
+    stub = StubProviders(args.provider_latency, args.failure_rate).start()
+    configure(args, stub)
+
+    results = {}
+    try:
+        for subscribers in args.subscribers:
+            results[str(subscribers)] = await bench(args, subscribers, stub)
+            print(f"{subscribers} subscribers: {results[str(subscribers)]}")
+    finally:
+        stub.stop()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the monitor's alert path against stub providers."
+    )
+    parser.add_argument(
+        "--database-url",
+        default=os.getenv("BENCH_DATABASE_URL"),
+        help="Scratch PostgreSQL database, truncated by every run "
+        "(default: $BENCH_DATABASE_URL)",
+    )
+    parser.add_argument(
+        "--subscribers",
+        type=lambda value: [int(n) for n in value.split(",")],
+        default=[10000, 100000],
+    )
+    parser.add_argument("--sms-share", type=float, default=0.2)
+    parser.add_argument("--endpoints", type=int, default=10)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--rate-limit", type=float, default=1000000)
+    parser.add_argument("--provider-latency", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--template", action="store_true", help="Use SES bulk templated sends"
+    )
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/)")
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("--database-url or BENCH_DATABASE_URL is required")
+
+    results = asyncio.run(run(args))
+    params = {key: value for key, value in vars(args).items() if key != "database_url"}
+    write_results("monitor", params, results, args.output)
@@ -0,0 +1,201 @@
+import os
+import time
+import fcntl
+import struct
+import hashlib
+import tempfile
+import threading
+from datetime import datetime
+from shm import open_shared_map
+from collections import OrderedDict
+
+# Cache configuration
+CACHE_TTL = float(os.getenv("CACHE_TTL", "300"))
+CACHE_SHM_PATH = os.getenv(
+    "CACHE_SHM_PATH",
+    os.path.join(
+        "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+        "allo_guru_cache",
+    ),
+)
+
+# Superusers confirmed against the database are trusted for this long
+IDENTITY_CACHE_TTL = float(os.getenv("IDENTITY_CACHE_TTL", "60"))
+IDENTITY_CACHE_SIZE = int(os.getenv("IDENTITY_CACHE_SIZE", "128"))
+
+# Names of the shared generation counters; only ever append to this list
+CACHE_KEYS = ["status", "isp_endpoints", "superusers"]
+
+COUNTER = struct.Struct("<Q")
+
+
+class SharedCounters:
+    """
+    Array of 64-bit counters in a memory-mapped file, shared by every
+    process on the host (gunicorn workers and the monitor).
+    """
+
+    def __init__(self, path, names):
+        self.path = path
+        self.names = list(names)
+        self.size = COUNTER.size * len(self.names)
+        self.fd = None
+        self.buffer = None
+        self.lock = threading.Lock()
+
+    def _map(self):
+        # Mapped lazily so each forked worker gets its own mapping
+        if self.buffer is None:
+            with self.lock:
+                if self.buffer is None:
+                    self.fd, self.buffer = open_shared_map(self.path, self.size)
+        return self.buffer
+
+    def _offset(self, name):
+        return COUNTER.size * self.names.index(name)
+
+    def get(self, name):
+        return COUNTER.unpack_from(self._map(), self._offset(name))[0]
+
+    def bump(self, name):
+        buffer = self._map()
+        offset = self._offset(name)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            value = COUNTER.unpack_from(buffer, offset)[0] + 1
+            COUNTER.pack_into(buffer, offset, value)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        return value
+
+
+class CachedResponse:
+    __slots__ = ("body", "etag", "last_modified", "generation", "expires_at")
+
+    def __init__(self, body, last_modified, generation, expires_at):
+        self.body = body
+        self.etag = hashlib.sha1(body.encode()).hexdigest()
+        self.last_modified = last_modified
+        self.generation = generation
+        self.expires_at = expires_at
+
+
+class ResponseCache:
+    """
+    Read-through cache of serialized responses.
+
+    Entries expire after the TTL, or as soon as any process bumps the
+    shared generation counter for their key.
+    """
+
+    def __init__(self, counters, ttl=CACHE_TTL):
+        self.counters = counters
+        self.ttl = ttl
+        self.entries = {}
+
+    def lookup(self, key):
+        """
+        Returns (entry, generation), with entry set to None when it is
+        missing or stale.
+
+        The generation is read before any reload so that a bump racing
+        with the reload forces another one.
+        """
+        generation = self.counters.get(key)
+        entry = self.entries.get(key)
+        if (
+            entry is not None
+            and entry.generation == generation
+            and entry.expires_at > time.monotonic()
+        ):
+            return entry, generation
+        return None, generation
+
+    def store(self, key, generation, body, last_modified):
+        """
+        Caches a freshly loaded body under the generation read by lookup().
+        """
+        entry = CachedResponse(
+            body,
+            last_modified or datetime.utcnow(),
+            generation,
+            time.monotonic() + self.ttl,
+        )
+        self.entries[key] = entry
+        return entry
+
+    def get(self, key, loader):
+        """
+        Returns the cached entry for key, calling loader() on a miss.
+
+        The loader returns a (body, last_modified) tuple.
+        """
+        entry, generation = self.lookup(key)
+        if entry is None:
+            entry = self.store(key, generation, *loader())
+        return entry
+
+    def discard(self, key):
+        """
+        Drops the entry for key in this process only.
+        """
+        self.entries.pop(key, None)
+
+    def invalidate(self, key):
+        """
+        Drops the entry for key in every process sharing the counters.
+        """
+        self.discard(key)
+        self.counters.bump(key)
+
+
+class IdentityCache:
+    """
+    Small LRU of identities recently confirmed against the database.
+
+    Entries expire after the TTL, and all of them are dropped as soon as
+    any process bumps the shared generation counter for the key.
+    """
+
+    def __init__(self, counters, key, ttl=IDENTITY_CACHE_TTL, size=IDENTITY_CACHE_SIZE):
+        self.counters = counters
+        self.key = key
+        self.ttl = ttl
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def lookup(self, identity):
+        """
+        Returns (known, generation); as with ResponseCache.lookup(), the
+        generation is read before the database is.
+        """
+        generation = self.counters.get(self.key)
+        with self.lock:
+            entry = self.entries.get(identity)
+            if entry is None:
+                return False, generation
+            entry_generation, expires_at = entry
+            if entry_generation != generation or expires_at <= time.monotonic():
+                del self.entries[identity]
+                return False, generation
+            self.entries.move_to_end(identity)
+        return True, generation
+
+    def add(self, identity, generation):
+        with self.lock:
+            self.entries[identity] = (generation, time.monotonic() + self.ttl)
+            self.entries.move_to_end(identity)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self):
+        """
+        Forgets every identity in every process sharing the counters.
+        """
+        with self.lock:
+            self.entries.clear()
+        self.counters.bump(self.key)
+
+
+shared_counters = SharedCounters(CACHE_SHM_PATH, CACHE_KEYS)
@@ -0,0 +1,186 @@
+import os
+import socket
+import logging
+import psycopg2
+from hashring import HashRing
+from models import MonitorWorker
+from sqlalchemy import Float, bindparam, delete, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+logger = logging.getLogger(__name__)
+
+# Workers heartbeat this often and are presumed dead after the TTL; both
+# together bound failover, so keep their sum under one probe interval
+MONITOR_HEARTBEAT_INTERVAL = float(os.getenv("MONITOR_HEARTBEAT_INTERVAL", "5"))
+MONITOR_MEMBER_TTL = float(os.getenv("MONITOR_MEMBER_TTL", "15"))
+MONITOR_WORKER_ID = (
+    os.getenv("MONITOR_WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+)
+
+# Session advisory lock held by the leader's dedicated connection
+LEADER_LOCK_ID = 0x616C6C6F
+
+# Rows of workers gone this many TTLs are deleted by the leader
+MEMBER_RETENTION = 20
+
+
+class LeaderLock:
+    """
+    PostgreSQL session advisory lock on a dedicated connection.
+
+    PostgreSQL releases the lock as soon as the connection ends, so a
+    crashed leader frees it for the next worker that asks.
+    """
+
+    def __init__(self, dsn, lock_id=LEADER_LOCK_ID):
+        self.dsn = dsn
+        self.lock_id = lock_id
+        self.connection = None
+        self.held = False
+
+    def hold(self):
+        """
+        Takes the lock if it is free, or checks it is still held. Returns
+        whether this process holds it.
+        """
+        try:
+            if self.connection is None:
+                self.connection = psycopg2.connect(self.dsn)
+                self.connection.set_isolation_level(
+                    psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT
+                )
+            with self.connection.cursor() as cursor:
+                if self.held:
+                    # The lock lives as long as this connection does
+                    cursor.execute("SELECT 1")
+                else:
+                    cursor.execute("SELECT pg_try_advisory_lock(%s)", (self.lock_id,))
+                    self.held = cursor.fetchone()[0]
+        except psycopg2.Error as e:
+            logger.warning("Leader lock connection lost: %s", e)
+            self.release()
+        return self.held
+
+    def release(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except psycopg2.Error:
+                pass
+        self.connection = None
+        self.held = False
+
+
+class Cluster:
+    """
+    Membership, endpoint ownership and leadership of the monitor workers.
+
+    Every worker probes the endpoints the hash ring assigns to it and
+    reports their hysteresis state with its heartbeat. The leader merges
+    the reports, evaluates the ISP state and alone triggers notifications.
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        dsn,
+        worker_id=MONITOR_WORKER_ID,
+        member_ttl=MONITOR_MEMBER_TTL,
+    ):
+        self.session_factory = session_factory
+        self.worker_id = worker_id
+        self.member_ttl = member_ttl
+        self.lock = LeaderLock(dsn)
+        self.members = [worker_id]
+        self.ring = HashRing(self.members)
+        self.reports = {}
+        self.leader = False
+
+    def owns(self, address):
+        return self.ring.owner(address) == self.worker_id
+
+    def heartbeat(self, report):
+        """
+        Publishes this worker's endpoint states, then refreshes leadership,
+        membership and the merged reports of every worker.
+
+        `report` maps addresses to [up, failures, successes]. Returns
+        whether this worker just became the leader.
+        """
+        was_leader = self.leader
+        self.leader = self.lock.hold()
+
+        ttl = bindparam("ttl", self.member_ttl, type_=Float)
+        session = self.session_factory()
+        try:
+            session.execute(
+                pg_insert(MonitorWorker)
+                .values(
+                    worker_id=self.worker_id,
+                    heartbeat_at=func.now(),
+                    leader=self.leader,
+                    endpoints=report,
+                )
+                .on_conflict_do_update(
+                    index_elements=[MonitorWorker.worker_id],
+                    set_={
+                        "heartbeat_at": func.now(),
+                        "leader": self.leader,
+                        "endpoints": report,
+                    },
+                )
+            )
+            rows = session.execute(
+                select(
+                    MonitorWorker.worker_id,
+                    MonitorWorker.endpoints,
+                    MonitorWorker.heartbeat_at
+                    > func.now() - func.make_interval(0, 0, 0, 0, 0, 0, ttl),
+                ).order_by(MonitorWorker.heartbeat_at)
+            ).all()
+            if self.leader:
+                session.execute(
+                    delete(MonitorWorker).where(
+                        MonitorWorker.heartbeat_at
+                        < func.now()
+                        - func.make_interval(0, 0, 0, 0, 0, 0, ttl * MEMBER_RETENTION)
+                    )
+                )
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+        members = sorted(worker_id for worker_id, _, alive in rows if alive)
+        if members != self.members:
+            logger.info("Monitor workers: %s", ", ".join(members))
+            self.members = members
+            self.ring = HashRing(members)
+
+        # Oldest first, so the latest report of each endpoint wins; reports
+        # of dead workers seed whoever takes their endpoints over
+        reports = {}
+        for _, endpoints, _ in rows:
+            reports.update(endpoints)
+        self.reports = reports
+
+        if self.leader and not was_leader:
+            logger.info("Monitor worker %s is now the leader", self.worker_id)
+        return self.leader and not was_leader
+
+    def leave(self):
+        """
+        Hands this worker's endpoints and leadership over without waiting
+        for the TTL.
+        """
+        self.lock.release()
+        session = self.session_factory()
+        try:
+            session.execute(
+                delete(MonitorWorker).where(MonitorWorker.worker_id == self.worker_id)
+            )
+            session.commit()
+        finally:
+            session.close()
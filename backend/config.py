@@ -1,7 +1,14 @@
 import os
+import time
+import threading
+from sqlalchemy import event
 from dotenv import load_dotenv
+from metrics import track_db_time
 from sqlalchemy import create_engine
-from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from metrics import POOL_CHECKED_OUT, POOL_OVERFLOW_EVENTS, POOL_TIMEOUTS, POOL_WAIT
 
 load_dotenv()
 
@@ -12,17 +19,163 @@ POSTGRES_USER = os.getenv("POSTGRES_USER")
 POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD")
 POSTGRES_DB = os.getenv("POSTGRES_DB")
 
-# Database URL
-DATABASE_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+# Connection pool configuration, per process
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
 
-# Create SQLAlchemy engine
-engine = create_engine(DATABASE_URL)
+# Database URL; DATABASE_URL overrides the POSTGRES_* settings, e.g. to run
+# benchmarks against a scratch database
+DATABASE_URL = (
+    os.getenv("DATABASE_URL")
+    or f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+)
+
+
+class PoolStats:
+    """
+    Counters describing how the connection pool is being used.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connects = 0
+        self.invalidations = 0
+        self.overflow_events = 0
+        self.timeouts = 0
+        self.waits = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def record_wait(self, seconds, overflowed, timed_out):
+        with self.lock:
+            self.waits += 1
+            self.wait_time_total += seconds
+            self.wait_time_max = max(self.wait_time_max, seconds)
+            if overflowed:
+                self.overflow_events += 1
+            if timed_out:
+                self.timeouts += 1
+
+        POOL_WAIT.observe(seconds)
+        if overflowed:
+            POOL_OVERFLOW_EVENTS.inc()
+        if timed_out:
+            POOL_TIMEOUTS.inc()
+
+    def snapshot(self, pool):
+        with self.lock:
+            return {
+                "pid": os.getpid(),
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                "overflow": max(pool.overflow(), 0),
+                "max_overflow": DB_MAX_OVERFLOW,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "overflow_events": self.overflow_events,
+                "timeouts": self.timeouts,
+                "checkouts": self.waits,
+                "wait_time_total": round(self.wait_time_total, 6),
+                "wait_time_max": round(self.wait_time_max, 6),
+            }
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool that records how long each checkout waited for a connection
+    and whether it had to open an overflow connection.
+    """
+
+    def _do_get(self):
+        overflow = self.overflow()
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            timed_out = True
+            raise
+        finally:
+            pool_stats.record_wait(
+                time.perf_counter() - start,
+                self.overflow() > max(overflow, 0),
+                timed_out,
+            )
+
+
+# Created by get_engine() on first use, so importing this module neither
+# opens a connection nor fails while the database is unreachable
+engine = None
+engine_lock = threading.Lock()
 
-# Session maker bound to the engine
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-# Base class for declarative models
-Base = declarative_base()
+def on_connect(dbapi_connection, connection_record):
+    with pool_stats.lock:
+        pool_stats.connects += 1
 
-# Create all tables in the database
-Base.metadata.create_all(bind=engine)
+
+def on_checkout(dbapi_connection, connection_record, connection_proxy):
+    POOL_CHECKED_OUT.inc()
+
+
+def on_checkin(dbapi_connection, connection_record):
+    POOL_CHECKED_OUT.dec()
+
+
+def on_invalidate(dbapi_connection, connection_record, exception):
+    with pool_stats.lock:
+        pool_stats.invalidations += 1
+
+
+def get_engine():
+    """
+    Returns this process's engine, creating it on the first call. Creating
+    it does not connect; the pool opens connections as sessions need them.
+    """
+    global engine
+    if engine is None:
+        with engine_lock:
+            if engine is None:
+                new_engine = create_engine(
+                    DATABASE_URL,
+                    poolclass=InstrumentedQueuePool,
+                    pool_size=DB_POOL_SIZE,
+                    max_overflow=DB_MAX_OVERFLOW,
+                    pool_timeout=DB_POOL_TIMEOUT,
+                    pool_recycle=DB_POOL_RECYCLE,
+                    pool_pre_ping=DB_POOL_PRE_PING,
+                    connect_args={
+                        "options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+                    },
+                )
+                event.listen(new_engine, "connect", on_connect)
+                event.listen(new_engine, "checkout", on_checkout)
+                event.listen(new_engine, "checkin", on_checkin)
+                event.listen(new_engine, "invalidate", on_invalidate)
+                # Attribute database time to the request that spent it
+                track_db_time(new_engine)
+                engine = new_engine
+    return engine
+
+
+class LazySessionmaker(sessionmaker):
+    """
+    sessionmaker that binds to get_engine() when the first session is made.
+    """
+
+    def __call__(self, **local_kw):
+        if self.kw.get("bind") is None:
+            self.configure(bind=get_engine())
+        return super().__call__(**local_kw)
+
+
+# Session maker bound to the engine
+SessionLocal = LazySessionmaker(autocommit=False, autoflush=False)
@@ -0,0 +1,150 @@
+import os
+import time
+import random
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+# Dispatch configuration
+NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", "16"))
+
+# Provider clients are blocking, so sends run on a bounded thread pool
+dispatch_executor = ThreadPoolExecutor(
+    max_workers=NOTIFY_CONCURRENCY, thread_name_prefix="dispatch"
+)
+
+
+class TokenBucket:
+    """
+    Token bucket used to keep sends under a provider's rate limit.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    async def acquire(self, tokens=1):
+        # Waiters are served in order so large batches are not starved
+        async with self.lock:
+            self._refill()
+            needed = min(tokens, self.capacity)
+            while self.tokens < needed:
+                await asyncio.sleep((needed - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= tokens
+
+            # Requests larger than the bucket drain it, then wait for the
+            # rest, so they are charged in full
+            if self.tokens < 0:
+                await asyncio.sleep(-self.tokens / self.rate)
+                self._refill()
+
+
+class DispatchReport:
+    """
+    Per-recipient outcome of a notification dispatch.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.sent = []
+        self.failed = []
+
+    def record(self, recipient, error=None):
+        if error is None:
+            self.sent.append(recipient)
+        else:
+            self.failed.append((recipient, str(error)))
+
+    def __repr__(self):
+        return (
+            f"<DispatchReport {self.channel}: "
+            f"{len(self.sent)} sent, {len(self.failed)} failed>"
+        )
+
+
+def backoff(attempts, base, cap, rng=random.random):
+    """
+    Returns the delay before retrying after `attempts` failed attempts.
+
+    The delay is drawn uniformly up to an exponentially growing ceiling so
+    retries from many recipients do not hit the provider in lockstep.
+    """
+    return rng() * min(cap, base * 2 ** (attempts - 1))
+
+
+def batched(items, size):
+    """
+    Groups an iterable into lists of at most `size` items.
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def dispatch(
+    channel,
+    recipients,
+    send_batch,
+    bucket,
+    batch_size=1,
+    concurrency=NOTIFY_CONCURRENCY,
+):
+    """
+    Fans recipients out to a pool of workers.
+
+    Each recipient must be a tuple whose first element identifies it in the
+    report. `send_batch` is called on the thread pool with a list of at most
+    `batch_size` recipients and returns a list of (recipient_id, error)
+    pairs, with error set to None on success.
+    """
+    loop = asyncio.get_running_loop()
+    report = DispatchReport(channel)
+
+    # A bounded queue keeps memory flat however many recipients there are
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def worker():
+        while True:
+            batch = await queue.get()
+            try:
+                if batch is None:
+                    return
+                await bucket.acquire(len(batch))
+                try:
+                    results = await loop.run_in_executor(
+                        dispatch_executor, send_batch, batch
+                    )
+                except Exception as e:
+                    results = [(recipient[0], e) for recipient in batch]
+                for recipient_id, error in results:
+                    report.record(recipient_id, error)
+            finally:
+                queue.task_done()
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        for batch in batched(recipients, batch_size):
+            await queue.put(batch)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+
+    return report
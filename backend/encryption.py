@@ -1,16 +1,80 @@
 import os
 from dotenv import load_dotenv
-from cryptography.fernet import Fernet
+from concurrent.futures import ProcessPoolExecutor
+from cryptography.fernet import Fernet, MultiFernet
 
 load_dotenv()
 
+# Process pool used by the *_many methods for large inputs; 0 runs them inline
+ENCRYPTION_PROCESSES = int(os.getenv("ENCRYPTION_PROCESSES", "0"))
+ENCRYPTION_CHUNK_SIZE = int(os.getenv("ENCRYPTION_CHUNK_SIZE", "1000"))
+
+process_pool = None
+
+
+def load_keys():
+    """
+    Returns the keyring, newest key first.
+
+    ENCRYPTION_KEYS holds comma-separated keys for rotation; the first one
+    encrypts and all of them decrypt. ENCRYPTION_KEY alone still works.
+    """
+    keys = os.getenv("ENCRYPTION_KEYS") or os.getenv("ENCRYPTION_KEY")
+    return [key.strip() for key in keys.split(",") if key.strip()]
+
+
+def crypt_chunk(keys, method, chunk):
+    # Runs in a worker process, so the keyring is passed rather than pickled
+    fernet = MultiFernet([Fernet(key.encode()) for key in keys])
+    operation = getattr(fernet, method)
+    return [operation(item.encode()).decode() for item in chunk]
+
+
 class Encryptor:
-    def __init__(self):
-        self.key = os.getenv("ENCRYPTION_KEY").encode()
-        self.fernet = Fernet(self.key)
+    def __init__(self, keys=None):
+        self.keys = keys or load_keys()
+        self.key = self.keys[0].encode()
+        self.fernet = MultiFernet([Fernet(key.encode()) for key in self.keys])
 
     def encrypt(self, data: str) -> str:
         return self.fernet.encrypt(data.encode()).decode()
 
     def decrypt(self, data: str) -> str:
         return self.fernet.decrypt(data.encode()).decode()
+
+    def rotate(self, data: str) -> str:
+        """
+        Re-encrypts a token under the primary key.
+        """
+        return self.fernet.rotate(data.encode()).decode()
+
+    def _many(self, method, items, processes):
+        items = list(items)
+        processes = ENCRYPTION_PROCESSES if processes is None else processes
+        if processes <= 1 or len(items) <= ENCRYPTION_CHUNK_SIZE:
+            return crypt_chunk(self.keys, method, items)
+
+        global process_pool
+        if process_pool is None:
+            process_pool = ProcessPoolExecutor(max_workers=processes)
+
+        chunks = [
+            items[i : i + ENCRYPTION_CHUNK_SIZE]
+            for i in range(0, len(items), ENCRYPTION_CHUNK_SIZE)
+        ]
+        results = process_pool.map(
+            crypt_chunk,
+            [self.keys] * len(chunks),
+            [method] * len(chunks),
+            chunks,
+        )
+        return [item for chunk in results for item in chunk]
+
+    def encrypt_many(self, items, processes=None) -> list:
+        return self._many("encrypt", items, processes)
+
+    def decrypt_many(self, items, processes=None) -> list:
+        return self._many("decrypt", items, processes)
+
+    def rotate_many(self, items, processes=None) -> list:
+        return self._many("rotate", items, processes)
@@ -0,0 +1,324 @@
+import os
+import re
+import time
+import json
+import logging
+import threading
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Seconds between full reloads when no change notification arrives
+ENDPOINT_REFRESH_INTERVAL = float(os.getenv("ENDPOINT_REFRESH_INTERVAL", "300"))
+
+# Service area of endpoints and subscribers that do not name one
+DEFAULT_AREA = os.getenv("DEFAULT_AREA", "default")
+AREA_PATTERN = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
+
+# Diffs larger than this are announced as a reload instead; NOTIFY payloads
+# must stay under 8000 bytes
+ENDPOINT_DIFF_MAX_BYTES = 7500
+
+# Applies a posted endpoint set as a diff and announces it, in one round
+# trip: PostgreSQL runs a multi-statement query as a single transaction.
+# The advisory lock orders concurrent updates, and the diff statement takes
+# its snapshot only once the lock is held. Unchanged endpoints keep their
+# rows, ids and created_at.
+UPDATE_ENDPOINTS_SQL = """
+SELECT pg_advisory_xact_lock(hashtext('isp_endpoints'));
+WITH posted AS (
+    SELECT address, area, probe_interval, probe_type, probe_params::json,
+        probe_timeout, latency_slo
+    FROM unnest(
+        %(addresses)s::varchar[],
+        %(areas)s::varchar[],
+        %(intervals)s::integer[],
+        %(types)s::varchar[],
+        %(params)s::text[],
+        %(timeouts)s::float[],
+        %(slos)s::float[]
+    ) AS posted (
+        address, area, probe_interval, probe_type, probe_params, probe_timeout,
+        latency_slo
+    )
+), removed AS (
+    DELETE FROM isp_endpoints
+    WHERE address NOT IN (SELECT address FROM posted)
+    RETURNING address
+), added AS (
+    INSERT INTO isp_endpoints (
+        address, area, probe_interval, probe_type, probe_params, probe_timeout,
+        latency_slo, created_at
+    )
+    SELECT address, area, probe_interval, probe_type, probe_params,
+        probe_timeout, latency_slo, now()
+    FROM posted
+    WHERE address NOT IN (SELECT address FROM isp_endpoints)
+    RETURNING address, area, probe_interval, probe_type, probe_params,
+        probe_timeout, latency_slo
+), changed AS (
+    UPDATE isp_endpoints
+    SET area = posted.area,
+        probe_interval = posted.probe_interval,
+        probe_type = posted.probe_type,
+        probe_params = posted.probe_params,
+        probe_timeout = posted.probe_timeout,
+        latency_slo = posted.latency_slo,
+        updated_at = now()
+    FROM posted
+    WHERE isp_endpoints.address = posted.address
+        AND (
+            isp_endpoints.area, isp_endpoints.probe_interval,
+            isp_endpoints.probe_type, isp_endpoints.probe_params::jsonb,
+            isp_endpoints.probe_timeout, isp_endpoints.latency_slo
+        ) IS DISTINCT FROM (
+            posted.area, posted.probe_interval, posted.probe_type,
+            posted.probe_params::jsonb, posted.probe_timeout, posted.latency_slo
+        )
+    RETURNING isp_endpoints.address, isp_endpoints.area,
+        isp_endpoints.probe_interval,
+        isp_endpoints.probe_type, isp_endpoints.probe_params,
+        isp_endpoints.probe_timeout, isp_endpoints.latency_slo
+), bumped AS (
+    INSERT INTO isp_endpoint_version (id, version) VALUES (1, 1)
+    ON CONFLICT (id) DO UPDATE SET version = isp_endpoint_version.version + 1
+    RETURNING version
+), diff AS (
+    SELECT bumped.version, json_build_object(
+        'version', bumped.version,
+        'added', (
+            SELECT coalesce(json_object_agg(address, json_build_object(
+                'area', area,
+                'interval', probe_interval,
+                'type', probe_type,
+                'params', probe_params,
+                'timeout', probe_timeout,
+                'slo', latency_slo
+            )), '{}')
+            FROM (SELECT * FROM added UNION ALL SELECT * FROM changed) upserted
+        ),
+        'removed', (SELECT coalesce(json_agg(address), '[]') FROM removed)
+    )::text AS payload
+    FROM bumped
+)
+SELECT version, pg_notify(
+    %(channel)s,
+    CASE WHEN octet_length(payload) <= %(max_bytes)s THEN payload
+    ELSE json_build_object('version', version, 'reload', true)::text END
+)
+FROM diff;
+"""
+
+# Endpoints and the version they are at, read in one snapshot
+LOAD_ENDPOINTS_SQL = text("""
+    SELECT latest.version, isp_endpoints.address, isp_endpoints.area,
+        isp_endpoints.probe_interval,
+        isp_endpoints.probe_type, isp_endpoints.probe_params,
+        isp_endpoints.probe_timeout, isp_endpoints.latency_slo
+    FROM (
+        SELECT coalesce(max(version), 0) AS version FROM isp_endpoint_version
+    ) latest
+    LEFT JOIN isp_endpoints ON true
+    """)
+
+
+class ProbeSpec:
+    """
+    How one endpoint is probed: every `interval` seconds, with the probe
+    type and parameters from probing.PROBES, and a timeout and optional
+    latency threshold in seconds. Its results count towards `area`.
+    """
+
+    __slots__ = ("interval", "type", "params", "timeout", "slo", "area")
+
+    def __init__(
+        self,
+        interval,
+        type="icmp",
+        params=None,
+        timeout=None,
+        slo=None,
+        area=DEFAULT_AREA,
+    ):
+        self.interval = interval
+        self.type = type
+        self.params = params or {}
+        self.timeout = timeout
+        self.slo = slo
+        self.area = area
+
+    def _fields(self):
+        return (
+            self.interval,
+            self.type,
+            self.params,
+            self.timeout,
+            self.slo,
+            self.area,
+        )
+
+    def __eq__(self, other):
+        return isinstance(other, ProbeSpec) and self._fields() == other._fields()
+
+    def __repr__(self):
+        return f"<ProbeSpec {self.type} every {self.interval}s>"
+
+
+def update_endpoints(engine, channel, endpoints):
+    """
+    Makes the endpoint set match `endpoints`, a dict mapping each address
+    to a dict with any of "area", "interval", "type", "params", "timeout"
+    and "slo", and returns the new version.
+
+    Listeners on `channel` receive {"version", "added", "removed"}, where
+    added maps addresses to the same dicts, or {"version", "reload": true}
+    when the diff is too large to send.
+    """
+    configs = list(endpoints.values())
+    with engine.connect() as connection:
+        return (
+            connection.execution_options(isolation_level="AUTOCOMMIT")
+            .exec_driver_sql(
+                UPDATE_ENDPOINTS_SQL,
+                {
+                    "addresses": list(endpoints),
+                    "areas": [config.get("area") or DEFAULT_AREA for config in configs],
+                    "intervals": [config.get("interval") for config in configs],
+                    "types": [config.get("type") or "icmp" for config in configs],
+                    "params": [
+                        json.dumps(config["params"]) if config.get("params") else None
+                        for config in configs
+                    ],
+                    "timeouts": [config.get("timeout") for config in configs],
+                    "slos": [config.get("slo") for config in configs],
+                    "channel": channel,
+                    "max_bytes": ENDPOINT_DIFF_MAX_BYTES,
+                },
+            )
+            .scalar()
+        )
+
+
+class EndpointProvider:
+    """
+    In-memory copy of the monitored endpoints, loaded straight from
+    isp_endpoints.
+
+    Change notifications are applied as diffs when they follow on from the
+    version held; otherwise, and after the refresh interval, the set is
+    reloaded. If the database cannot be reached, the last known good set
+    is kept.
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        default_interval,
+        refresh_interval=ENDPOINT_REFRESH_INTERVAL,
+    ):
+        self.session_factory = session_factory
+        self.default_interval = default_interval
+        self.refresh_interval = refresh_interval
+        self.endpoints = None
+        self.version = None
+        self.stale = True
+        self.loaded_at = 0.0
+        # Diffs arrive on the listener thread, reloads on an executor thread
+        self.lock = threading.Lock()
+
+    def mark_stale(self, payload=None):
+        """
+        The next get() reloads from the database.
+        """
+        self.stale = True
+
+    def on_change(self, payload):
+        """
+        Notification handler for update_endpoints(). Diffs that skip a
+        version, or arrive before the first load, mark the set stale.
+        """
+        version = payload.get("version") if payload else None
+
+        with self.lock:
+            # Already covered by a reload that read a later version
+            if None not in (version, self.version) and version <= self.version:
+                return
+            if (
+                version is None
+                or payload.get("reload")
+                or self.version is None
+                or version != self.version + 1
+            ):
+                self.stale = True
+                return
+
+            endpoints = dict(self.endpoints)
+            for address in payload["removed"]:
+                endpoints.pop(address, None)
+            for address, config in payload["added"].items():
+                endpoints[address] = self.spec(**config)
+
+            # Replaced rather than mutated, as get() hands out the dict
+            self.endpoints = endpoints
+            self.version = version
+
+    def spec(
+        self,
+        interval=None,
+        type=None,
+        params=None,
+        timeout=None,
+        slo=None,
+        area=None,
+    ):
+        return ProbeSpec(
+            interval or self.default_interval,
+            type or "icmp",
+            params,
+            timeout,
+            slo,
+            area or DEFAULT_AREA,
+        )
+
+    def load(self):
+        session = self.session_factory()
+        try:
+            rows = session.execute(LOAD_ENDPOINTS_SQL).all()
+            endpoints = {
+                row.address: self.spec(
+                    row.probe_interval,
+                    row.probe_type,
+                    row.probe_params,
+                    row.probe_timeout,
+                    row.latency_slo,
+                    row.area,
+                )
+                for row in rows
+                if row.address is not None
+            }
+            return rows[0].version, endpoints
+        finally:
+            session.close()
+
+    def get(self):
+        """
+        Returns a dict mapping each address to its ProbeSpec, or None if
+        the endpoints have never been loaded.
+        """
+        if self.stale or time.monotonic() - self.loaded_at >= self.refresh_interval:
+            # Cleared before loading so a change made during the load is not lost
+            self.stale = False
+            try:
+                version, endpoints = self.load()
+                with self.lock:
+                    # Diffs applied during the load may already be newer
+                    if self.version is None or version >= self.version:
+                        self.endpoints = endpoints
+                        self.version = version
+                self.loaded_at = time.monotonic()
+            except Exception as e:
+                self.stale = True
+                logger.warning(
+                    "Error loading ISP endpoints, keeping last known set: %s", e
+                )
+        return self.endpoints
@@ -0,0 +1,32 @@
+import bisect
+import hashlib
+
+# Points per worker on the hash ring; more points spread endpoints more evenly
+HASH_RING_REPLICAS = 64
+
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring assigning each key to one member.
+
+    Adding or removing a member only moves the keys on its own arcs.
+    """
+
+    def __init__(self, members, replicas=HASH_RING_REPLICAS):
+        points = sorted(
+            (ring_hash(f"{member}#{i}"), member)
+            for member in members
+            for i in range(replicas)
+        )
+        self.hashes = [point for point, _ in points]
+        self.members = [member for _, member in points]
+
+    def owner(self, key):
+        if not self.hashes:
+            return None
+        index = bisect.bisect(self.hashes, ring_hash(key)) % len(self.hashes)
+        return self.members[index]
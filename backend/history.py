@@ -0,0 +1,277 @@
+import os
+import logging
+import threading
+from models import ProbeResult, ProbeRollup
+from sqlalchemy import insert, literal_column
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+logger = logging.getLogger(__name__)
+
+# History configuration
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "60"))
+HISTORY_MAX_BUCKETS = int(os.getenv("HISTORY_MAX_BUCKETS", "2000"))
+
+# Results and rollup buckets kept for the next flush when a write fails;
+# the oldest are dropped beyond this, so an outage cannot exhaust memory
+HISTORY_MAX_PENDING = int(os.getenv("HISTORY_MAX_PENDING", "50000"))
+
+# Upper bounds of the latency histogram buckets in milliseconds; the last
+# bucket counts everything slower than the final bound
+LATENCY_BOUNDS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+GRANULARITIES = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+
+def parse_timestamp(value):
+    """
+    Parses an ISO 8601 timestamp, treating naive values as UTC.
+    """
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
+def bucket_start(timestamp, granularity):
+    """
+    Truncates a timestamp to the start of its rollup bucket.
+    """
+    if granularity == "minute":
+        return timestamp.replace(second=0, microsecond=0)
+    if granularity == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def empty_histogram():
+    return [0] * (len(LATENCY_BOUNDS_MS) + 1)
+
+
+def histogram_index(rtt):
+    """
+    Returns the histogram bucket for a round-trip time in seconds.
+    """
+    rtt_ms = rtt * 1000
+    for index, bound in enumerate(LATENCY_BOUNDS_MS):
+        if rtt_ms <= bound:
+            return index
+    return len(LATENCY_BOUNDS_MS)
+
+
+def percentile(histogram, q):
+    """
+    Estimates the q-th quantile (0-1) in milliseconds from a histogram,
+    reporting the upper bound of the bucket it falls in.
+    """
+    total = sum(histogram)
+    if not total:
+        return None
+
+    rank = q * total
+    seen = 0
+    for index, count in enumerate(histogram):
+        seen += count
+        if seen >= rank:
+            return LATENCY_BOUNDS_MS[min(index, len(LATENCY_BOUNDS_MS) - 1)]
+    return LATENCY_BOUNDS_MS[-1]
+
+
+class HistoryWriter:
+    """
+    Buffers probe results and writes them in batches, appending raw rows
+    and folding them into the minute, hour and day rollups.
+    """
+
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+        self.results = []
+        self.rollups = {}
+        self.lock = threading.Lock()
+
+    def record(self, address, probed_at, rtt):
+        """
+        Buffers one probe result; rtt is None when the probe failed.
+        """
+        with self.lock:
+            self.results.append(
+                {
+                    "address": address,
+                    "probed_at": probed_at,
+                    "rtt": rtt,
+                    "success": rtt is not None,
+                }
+            )
+
+            # Rollups are accumulated in memory so each flush is one upsert per bucket
+            for granularity in GRANULARITIES:
+                key = (address, granularity, bucket_start(probed_at, granularity))
+                rollup = self.rollups.get(key)
+                if rollup is None:
+                    rollup = self.rollups[key] = {
+                        "probes": 0,
+                        "successes": 0,
+                        "rtt_sum": 0.0,
+                        "rtt_histogram": empty_histogram(),
+                    }
+                rollup["probes"] += 1
+                if rtt is not None:
+                    rollup["successes"] += 1
+                    rollup["rtt_sum"] += rtt
+                    rollup["rtt_histogram"][histogram_index(rtt)] += 1
+
+    def flush(self):
+        """
+        Writes buffered results and rollups in a single transaction.
+        """
+        with self.lock:
+            results, self.results = self.results, []
+            rollups, self.rollups = self.rollups, {}
+
+        if not results:
+            return
+
+        session = self.session_factory()
+        try:
+            session.execute(insert(ProbeResult), results)
+
+            statement = pg_insert(ProbeRollup)
+            statement = statement.on_conflict_do_update(
+                index_elements=["address", "granularity", "bucket_start"],
+                set_={
+                    "probes": ProbeRollup.probes + statement.excluded.probes,
+                    "successes": ProbeRollup.successes + statement.excluded.successes,
+                    "rtt_sum": ProbeRollup.rtt_sum + statement.excluded.rtt_sum,
+                    # Element-wise sum of the stored and incoming histograms
+                    "rtt_histogram": literal_column(
+                        "ARRAY(SELECT a + b FROM unnest("
+                        "probe_rollups.rtt_histogram, excluded.rtt_histogram"
+                        ") AS t(a, b))"
+                    ),
+                },
+            )
+            session.execute(
+                statement,
+                [
+                    {
+                        "address": address,
+                        "granularity": granularity,
+                        "bucket_start": start,
+                        **rollup,
+                    }
+                    for (address, granularity, start), rollup in rollups.items()
+                ],
+            )
+            session.commit()
+        except Exception as e:
+            logger.warning("Error writing probe history, retrying next flush: %s", e)
+            session.rollback()
+            self.requeue(results, rollups)
+        finally:
+            session.close()
+
+    def requeue(self, results, rollups):
+        """
+        Puts the results and rollups of a failed flush back in front of
+        those recorded since, keeping at most HISTORY_MAX_PENDING of each.
+        """
+        with self.lock:
+            self.results = results + self.results
+            for key, rollup in self.rollups.items():
+                pending = rollups.get(key)
+                if pending is None:
+                    rollups[key] = rollup
+                    continue
+                for field in ("probes", "successes", "rtt_sum"):
+                    pending[field] += rollup[field]
+                pending["rtt_histogram"] = [
+                    a + b
+                    for a, b in zip(pending["rtt_histogram"], rollup["rtt_histogram"])
+                ]
+            self.rollups = rollups
+
+            dropped = max(len(self.results) - HISTORY_MAX_PENDING, 0)
+            if dropped:
+                del self.results[:dropped]
+            excess = len(self.rollups) - HISTORY_MAX_PENDING
+            if excess > 0:
+                # Keys end with the bucket start, so the oldest buckets go first
+                for key in sorted(self.rollups, key=lambda key: key[2])[:excess]:
+                    del self.rollups[key]
+
+        if dropped:
+            logger.warning("Dropped %d buffered probe results", dropped)
+
+
+def pick_granularity(start, end):
+    """
+    Chooses the coarsest rollup that still gives a useful number of buckets.
+    """
+    span = end - start
+    if span <= timedelta(hours=6):
+        return "minute"
+    if span <= timedelta(days=14):
+        return "hour"
+    return "day"
+
+
+def summarize(rollups):
+    """
+    Merges rollup rows into uptime and latency figures.
+    """
+    probes = sum(rollup.probes for rollup in rollups)
+    successes = sum(rollup.successes for rollup in rollups)
+    rtt_sum = sum(rollup.rtt_sum for rollup in rollups)
+    histogram = empty_histogram()
+    for rollup in rollups:
+        for index, count in enumerate(rollup.rtt_histogram):
+            histogram[index] += count
+
+    return {
+        "probes": probes,
+        "uptime": round(100 * successes / probes, 3) if probes else None,
+        "mean_rtt_ms": round(1000 * rtt_sum / successes, 3) if successes else None,
+        "p50_rtt_ms": percentile(histogram, 0.5),
+        "p95_rtt_ms": percentile(histogram, 0.95),
+        "p99_rtt_ms": percentile(histogram, 0.99),
+    }
+
+
+def load_history(session, start, end, granularity, address=None):
+    """
+    Reads the rollups for a time range and summarizes each bucket and the
+    range as a whole. Cost grows with the number of buckets, never with the
+    number of raw probe results.
+    """
+    query = session.query(ProbeRollup).filter(
+        ProbeRollup.granularity == granularity,
+        ProbeRollup.bucket_start >= bucket_start(start, granularity),
+        ProbeRollup.bucket_start < end,
+    )
+    if address:
+        query = query.filter(ProbeRollup.address == address)
+    rollups = query.order_by(ProbeRollup.bucket_start).all()
+
+    # Endpoints sharing a bucket are merged into a single point
+    buckets = {}
+    for rollup in rollups:
+        buckets.setdefault(rollup.bucket_start, []).append(rollup)
+
+    return {
+        "granularity": granularity,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "summary": summarize(rollups),
+        "buckets": [
+            {"start": start_at.isoformat(), **summarize(bucket)}
+            for start_at, bucket in buckets.items()
+        ],
+    }
@@ -0,0 +1,200 @@
+import io
+import re
+import csv
+import hashlib
+import secrets
+import argparse
+from dispatch import batched
+from config import SessionLocal
+from encryption import Encryptor
+from endpoints import DEFAULT_AREA
+from pubsub import SUBSCRIPTIONS_CHANNEL, publish
+from models import EmailSubscription, SMSSubscription
+from email_validator import validate_email, EmailNotValidError
+
+encryptor = Encryptor()
+
+# E.164, the format Twilio reports SMS senders in
+PHONE_PATTERN = re.compile(r"^\+[1-9]\d{6,14}$")
+
+# Holds one batch at a time; emptied whenever its transaction commits
+STAGING_TABLE = "subscriber_import"
+
+
+def normalize_email(value):
+    # Deliverability checks would cost a DNS lookup per imported address
+    return validate_email(value, check_deliverability=False).email
+
+
+def normalize_phone(value):
+    if not PHONE_PATTERN.match(value):
+        raise ValueError(f"Not an E.164 phone number: {value}")
+    return value
+
+
+# Model, encrypted column, hash column and normalizer for each channel
+CHANNELS = {
+    "email": (
+        EmailSubscription,
+        EmailSubscription.encrypted_email,
+        EmailSubscription.email_hash,
+        normalize_email,
+    ),
+    "sms": (
+        SMSSubscription,
+        SMSSubscription.encrypted_phone,
+        SMSSubscription.phone_hash,
+        normalize_phone,
+    ),
+}
+
+
+def read_addresses(path, skip_header=False):
+    """
+    Yields the first column of every non-empty row of a CSV file.
+    """
+    with open(path, newline="") as f:
+        rows = csv.reader(f)
+        if skip_header:
+            next(rows, None)
+        for row in rows:
+            if row and row[0].strip():
+                yield row[0].strip()
+
+
+def prepare_batch(addresses, normalize, processes=None):
+    """
+    Normalizes, deduplicates and encrypts one batch of addresses.
+
+    Returns (rows, invalid), where rows are (token, encrypted, hash) tuples
+    hashed the same way as the subscribe routes.
+    """
+    hashed = {}
+    invalid = 0
+    for address in addresses:
+        try:
+            address = normalize(address)
+        except (EmailNotValidError, ValueError):
+            invalid += 1
+            continue
+        hashed.setdefault(hashlib.sha256(address.encode()).hexdigest(), address)
+
+    encrypted = encryptor.encrypt_many(list(hashed.values()), processes=processes)
+    rows = [
+        (secrets.token_urlsafe(16), value, digest)
+        for digest, value in zip(hashed, encrypted)
+    ]
+    return rows, invalid
+
+
+def copy_batch(session, model, encrypted_column, hash_column, rows, areas):
+    """
+    Streams one batch into the staging table with COPY, then moves the new
+    subscribers across in a single INSERT ... SELECT, subscribed to `areas`.
+
+    Returns the number of subscribers inserted; the others already existed.
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    # The raw cursor shares the session's connection and transaction
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.execute(
+            f"CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} "
+            "(token text, encrypted text, hash text) ON COMMIT DELETE ROWS"
+        )
+        cursor.copy_expert(
+            f"COPY {STAGING_TABLE} (token, encrypted, hash) "
+            "FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+        cursor.execute(
+            f"INSERT INTO {model.__tablename__} "
+            f"(token, {encrypted_column.key}, {hash_column.key}, areas, created_at) "
+            f"SELECT token, encrypted, hash, %s, now() FROM {STAGING_TABLE} "
+            f"ON CONFLICT ({hash_column.key}) DO NOTHING",
+            (areas,),
+        )
+        return cursor.rowcount
+    finally:
+        cursor.close()
+
+
+def import_subscribers(channel, addresses, batch_size, processes=None, areas=None):
+    """
+    Subscribes every address to a channel for the given service areas, the
+    default area if none, skipping existing subscribers.
+
+    Each batch is committed on its own, so an interrupted import can simply
+    be run again. Returns (imported, existing, invalid) counts.
+    """
+    model, encrypted_column, hash_column, normalize = CHANNELS[channel]
+    areas = sorted(set(areas or [DEFAULT_AREA]))
+
+    imported = existing = invalid = 0
+    for batch in batched(addresses, batch_size):
+        rows, skipped = prepare_batch(batch, normalize, processes)
+        invalid += skipped
+        if not rows:
+            continue
+
+        session = SessionLocal()
+        try:
+            inserted = copy_batch(
+                session, model, encrypted_column, hash_column, rows, areas
+            )
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+        imported += inserted
+        existing += len(batch) - skipped - inserted
+        print(f"Imported {imported} {channel} subscribers ({existing} existing)")
+
+    # One roster rebuild in the monitor rather than a notification per row
+    if imported:
+        session = SessionLocal()
+        try:
+            publish(
+                session, SUBSCRIPTIONS_CHANNEL, {"channel": channel, "op": "reload"}
+            )
+            session.commit()
+        finally:
+            session.close()
+
+    return imported, existing, invalid
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Bulk import subscribers from a CSV file of addresses."
+    )
+    parser.add_argument("channel", choices=sorted(CHANNELS))
+    parser.add_argument("path", help="CSV file with one address per row")
+    parser.add_argument("--skip-header", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument(
+        "--area",
+        action="append",
+        dest="areas",
+        help="Service area to subscribe to; repeat for several",
+    )
+    args = parser.parse_args()
+
+    imported, existing, invalid = import_subscribers(
+        args.channel,
+        read_addresses(args.path, args.skip_header),
+        args.batch_size,
+        args.processes,
+        args.areas,
+    )
+    print(
+        f"Done: {imported} imported, {existing} already subscribed, "
+        f"{invalid} invalid"
+    )
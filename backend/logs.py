@@ -0,0 +1,201 @@
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import queue
+import atexit
+import random
+import logging
+import threading
+from contextvars import ContextVar
+from contextlib import contextmanager
+from metrics import LOG_RECORDS_DROPPED
+from logging.handlers import QueueHandler, QueueListener
+
+# Logging configuration
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json or text
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Repeats of one message allowed per window before the rest are counted
+# and dropped
+LOG_RATE_LIMIT = int(os.getenv("LOG_RATE_LIMIT", "10"))
+LOG_RATE_WINDOW = float(os.getenv("LOG_RATE_WINDOW", "60"))
+
+# Share of records logged with extra={"sample": True} that are kept
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+
+# Contact details that must never reach the logs
+EMAIL_PATTERN = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+PHONE_PATTERN = re.compile(r"\+[1-9]\d{6,14}\b")
+
+# Attributes every LogRecord has; anything else was passed through extra=
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+# Ties the log lines of one state transition to its notification batches
+correlation_id = ContextVar("correlation_id", default=None)
+
+# Started once per process by setup_logging()
+listener = None
+setup_lock = threading.Lock()
+
+
+def redact(text):
+    text = EMAIL_PATTERN.sub("[email]", text)
+    return PHONE_PATTERN.sub("[phone]", text)
+
+
+def new_correlation_id():
+    return uuid.uuid4().hex[:16]
+
+
+@contextmanager
+def correlation(value=None):
+    """
+    Tags every record logged in this context, including tasks it starts,
+    with a correlation id; a new one unless `value` is given.
+    """
+    token = correlation_id.set(value or new_correlation_id())
+    try:
+        yield correlation_id.get()
+    finally:
+        correlation_id.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    # Runs on the caller's thread, where the context variable is set
+    def filter(self, record):
+        record.correlation_id = correlation_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a share of the records marked for sampling, so per-probe and
+    per-recipient detail costs almost nothing in steady state.
+    """
+
+    def __init__(self, rate=LOG_SAMPLE_RATE, rng=random.random):
+        super().__init__()
+        self.rate = rate
+        self.rng = rng
+
+    def filter(self, record):
+        if not getattr(record, "sample", False):
+            return True
+        if self.rng() < self.rate:
+            record.sample = self.rate
+            return True
+        LOG_RECORDS_DROPPED.labels("sampled").inc()
+        return False
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets each message template through `limit` times per window. The first
+    record of the next window reports how many repeats were dropped.
+    """
+
+    def __init__(
+        self, limit=LOG_RATE_LIMIT, window=LOG_RATE_WINDOW, clock=time.monotonic
+    ):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.clock = clock
+        self.windows = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.levelno, str(record.msg))
+        now = self.clock()
+        with self.lock:
+            started, count, dropped = self.windows.get(key, (now, 0, 0))
+            if now - started >= self.window:
+                if dropped:
+                    record.suppressed = dropped
+                started, count, dropped = now, 0, 0
+            count += 1
+            if count > self.limit:
+                dropped += 1
+            self.windows[key] = (started, count, dropped)
+
+        if count > self.limit:
+            LOG_RECORDS_DROPPED.labels("rate_limited").inc()
+            return False
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Hands records to the logging thread without ever blocking the caller;
+    records arriving while the queue is full are counted and dropped.
+    """
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.labels("queue_full").inc()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, with contact details redacted and any extra=
+    fields included. Tracebacks arrive already merged into the message by
+    the queue handler.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S%z"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": redact(record.getMessage()),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and value is not None:
+                entry[key] = redact(value) if isinstance(value, str) else value
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        return redact(super().format(record))
+
+
+def setup_logging(level=LOG_LEVEL, log_format=LOG_FORMAT):
+    """
+    Routes the root logger through a bounded queue to a background thread
+    that formats and writes each record to stdout. Safe to call more than
+    once; only the first call configures logging.
+    """
+    global listener
+    with setup_lock:
+        if listener is not None:
+            return
+
+        handler = logging.StreamHandler(sys.stdout)
+        if log_format == "json":
+            handler.setFormatter(JsonFormatter())
+        else:
+            handler.setFormatter(
+                TextFormatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+            )
+
+        # Filters run on the caller, so dropped records never reach the queue
+        queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        queue_handler.addFilter(SamplingFilter())
+        queue_handler.addFilter(RateLimitFilter())
+        queue_handler.addFilter(ContextFilter())
+
+        root = logging.getLogger()
+        root.handlers = [queue_handler]
+        root.setLevel(level)
+
+        listener = QueueListener(queue_handler.queue, handler)
+        listener.start()
+        # Write out what is still queued when the process exits
+        atexit.register(listener.stop)
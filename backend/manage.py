@@ -0,0 +1,159 @@
+import os
+import argparse
+from sqlalchemy import text
+from datetime import datetime
+from dotenv import load_dotenv
+from cache import shared_counters
+from pubsub import ENDPOINTS_CHANNEL
+from endpoints import update_endpoints
+from sqlalchemy.schema import CreateColumn
+from config import SessionLocal, get_engine
+from models import (
+    Base,
+    EmailSubscription,
+    ISPEndpoint,
+    ServiceStatus,
+    SMSSubscription,
+    StatusTransition,
+    Superuser,
+)
+
+load_dotenv()
+
+# Superuser created by init if it does not exist yet
+SUPERUSER_NAME = os.getenv("SUPERUSER_NAME")
+SUPERUSER_PASSWORD = os.getenv("SUPERUSER_PASSWORD")
+
+# Endpoints monitored until an admin configures others
+DEFAULT_ISP_ENDPOINTS = ["216.75.112.220", "216.75.120.220"]
+
+# Columns added to tables that existing deployments already have;
+# create_all skips tables that exist, so migrate adds these itself
+MIGRATED_COLUMNS = [
+    ISPEndpoint.__table__.c.probe_interval,
+    ISPEndpoint.__table__.c.area,
+    ISPEndpoint.__table__.c.probe_type,
+    ISPEndpoint.__table__.c.probe_params,
+    ISPEndpoint.__table__.c.probe_timeout,
+    ISPEndpoint.__table__.c.latency_slo,
+    ServiceStatus.__table__.c.area,
+    StatusTransition.__table__.c.area,
+    StatusTransition.__table__.c.correlation_id,
+    EmailSubscription.__table__.c.areas,
+    SMSSubscription.__table__.c.areas,
+]
+
+
+def add_column(column, dialect):
+    ddl = CreateColumn(column).compile(dialect=dialect)
+    return f"ALTER TABLE {column.table.name} ADD COLUMN IF NOT EXISTS {ddl}"
+
+
+def migrate():
+    """
+    Creates missing tables, adds the columns introduced since the tables
+    were first created and creates missing indexes, in one transaction.
+    """
+    with get_engine().begin() as connection:
+        Base.metadata.create_all(bind=connection)
+
+        # Columns with a server default backfill existing rows, so every
+        # endpoint, status and subscriber lands in the default area
+        for column in MIGRATED_COLUMNS:
+            connection.execute(text(add_column(column, connection.dialect)))
+
+        # Deployments from before areas kept at most one status row, but
+        # make sure the newest one per area wins before it becomes unique
+        connection.execute(
+            text(
+                "DELETE FROM service_status a USING service_status b "
+                "WHERE a.area = b.area AND a.id < b.id"
+            )
+        )
+        connection.execute(
+            text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS service_status_area_key "
+                "ON service_status (area)"
+            )
+        )
+
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=connection, checkfirst=True)
+    print("Database schema is up to date")
+
+
+def set_default_status(session):
+    # Check and set initial service status
+    if session.query(ServiceStatus.id).first() is None:
+        session.add(ServiceStatus(status="online", updated_at=datetime.now()))
+        session.commit()
+        shared_counters.bump("status")
+        print("Service status set to online")
+    else:
+        print("Service status already exists")
+
+
+def create_default_superuser(session):
+    if not (SUPERUSER_NAME and SUPERUSER_PASSWORD):
+        print("SUPERUSER_NAME or SUPERUSER_PASSWORD not set, no superuser created")
+        return
+
+    if session.query(Superuser).filter_by(username=SUPERUSER_NAME).first() is None:
+        superuser = Superuser(username=SUPERUSER_NAME)
+        superuser.set_password(SUPERUSER_PASSWORD)
+        session.add(superuser)
+        session.commit()
+        shared_counters.bump("superusers")
+        print(f"Superuser {SUPERUSER_NAME} created")
+    else:
+        print(f"Superuser {SUPERUSER_NAME} already exists")
+
+
+def populate_default_isp_endpoints(session):
+    if session.query(ISPEndpoint.id).first() is None:
+        # Add default endpoints the same way as the API, so a concurrent
+        # update cannot insert them twice
+        update_endpoints(
+            get_engine(),
+            ENDPOINTS_CHANNEL,
+            {endpoint: {} for endpoint in DEFAULT_ISP_ENDPOINTS},
+        )
+        shared_counters.bump("isp_endpoints")
+        print("Default ISP endpoints added to the database")
+    else:
+        print("ISP endpoints already exist in the database")
+
+
+def init():
+    """
+    Brings the schema up to date and adds the default rows the services
+    expect. Safe to run on every deploy.
+    """
+    migrate()
+    session = SessionLocal()
+    try:
+        set_default_status(session)
+        create_default_superuser(session)
+        populate_default_isp_endpoints(session)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+COMMANDS = {"init": init, "migrate": migrate}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Prepare the database before the services start."
+    )
+    parser.add_argument(
+        "command",
+        choices=sorted(COMMANDS),
+        help="migrate brings the schema up to date; init also adds the default rows",
+    )
+    args = parser.parse_args()
+    COMMANDS[args.command]()
@@ -0,0 +1,159 @@
+import os
+import time
+from sqlalchemy import event
+from contextvars import ContextVar
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Ports the monitor and standalone notifier processes serve their metrics on
+MONITOR_METRICS_PORT = int(os.getenv("MONITOR_METRICS_PORT", "9100"))
+NOTIFIER_METRICS_PORT = int(os.getenv("NOTIFIER_METRICS_PORT", "9101"))
+
+# API metrics
+REQUEST_LATENCY = Histogram(
+    "allo_http_request_duration_seconds",
+    "Time spent handling a request",
+    ["route", "method", "status"],
+)
+REQUEST_DB_TIME = Histogram(
+    "allo_http_request_db_seconds",
+    "Time a request spent executing database statements",
+    ["route"],
+)
+
+# Connection pool metrics
+POOL_CHECKED_OUT = Gauge(
+    "allo_db_pool_checked_out",
+    "Connections currently checked out of the pool",
+    multiprocess_mode="livesum",
+)
+POOL_WAIT = Histogram(
+    "allo_db_pool_wait_seconds",
+    "Time spent waiting to check out a connection",
+)
+POOL_OVERFLOW_EVENTS = Counter(
+    "allo_db_pool_overflow_events_total",
+    "Checkouts that had to open an overflow connection",
+)
+POOL_TIMEOUTS = Counter(
+    "allo_db_pool_timeouts_total",
+    "Checkouts that gave up waiting for a connection",
+)
+
+# Monitor metrics
+PROBE_RTT = Histogram(
+    "allo_probe_rtt_seconds",
+    "Round-trip time of successful probes",
+    ["endpoint"],
+    buckets=(0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5),
+)
+PROBE_FAILURES = Counter(
+    "allo_probe_failures_total",
+    "Failed probes, by reason: timeout, error or bad_response",
+    ["endpoint", "reason"],
+)
+PROBE_SLO_BREACHES = Counter(
+    "allo_probe_slo_breaches_total",
+    "Probes answered slower than their endpoint's latency threshold",
+    ["endpoint"],
+)
+CHECK_DURATION = Histogram(
+    "allo_check_duration_seconds",
+    "Time taken to evaluate and publish the ISP state",
+)
+LOOP_DRIFT = Histogram(
+    "allo_monitor_loop_drift_seconds",
+    "How late each monitor tick started compared to its schedule",
+    ["schedule"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30),
+)
+MISSED_TICKS = Counter(
+    "allo_monitor_missed_ticks_total",
+    "Scheduled ticks skipped because the previous run overran",
+    ["schedule"],
+)
+NOTIFICATION_LATENCY = Histogram(
+    "allo_notification_send_seconds",
+    "Time taken by one provider send call",
+    ["provider"],
+)
+NOTIFICATIONS_SENT = Counter(
+    "allo_notifications_sent_total",
+    "Notifications accepted by the provider",
+    ["provider"],
+)
+NOTIFICATION_ERRORS = Counter(
+    "allo_notification_errors_total",
+    "Notifications that failed to send",
+    ["provider"],
+)
+NOTIFICATION_DELIVERY_DELAY = Histogram(
+    "allo_notification_delivery_delay_seconds",
+    "Time from a transition being detected to a subscriber being notified",
+    ["channel"],
+    buckets=(1, 5, 10, 30, 60, 300, 900, 1800, 3600),
+)
+NOTIFICATION_DEAD_LETTERS = Counter(
+    "allo_notification_dead_letters_total",
+    "Notifications abandoned after the retry limit",
+    ["channel"],
+)
+
+# Logging metrics
+LOG_RECORDS_DROPPED = Counter(
+    "allo_log_records_dropped_total",
+    "Log records dropped by rate limiting, sampling or a full log queue",
+    ["reason"],
+)
+
+# Database time accumulated by the current request
+db_timer = ContextVar("db_timer", default=None)
+
+
+def start_db_timer():
+    db_timer.set([0.0])
+
+
+def stop_db_timer():
+    timer = db_timer.get()
+    db_timer.set(None)
+    return timer[0] if timer else 0.0
+
+
+def track_db_time(engine):
+    """
+    Adds the duration of every statement run on the engine to the
+    current request's database timer.
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        timer = db_timer.get()
+        if timer is not None:
+            timer[0] += elapsed
+
+
+def render():
+    """
+    Returns the metrics in Prometheus text format, merging every gunicorn
+    worker when running in multiprocess mode.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -1,8 +1,11 @@
-from config import engine
 from datetime import datetime
+from endpoints import DEFAULT_AREA
 from sqlalchemy.orm import declarative_base
-from sqlalchemy import Column, Integer, String, DateTime
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy.dialects.postgresql import ARRAY
+from passwords import check_password, hash_password
+from sqlalchemy import ForeignKey, Index, Text, func, text
+from sqlalchemy import Column, Integer, String, DateTime, JSON
+from sqlalchemy import BigInteger, Boolean, Float, UniqueConstraint
 
 Base = declarative_base()
 
@@ -15,10 +18,10 @@ class Superuser(Base):
     password_hash = Column(String(128))
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return check_password(self.password_hash, password)
 
 
 class ISPEndpoint(Base):
@@ -26,40 +29,178 @@ class ISPEndpoint(Base):
 
     id = Column(Integer, primary_key=True)
     address = Column(String(255), unique=True, nullable=False)
+    # Service area whose status the endpoint counts towards
+    area = Column(
+        String(64),
+        nullable=False,
+        index=True,
+        default=DEFAULT_AREA,
+        server_default=DEFAULT_AREA,
+    )
+    probe_interval = Column(Integer)  # Seconds between probes, monitor default if null
+    # Probe plugin from probing.PROBES, its parameters, and the timeout and
+    # latency threshold in seconds; monitor defaults if null
+    probe_type = Column(
+        String(16), nullable=False, default="icmp", server_default="icmp"
+    )
+    probe_params = Column(JSON)
+    probe_timeout = Column(Float)
+    latency_slo = Column(Float)
     created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
     updated_at = Column(DateTime(timezone=True), onupdate=datetime.utcnow)
 
 
+class EndpointSetVersion(Base):
+    __tablename__ = "isp_endpoint_version"
+
+    # Single row, bumped by every change applied to isp_endpoints
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False)
+
+
 class ServiceStatus(Base):
     __tablename__ = "service_status"
 
+    # One row per service area
     id = Column(Integer, primary_key=True)
+    area = Column(
+        String(64),
+        unique=True,
+        nullable=False,
+        default=DEFAULT_AREA,
+        server_default=DEFAULT_AREA,
+    )
     status = Column(String(255), default="online", nullable=False)
     created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
     updated_at = Column(DateTime(timezone=True), onupdate=datetime.utcnow)
 
 
+class MonitorWorker(Base):
+    __tablename__ = "monitor_workers"
+
+    worker_id = Column(String(128), primary_key=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=False)
+    leader = Column(Boolean, nullable=False, default=False)
+    # Hysteresis state of the endpoints this worker probes
+    endpoints = Column(JSON, nullable=False)
+
+
+class MonitorState(Base):
+    __tablename__ = "monitor_state"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(50), unique=True, nullable=False)
+    data = Column(JSON, nullable=False)
+    updated_at = Column(
+        DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+
+
+class StatusTransition(Base):
+    __tablename__ = "status_transitions"
+
+    id = Column(BigInteger, primary_key=True)
+    area = Column(String(64), nullable=False, server_default=DEFAULT_AREA)
+    status = Column(String(255), nullable=False)
+    subject = Column(String(255), nullable=False)
+    message = Column(Text, nullable=False)
+    # Shared by the monitor's log lines for the transition and its deliveries
+    correlation_id = Column(String(32))
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class OutboxMessage(Base):
+    __tablename__ = "notification_outbox"
+    __table_args__ = (
+        # At most one message per subscriber and channel for each transition
+        UniqueConstraint("transition_id", "channel", "token"),
+        Index(
+            "ix_notification_outbox_due",
+            "channel",
+            "next_attempt_at",
+            postgresql_where=text("state = 'pending'"),
+        ),
+    )
+
+    id = Column(BigInteger, primary_key=True)
+    transition_id = Column(
+        BigInteger, ForeignKey("status_transitions.id"), nullable=False
+    )
+    channel = Column(String(10), nullable=False)  # email or sms
+    token = Column(String(255), nullable=False)
+    state = Column(String(10), nullable=False, server_default="pending")
+    attempts = Column(Integer, nullable=False, server_default="0")
+    next_attempt_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+    last_error = Column(Text)
+    sent_at = Column(DateTime(timezone=True))
+
+
 class EmailSubscription(Base):
     __tablename__ = "email_subscriptions"
+    __table_args__ = (
+        # Alerts select the subscribers of an area with areas @> ARRAY[area]
+        Index("ix_email_subscriptions_areas", "areas", postgresql_using="gin"),
+    )
 
     id = Column(Integer, primary_key=True)
     token = Column(String(255), unique=True, nullable=False)
     encrypted_email = Column(String(255), unique=True, nullable=False)
     email_hash = Column(String(64), unique=True, nullable=False)
+    # Service areas the subscriber is alerted about
+    areas = Column(
+        ARRAY(String(64)),
+        nullable=False,
+        default=lambda: [DEFAULT_AREA],
+        server_default=f"{{{DEFAULT_AREA}}}",
+    )
     created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
     updated_at = Column(DateTime(timezone=True), onupdate=datetime.utcnow)
 
 
 class SMSSubscription(Base):
     __tablename__ = "sms_subscriptions"
+    __table_args__ = (
+        # Alerts select the subscribers of an area with areas @> ARRAY[area]
+        Index("ix_sms_subscriptions_areas", "areas", postgresql_using="gin"),
+    )
 
     id = Column(Integer, primary_key=True)
     token = Column(String(255), unique=True, nullable=False)
     encrypted_phone = Column(String(255), unique=True, nullable=False)
     phone_hash = Column(String(64), unique=True, nullable=False)
+    # Service areas the subscriber is alerted about
+    areas = Column(
+        ARRAY(String(64)),
+        nullable=False,
+        default=lambda: [DEFAULT_AREA],
+        server_default=f"{{{DEFAULT_AREA}}}",
+    )
     created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
     updated_at = Column(DateTime(timezone=True), onupdate=datetime.utcnow)
 
 
-# Create the tables
-Base.metadata.create_all(bind=engine)
+class ProbeResult(Base):
+    __tablename__ = "probe_results"
+
+    id = Column(BigInteger, primary_key=True)
+    address = Column(String(255), nullable=False)
+    probed_at = Column(DateTime(timezone=True), nullable=False, index=True)
+    rtt = Column(Float)  # Round-trip time in seconds, null when the probe failed
+    success = Column(Boolean, nullable=False)
+
+
+class ProbeRollup(Base):
+    __tablename__ = "probe_rollups"
+    __table_args__ = (UniqueConstraint("address", "granularity", "bucket_start"),)
+
+    id = Column(BigInteger, primary_key=True)
+    address = Column(String(255), nullable=False)
+    granularity = Column(String(10), nullable=False)  # minute, hour or day
+    bucket_start = Column(DateTime(timezone=True), nullable=False)
+    probes = Column(Integer, nullable=False, default=0)
+    successes = Column(Integer, nullable=False, default=0)
+    rtt_sum = Column(Float, nullable=False, default=0)
+    rtt_histogram = Column(ARRAY(Integer), nullable=False)  # Counts per latency bucket
+
@@ -0,0 +1,583 @@
+import os
+import json
+import logging
+import asyncio
+import threading
+from history import utcnow
+from sqlalchemy import select
+from dotenv import load_dotenv
+from roster import Roster, wipe
+from encryption import Encryptor
+from dispatch import NOTIFY_CONCURRENCY
+from sqlalchemy.orm import scoped_session
+from logs import correlation, setup_logging
+from config import SessionLocal, DATABASE_URL
+from prometheus_client import start_http_server
+from models import EmailSubscription, SMSSubscription
+from outbox import claim, complete, OUTBOX_POLL_INTERVAL
+from dispatch import dispatch, batched, DispatchReport, TokenBucket
+from pubsub import PgListener, OUTBOX_CHANNEL, SUBSCRIPTIONS_CHANNEL
+from metrics import (
+    NOTIFIER_METRICS_PORT,
+    NOTIFICATION_DEAD_LETTERS,
+    NOTIFICATION_DELIVERY_DELAY,
+    NOTIFICATION_ERRORS,
+    NOTIFICATION_LATENCY,
+    NOTIFICATIONS_SENT,
+)
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables from a .env file
+load_dotenv()
+encryptor = Encryptor()
+
+# AWS Simple Notification Service (SNS) configuration
+AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
+AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
+SNS_TOPIC_ARN = os.getenv("SNS_TOPIC_ARN")
+
+# Twilio configuration for sending SMS
+TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
+TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
+TWILIO_PHONE_NUMBER = os.getenv("TWILIO_PHONE_NUMBER")
+
+# Point the Twilio API at another server, e.g. a local stub when testing
+TWILIO_BASE_URL = os.getenv("TWILIO_BASE_URL")
+
+# AWS Simple Email Service (SES) endpoint, a local stub when testing
+SES_ENDPOINT_URL = os.getenv("SES_ENDPOINT_URL")
+
+# Provider clients, created on first use so importing this module stays cheap
+twilio_client = None
+ses_client = None
+clients_lock = threading.Lock()
+
+
+def get_twilio_client():
+    """
+    Returns the Twilio client, creating it on the first call.
+    """
+    global twilio_client
+    if twilio_client is None:
+        with clients_lock:
+            if twilio_client is None:
+                from twilio.rest import Client
+
+                client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+                if TWILIO_BASE_URL:
+                    client.api.base_url = TWILIO_BASE_URL
+                twilio_client = client
+    return twilio_client
+
+
+def get_ses_client():
+    """
+    Returns the SES client, creating it on the first call.
+    """
+    global ses_client
+    if ses_client is None:
+        with clients_lock:
+            if ses_client is None:
+                import boto3
+                from botocore.config import Config
+
+                ses_client = boto3.client(
+                    "ses",
+                    region_name="us-east-1",
+                    aws_access_key_id=AWS_ACCESS_KEY_ID,
+                    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+                    endpoint_url=SES_ENDPOINT_URL,
+                    config=Config(max_pool_connections=NOTIFY_CONCURRENCY),
+                )
+    return ses_client
+
+
+# SES bulk templated sending is used when a template name is configured
+SES_TEMPLATE_NAME = os.getenv("SES_TEMPLATE_NAME")
+SES_SOURCE = "alerts@allo.guru"  # Replace with your verified SES email
+SES_BULK_BATCH_SIZE = 50  # SES accepts at most 50 destinations per bulk call
+
+# Provider rate limits, in messages per second
+ses_bucket = TokenBucket(float(os.getenv("SES_RATE_LIMIT", "14")))
+twilio_bucket = TokenBucket(float(os.getenv("TWILIO_RATE_LIMIT", "10")))
+
+# Number of subscribers fetched and decrypted per round trip when loading rosters
+SUBSCRIBER_BATCH_SIZE = int(os.getenv("SUBSCRIBER_BATCH_SIZE", "1000"))
+
+# Token and encrypted address columns of each channel's subscriptions
+RECIPIENT_COLUMNS = {
+    "email": (EmailSubscription.token, EmailSubscription.encrypted_email),
+    "sms": (SMSSubscription.token, SMSSubscription.encrypted_phone),
+}
+
+# Decrypted recipients, loaded once and kept current from subscription changes
+email_roster = Roster("email")
+sms_roster = Roster("sms")
+rosters_ready = threading.Event()
+
+# Wakes the delivery workers when messages are enqueued; set up by run_delivery()
+delivery_loop = None
+delivery_wakeups = {}
+
+
+def log_failures(report, total):
+    """
+    Logs one summary per send instead of a line per failed recipient; only
+    a sample of the individual errors is kept.
+    """
+    if not report.failed:
+        return
+    for message_id, error in report.failed:
+        logger.warning(
+            "Error sending %s for outbox message %s: %s",
+            report.channel,
+            message_id,
+            error,
+            extra={"sample": True},
+        )
+    logger.error(
+        "Failed to send %d of %d %s notifications",
+        len(report.failed),
+        total,
+        report.channel,
+        extra={"channel": report.channel, "failed": len(report.failed)},
+    )
+
+
+def send_sms_batch(message, batch):
+    """
+    Sends one SMS per recipient in the batch using Twilio.
+    """
+    results = []
+    for message_id, phone, _ in batch:
+        # Wiped by an unsubscribe since the alert started
+        if not any(phone):
+            continue
+        try:
+            with NOTIFICATION_LATENCY.labels("twilio").time():
+                get_twilio_client().messages.create(
+                    body=message, from_=TWILIO_PHONE_NUMBER, to=phone.decode()
+                )
+            NOTIFICATIONS_SENT.labels("twilio").inc()
+            results.append((message_id, None))
+        except Exception as e:
+            NOTIFICATION_ERRORS.labels("twilio").inc()
+            results.append((message_id, e))
+    return results
+
+
+async def send_sms_notification(message, recipients):
+    """
+    Sends SMS notifications using Twilio.
+
+    Recipients are (message_id, phone, link) tuples built from the SMS
+    roster.
+    """
+    report = await dispatch(
+        "sms",
+        recipients,
+        lambda batch: send_sms_batch(message, batch),
+        twilio_bucket,
+    )
+    log_failures(report, len(recipients))
+    return report
+
+
+def generate_unsubscribe_link(token):
+    """
+    Generates an unsubscribe link for email notifications.
+    """
+    base_url = "http://www.allo.guru/api/unsubscribe"
+    unsubscribe_link = f"{base_url}?token={token}"
+    return unsubscribe_link
+
+
+def create_ses_template():
+    """
+    Creates the SES template used for bulk sends if it does not exist yet.
+    """
+    ses_client = get_ses_client()
+    try:
+        ses_client.get_template(TemplateName=SES_TEMPLATE_NAME)
+    except ses_client.exceptions.TemplateDoesNotExistException:
+        ses_client.create_template(
+            Template={
+                "TemplateName": SES_TEMPLATE_NAME,
+                "SubjectPart": "{{subject}}",
+                "TextPart": "{{message}}\n\nTo unsubscribe, please click here: {{unsubscribe_link}}",
+            }
+        )
+
+
+def send_email_batch(subject, message, batch):
+    """
+    Sends an email to each recipient in the batch using Amazon SES.
+    """
+    CHARSET = "UTF-8"
+    ses_client = get_ses_client()
+    results = []
+
+    # Skip addresses wiped by an unsubscribe since the alert started
+    destinations = [
+        (message_id, email.decode(), link)
+        for message_id, email, link in batch
+        if any(email)
+    ]
+    if not destinations:
+        return results
+
+    if SES_TEMPLATE_NAME:
+        # One bulk call covers the whole batch, with a personalised unsubscribe link
+        try:
+            with NOTIFICATION_LATENCY.labels("ses").time():
+                response = ses_client.send_bulk_templated_email(
+                    Source=SES_SOURCE,
+                    Template=SES_TEMPLATE_NAME,
+                    DefaultTemplateData=json.dumps(
+                        {"subject": subject, "message": message, "unsubscribe_link": ""}
+                    ),
+                    Destinations=[
+                        {
+                            "Destination": {"ToAddresses": [email]},
+                            "ReplacementTemplateData": json.dumps(
+                                {"unsubscribe_link": link}
+                            ),
+                        }
+                        for _, email, link in destinations
+                    ],
+                )
+        except Exception as e:
+            NOTIFICATION_ERRORS.labels("ses").inc(len(destinations))
+            return results + [(message_id, e) for message_id, _, _ in destinations]
+
+        for (message_id, _, _), status in zip(destinations, response["Status"]):
+            if status["Status"] == "Success":
+                NOTIFICATIONS_SENT.labels("ses").inc()
+                results.append((message_id, None))
+            else:
+                NOTIFICATION_ERRORS.labels("ses").inc()
+                results.append((message_id, status.get("Error") or status["Status"]))
+        return results
+
+    for message_id, email, link in destinations:
+        full_message = f"{message}\n\nTo unsubscribe, please click here: {link}"
+        try:
+            with NOTIFICATION_LATENCY.labels("ses").time():
+                ses_client.send_email(
+                    Destination={"ToAddresses": [email]},
+                    Message={
+                        "Body": {"Text": {"Charset": CHARSET, "Data": full_message}},
+                        "Subject": {"Charset": CHARSET, "Data": subject},
+                    },
+                    Source=SES_SOURCE,
+                )
+            NOTIFICATIONS_SENT.labels("ses").inc()
+            results.append((message_id, None))
+        except Exception as e:
+            NOTIFICATION_ERRORS.labels("ses").inc()
+            results.append((message_id, e))
+    return results
+
+
+async def send_email_notification(subject, message, recipients):
+    """
+    Sends email notifications using Amazon SES.
+
+    Recipients are (message_id, email, unsubscribe_link) tuples built from
+    the email roster.
+    """
+    report = await dispatch(
+        "email",
+        recipients,
+        lambda batch: send_email_batch(subject, message, batch),
+        ses_bucket,
+        batch_size=SES_BULK_BATCH_SIZE if SES_TEMPLATE_NAME else 1,
+    )
+    log_failures(report, len(recipients))
+    return report
+
+
+def load_recipients(session, channel, tokens):
+    """
+    Reads and decrypts recipients missing from the roster, such as
+    subscribers whose change has not been applied to it yet.
+
+    Returns {token: (address, link)} for the tokens still subscribed, in the
+    roster's format.
+    """
+    token_column, encrypted_column = RECIPIENT_COLUMNS[channel]
+    rows = session.execute(
+        select(token_column, encrypted_column).where(token_column.in_(tokens))
+    ).all()
+    addresses = encryptor.decrypt_many([encrypted for _, encrypted in rows])
+    return {
+        token: (
+            bytearray(address.encode()),
+            generate_unsubscribe_link(token) if channel == "email" else None,
+        )
+        for (token, _), address in zip(rows, addresses)
+    }
+
+
+def subscribed_tokens(session, channel, tokens):
+    """
+    Returns which of the tokens still have a subscription.
+    """
+    token_column, _ = RECIPIENT_COLUMNS[channel]
+    return set(
+        session.execute(select(token_column).where(token_column.in_(tokens)))
+        .scalars()
+        .all()
+    )
+
+
+def stream_recipients(columns, link_for=None):
+    """
+    Yields decrypted (token, address, link) batches from one subscription
+    table, reading it through a server-side cursor.
+    """
+    session = scoped_session(SessionLocal)
+
+    try:
+        rows = session.query(*columns).yield_per(SUBSCRIBER_BATCH_SIZE)
+        for batch in batched(rows, SUBSCRIBER_BATCH_SIZE):
+            addresses = encryptor.decrypt_many([encrypted for _, encrypted in batch])
+            yield [
+                (token, address, link_for(token) if link_for else None)
+                for (token, _), address in zip(batch, addresses)
+            ]
+    finally:
+        session.remove()
+
+
+def load_rosters():
+    """
+    Rebuilds both rosters from the database.
+    """
+    email_roster.rebuild(
+        stream_recipients(RECIPIENT_COLUMNS["email"], generate_unsubscribe_link)
+    )
+    sms_roster.rebuild(stream_recipients(RECIPIENT_COLUMNS["sms"]))
+    rosters_ready.set()
+    logger.info(
+        "Loaded %d email and %d SMS recipients", len(email_roster), len(sms_roster)
+    )
+
+
+def on_subscription_change(payload):
+    """
+    Applies one subscribe or unsubscribe to the rosters.
+
+    Runs on the listener thread, so changes committed during a rebuild are
+    applied right after it.
+    """
+    # Changes may have been missed while the listener was disconnected, or
+    # were too many to announce one by one, as after a bulk import
+    if payload is None or payload["op"] == "reload":
+        load_rosters()
+        return
+
+    token = payload["token"]
+    if payload["channel"] == "email":
+        roster, link = email_roster, generate_unsubscribe_link(token)
+    else:
+        roster, link = sms_roster, None
+
+    if payload["op"] == "add":
+        roster.add(token, encryptor.decrypt(payload["encrypted"]), link)
+    else:
+        roster.remove(token)
+
+
+def outcomes(channel, rows, report, subscribed=()):
+    """
+    Splits one claimed batch into sent, skipped and failed messages.
+
+    Messages that were neither sent nor failed had no address to go to:
+    they are skipped if the subscriber has unsubscribed, and retried if
+    the subscription in `subscribed` was only missing from the roster, e.g.
+    wiped by a rebuild while the batch was in flight.
+    """
+    sent = set(report.sent)
+    errors = dict(report.failed)
+    skipped = []
+    for row in rows:
+        if row.id in sent or row.id in errors:
+            continue
+        if row.token in subscribed:
+            errors[row.id] = "Recipient missing from the roster"
+        else:
+            skipped.append(row.id)
+    failed = [
+        (row.id, row.attempts, errors[row.id]) for row in rows if row.id in errors
+    ]
+
+    for row in rows:
+        if row.id in sent:
+            NOTIFICATION_DELIVERY_DELAY.labels(channel).observe(
+                max(0.0, (utcnow() - row.created_at).total_seconds())
+            )
+    return sent, skipped, failed
+
+
+async def deliver_batch(channel):
+    """
+    Claims one batch of due messages for a channel and sends it.
+
+    The row locks are held until the outcome is committed, so a worker that
+    dies mid-batch leaves its messages to be claimed again by another.
+    Returns the number of messages claimed.
+    """
+    loop = asyncio.get_running_loop()
+    session = SessionLocal()
+
+    try:
+        rows = await loop.run_in_executor(None, claim, session, channel)
+        if not rows:
+            return 0
+
+        roster = email_roster if channel == "email" else sms_roster
+        report = DispatchReport(channel)
+
+        entries = {row.token: roster.get(row.token) for row in rows}
+
+        # Subscribers whose change has not reached the roster yet, or any
+        # missed by a stale one, are read from the database instead
+        missing = [token for token, entry in entries.items() if entry is None]
+        if missing:
+            entries.update(
+                await loop.run_in_executor(
+                    None, load_recipients, session, channel, missing
+                )
+            )
+
+        # A claim normally covers one transition, but retries can mix several
+        transitions = {}
+        for row in rows:
+            key = (row.correlation_id, row.subject, row.message)
+            transitions.setdefault(key, []).append(row)
+
+        for (correlation_id, subject, message), group in transitions.items():
+            recipients = [
+                (row.id, *entries[row.token])
+                for row in group
+                if entries[row.token] is not None
+            ]
+
+            # Logged under the id of the transition that queued the batch
+            with correlation(correlation_id):
+                if channel == "email":
+                    result = await send_email_notification(subject, message, recipients)
+                else:
+                    result = await send_sms_notification(message, recipients)
+                logger.info(
+                    "Sent %d of %d %s notifications",
+                    len(result.sent),
+                    len(group),
+                    channel,
+                    extra={"channel": channel},
+                )
+            report.sent.extend(result.sent)
+            report.failed.extend(result.failed)
+
+        # Addresses read for this batch alone are wiped like the roster's
+        for token in missing:
+            if entries[token] is not None:
+                wipe(entries[token][0])
+
+        # Only subscribers that are really gone are skipped for good
+        resolved = set(report.sent) | {message_id for message_id, _ in report.failed}
+        unresolved = [row.token for row in rows if row.id not in resolved]
+        subscribed = set()
+        if unresolved:
+            subscribed = await loop.run_in_executor(
+                None, subscribed_tokens, session, channel, unresolved
+            )
+
+        sent, skipped, failed = outcomes(channel, rows, report, subscribed)
+        dead = await loop.run_in_executor(
+            None, complete, session, sent, skipped, failed
+        )
+        if dead:
+            NOTIFICATION_DEAD_LETTERS.labels(channel).inc(dead)
+            logger.error(
+                "Dead-lettered %d %s notifications",
+                dead,
+                channel,
+                extra={"channel": channel},
+            )
+        return len(rows)
+    finally:
+        await loop.run_in_executor(None, session.close)
+
+
+async def deliver(channel):
+    """
+    Delivers outbox messages for one channel until cancelled.
+    """
+    wakeup = delivery_wakeups[channel]
+
+    # Messages are addressed through the roster, so wait for its first load
+    await asyncio.get_running_loop().run_in_executor(None, rosters_ready.wait)
+
+    while True:
+        try:
+            claimed = await deliver_batch(channel)
+        except Exception:
+            logger.exception("Error delivering %s notifications", channel)
+            claimed = 0
+
+        if not claimed:
+            # Sleep until new messages are enqueued or retries fall due
+            try:
+                await asyncio.wait_for(wakeup.wait(), OUTBOX_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            wakeup.clear()
+
+
+def on_outbox_change(payload):
+    """
+    Wakes the delivery workers; runs on the listener thread.
+    """
+    if delivery_loop is not None:
+        for wakeup in delivery_wakeups.values():
+            delivery_loop.call_soon_threadsafe(wakeup.set)
+
+
+def listener_handlers():
+    """
+    Notification handlers a process running delivery workers listens with.
+    """
+    return {
+        SUBSCRIPTIONS_CHANNEL: on_subscription_change,
+        OUTBOX_CHANNEL: on_outbox_change,
+    }
+
+
+async def run_delivery():
+    """
+    Runs one delivery worker per channel.
+
+    Any number of processes can run these; they share the outbox through
+    row locks.
+    """
+    global delivery_loop
+    delivery_loop = asyncio.get_running_loop()
+    for channel in ("email", "sms"):
+        delivery_wakeups[channel] = asyncio.Event()
+
+    await asyncio.gather(deliver("email"), deliver("sms"))
+
+
+if __name__ == "__main__":
+    # Extra dispatcher process, alongside the delivery workers of the monitor
+    setup_logging()
+    start_http_server(NOTIFIER_METRICS_PORT)
+    PgListener(DATABASE_URL, listener_handlers()).start()
+    try:
+        asyncio.run(run_delivery())
+    finally:
+        email_roster.clear()
+        sms_roster.clear()
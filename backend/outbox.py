@@ -0,0 +1,143 @@
+import os
+from dispatch import backoff
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy import Float, bindparam, func, literal, select, update
+from models import EmailSubscription, SMSSubscription, OutboxMessage, StatusTransition
+
+# Outbox configuration
+OUTBOX_CLAIM_SIZE = int(os.getenv("OUTBOX_CLAIM_SIZE", "200"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "10"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "1800"))
+
+# Subscription table behind each channel
+SUBSCRIPTIONS = {"email": EmailSubscription, "sms": SMSSubscription}
+
+
+def enqueue(session, area, status, subject, message, correlation_id=None):
+    """
+    Records a transition of one service area and queues one message per
+    subscriber of that area. The correlation id tags the delivery logs.
+
+    Runs on the caller's transaction, so the messages exist exactly when the
+    status change that caused them is committed.
+    """
+    transition_id = session.execute(
+        pg_insert(StatusTransition)
+        .values(
+            area=area,
+            status=status,
+            subject=subject,
+            message=message,
+            correlation_id=correlation_id,
+        )
+        .returning(StatusTransition.id)
+    ).scalar_one()
+
+    for channel, model in SUBSCRIPTIONS.items():
+        # Answered from the GIN index on areas, so the send volume follows
+        # the size of the affected area rather than of the whole audience
+        session.execute(
+            pg_insert(OutboxMessage)
+            .from_select(
+                ["transition_id", "channel", "token"],
+                select(literal(transition_id), literal(channel), model.token).where(
+                    model.areas.contains([area])
+                ),
+            )
+            .on_conflict_do_nothing()
+        )
+    return transition_id
+
+
+def claim(session, channel, limit=OUTBOX_CLAIM_SIZE):
+    """
+    Locks up to `limit` due messages for one channel.
+
+    Rows locked by other workers are skipped, and the locks are released
+    when the session commits or its connection drops, so messages claimed
+    by a crashed worker become due again straight away.
+    """
+    return session.execute(
+        select(
+            OutboxMessage.id,
+            OutboxMessage.token,
+            OutboxMessage.attempts,
+            StatusTransition.subject,
+            StatusTransition.message,
+            StatusTransition.created_at,
+            StatusTransition.correlation_id,
+        )
+        .join(StatusTransition, OutboxMessage.transition_id == StatusTransition.id)
+        .where(
+            OutboxMessage.channel == channel,
+            OutboxMessage.state == "pending",
+            OutboxMessage.next_attempt_at <= func.now(),
+        )
+        .order_by(OutboxMessage.id)
+        .limit(limit)
+        .with_for_update(of=OutboxMessage, skip_locked=True)
+    ).all()
+
+
+def complete(session, sent, skipped, failed):
+    """
+    Records the outcome of claimed messages and commits.
+
+    `sent` and `skipped` are message ids; `failed` holds (id, attempts,
+    error) tuples, which are retried with backoff until the attempt limit
+    and then dead-lettered. Returns the number of dead-lettered messages.
+    """
+    table = OutboxMessage.__table__
+
+    for ids, state in ((sent, "sent"), (skipped, "skipped")):
+        if ids:
+            session.execute(
+                update(table)
+                .where(table.c.id.in_(ids))
+                .values(
+                    state=state,
+                    attempts=table.c.attempts + 1,
+                    sent_at=func.now() if state == "sent" else None,
+                )
+            )
+
+    retries = []
+    dead = []
+    for message_id, attempts, error in failed:
+        attempts += 1
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            dead.append({"message_id": message_id, "error": str(error)})
+        else:
+            delay = backoff(attempts, OUTBOX_BACKOFF_BASE, OUTBOX_BACKOFF_MAX)
+            retries.append(
+                {"message_id": message_id, "error": str(error), "delay": delay}
+            )
+
+    if retries:
+        session.execute(
+            update(table)
+            .where(table.c.id == bindparam("message_id"))
+            .values(
+                attempts=table.c.attempts + 1,
+                last_error=bindparam("error"),
+                next_attempt_at=func.now()
+                + func.make_interval(0, 0, 0, 0, 0, 0, bindparam("delay", type_=Float)),
+            ),
+            retries,
+        )
+    if dead:
+        session.execute(
+            update(table)
+            .where(table.c.id == bindparam("message_id"))
+            .values(
+                state="dead",
+                attempts=table.c.attempts + 1,
+                last_error=bindparam("error"),
+            ),
+            dead,
+        )
+
+    session.commit()
+    return len(dead)
@@ -0,0 +1,49 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# PBKDF2 cost for new hashes; older hashes are upgraded on the next login
+PASSWORD_HASH_ITERATIONS = int(os.getenv("PASSWORD_HASH_ITERATIONS", "260000"))
+PASSWORD_HASH_METHOD = f"pbkdf2:sha256:{PASSWORD_HASH_ITERATIONS}"
+
+# Threads hashing passwords per process, and checks allowed to wait for one
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "8"))
+
+# hashlib releases the GIL while hashing, so the pool bounds the CPU that
+# a wave of logins can take from other requests
+executor = ThreadPoolExecutor(
+    max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash"
+)
+slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE)
+
+
+class HashingBusy(Exception):
+    """
+    Raised when more password hashes are waiting than the queue allows.
+    """
+
+
+def run(function, *args):
+    if not slots.acquire(blocking=False):
+        raise HashingBusy()
+    try:
+        return executor.submit(function, *args).result()
+    finally:
+        slots.release()
+
+
+def hash_password(password):
+    return run(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+
+def check_password(password_hash, password):
+    return run(check_password_hash, password_hash, password)
+
+
+def needs_rehash(password_hash):
+    """
+    Tells whether a hash was made under a different cost policy.
+    """
+    return not password_hash.startswith(f"{PASSWORD_HASH_METHOD}$")
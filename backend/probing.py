@@ -0,0 +1,278 @@
+import os
+import time
+import struct
+import random
+import logging
+import asyncio
+import aiohttp
+from ping3 import ping
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from metrics import PROBE_RTT, PROBE_FAILURES, PROBE_SLO_BREACHES
+
+logger = logging.getLogger(__name__)
+
+# Probe configuration
+PROBE_TIMEOUT = float(os.getenv("PROBE_TIMEOUT", "2"))
+PROBE_CONCURRENCY = int(os.getenv("PROBE_CONCURRENCY", "64"))
+
+# HTTP probes reuse connections, so keep them open across probe intervals
+HTTP_PROBE_KEEPALIVE = float(os.getenv("HTTP_PROBE_KEEPALIVE", "120"))
+
+# Name resolved by DNS probes that do not set one
+DNS_PROBE_NAME = os.getenv("DNS_PROBE_NAME", "example.com")
+DNS_TYPES = {"A": 1, "NS": 2, "CNAME": 5, "MX": 15, "TXT": 16, "AAAA": 28}
+
+# ping3 is blocking, so probes run on a bounded thread pool off the event loop
+probe_executor = ThreadPoolExecutor(
+    max_workers=PROBE_CONCURRENCY, thread_name_prefix="probe"
+)
+
+# Shared by every HTTP probe; created in the event loop on first use
+http_session = None
+
+
+def ping_endpoint(address, timeout=PROBE_TIMEOUT):
+    """
+    Pings a single endpoint and returns the round-trip time in seconds,
+    or None if the endpoint did not answer.
+    """
+    try:
+        rtt = ping(address, timeout=timeout)
+    except Exception as e:
+        logger.warning("Error pinging %s: %s", address, e)
+        return None
+
+    # ping3 returns None on timeout and False on error
+    if rtt is None or rtt is False:
+        return None
+    return rtt
+
+
+async def icmp_probe(address, params, timeout):
+    loop = asyncio.get_running_loop()
+    return await asyncio.wait_for(
+        loop.run_in_executor(probe_executor, ping_endpoint, address, timeout),
+        timeout + 1,
+    )
+
+
+async def tcp_probe(address, params, timeout):
+    """
+    Times a TCP handshake with params["port"].
+    """
+    started = time.perf_counter()
+    _, writer = await asyncio.wait_for(
+        asyncio.open_connection(address, params["port"]), timeout
+    )
+    rtt = time.perf_counter() - started
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        # The handshake was timed already; a reset on close changes nothing
+        pass
+    return rtt
+
+
+async def get_http_session():
+    global http_session
+    if http_session is None or http_session.closed:
+        http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=PROBE_CONCURRENCY, keepalive_timeout=HTTP_PROBE_KEEPALIVE
+            ),
+            headers={"User-Agent": "allo-guru-monitor"},
+        )
+    return http_session
+
+
+async def http_probe(address, params, timeout):
+    """
+    Times a HEAD request to params["url"], http://<address>/ by default.
+
+    Responses above params["max_status"], 399 by default, are failures.
+    """
+    session = await get_http_session()
+    url = params.get("url") or f"http://{address}/"
+    started = time.perf_counter()
+    async with session.head(
+        url,
+        allow_redirects=False,
+        timeout=aiohttp.ClientTimeout(total=timeout),
+    ) as response:
+        rtt = time.perf_counter() - started
+        if response.status > params.get("max_status", 399):
+            return None
+    return rtt
+
+
+def dns_query(name, record_type, query_id):
+    """
+    Builds a recursive DNS query for one record.
+    """
+    header = struct.pack("!HHHHHH", query_id, 0x0100, 1, 0, 0, 0)
+    labels = b"".join(
+        bytes([len(label)]) + label
+        for label in name.rstrip(".").encode("idna").split(b".")
+    )
+    return header + labels + b"\0" + struct.pack("!HH", DNS_TYPES[record_type], 1)
+
+
+def dns_answered(response, query_id):
+    """
+    Tells whether a DNS response answers the query without an error.
+    """
+    if len(response) < 12:
+        return False
+    response_id, flags, _, answers = struct.unpack_from("!HHHH", response)
+    # A response to our query, without an error code, with at least one answer
+    return (
+        response_id == query_id
+        and bool(flags & 0x8000)
+        and not flags & 0xF
+        and answers > 0
+    )
+
+
+class DatagramReply(asyncio.DatagramProtocol):
+    # Resolves the future with the first datagram received
+    def __init__(self, future):
+        self.future = future
+
+    def datagram_received(self, data, addr):
+        if not self.future.done():
+            self.future.set_result(data)
+
+    def error_received(self, exc):
+        if not self.future.done():
+            self.future.set_exception(exc)
+
+
+async def dns_probe(address, params, timeout):
+    """
+    Times resolving params["name"] through the DNS server at the endpoint
+    address over UDP. Errors and empty answers are failures.
+    """
+    loop = asyncio.get_running_loop()
+    query_id = random.getrandbits(16)
+    query = dns_query(
+        params.get("name", DNS_PROBE_NAME), params.get("record", "A"), query_id
+    )
+
+    reply = loop.create_future()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: DatagramReply(reply),
+        remote_addr=(address, params.get("port", 53)),
+    )
+    try:
+        started = time.perf_counter()
+        transport.sendto(query)
+        response = await asyncio.wait_for(reply, timeout)
+        rtt = time.perf_counter() - started
+    finally:
+        transport.close()
+    return rtt if dns_answered(response, query_id) else None
+
+
+# Probe functions by type; each returns the round-trip time in seconds, or
+# None for a failed probe, and may raise on errors and timeouts
+PROBES = {
+    "icmp": icmp_probe,
+    "tcp": tcp_probe,
+    "http": http_probe,
+    "dns": dns_probe,
+}
+
+
+def is_int_between(value, low, high):
+    # JSON booleans are ints in Python, but never a valid port or status
+    return (
+        isinstance(value, int) and not isinstance(value, bool) and low <= value <= high
+    )
+
+
+def validate_probe(probe_type, params):
+    """
+    Returns a description of what is wrong with a probe configuration, or
+    None if it is valid.
+    """
+    if probe_type not in PROBES:
+        return f"'type' must be one of {', '.join(PROBES)}."
+    if not isinstance(params, dict):
+        return "'params' must be an object."
+    if probe_type == "tcp" and not is_int_between(params.get("port"), 1, 65535):
+        return "TCP probes need a 'port' between 1 and 65535."
+    if probe_type == "http":
+        url = params.get("url")
+        if url is not None and (
+            not isinstance(url, str) or urlsplit(url).scheme not in ("http", "https")
+        ):
+            return "'url' must be an http or https URL."
+        if not is_int_between(params.get("max_status", 399), 100, 599):
+            return "'max_status' must be an HTTP status between 100 and 599."
+    if probe_type == "dns":
+        if not is_int_between(params.get("port", 53), 1, 65535):
+            return "'port' must be between 1 and 65535."
+        if params.get("record", "A") not in DNS_TYPES:
+            return f"'record' must be one of {', '.join(DNS_TYPES)}."
+        # Checked here, as dns_query would fail on every probe otherwise
+        name = params.get("name", DNS_PROBE_NAME)
+        try:
+            labels = name.rstrip(".").encode("idna").split(b".")
+        except (AttributeError, UnicodeError):
+            labels = []
+        if not labels or not all(0 < len(label) < 64 for label in labels):
+            return "'name' must be a valid domain name."
+    return None
+
+
+async def probe_endpoint(
+    address, semaphore, timeout=PROBE_TIMEOUT, probe_type="icmp", params=None
+):
+    """
+    Runs one probe of the given type, bounded by the semaphore, and returns
+    its round-trip time in seconds or None.
+    """
+    # The timeout only starts once a slot is free, so queued probes are not
+    # charged for the time they spend waiting behind other probes
+    async with semaphore:
+        try:
+            rtt = await PROBES[probe_type](address, params or {}, timeout)
+            # Probes return None when the endpoint answered but not as
+            # expected; ping3 cannot tell, so a missed ping is a timeout
+            reason = "timeout" if probe_type == "icmp" else "bad_response"
+        except asyncio.TimeoutError:
+            rtt, reason = None, "timeout"
+        except (OSError, aiohttp.ClientError):
+            rtt, reason = None, "error"
+        except Exception as e:
+            # Still a failed probe, so the endpoint keeps counting in its area
+            logger.warning("Error probing %s: %r", address, e, extra={"sample": True})
+            rtt, reason = None, "error"
+
+    if rtt is None:
+        PROBE_FAILURES.labels(address, reason).inc()
+    else:
+        PROBE_RTT.labels(address).observe(rtt)
+    return rtt
+
+
+def within_slo(address, rtt, slo):
+    """
+    Tells whether a probe succeeded within its latency threshold, if any.
+    """
+    if rtt is None:
+        return False
+    if slo is not None and rtt > slo:
+        PROBE_SLO_BREACHES.labels(address).inc()
+        return False
+    return True
+
+
+async def close():
+    """
+    Closes the connections kept open by HTTP probes.
+    """
+    if http_session is not None:
+        await http_session.close()
@@ -0,0 +1,84 @@
+import json
+import time
+import select
+import logging
+import psycopg2
+import threading
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# PostgreSQL channels carrying service status, endpoint, subscriber and
+# outbox changes
+STATUS_CHANNEL = "service_status"
+ENDPOINTS_CHANNEL = "isp_endpoints"
+SUBSCRIPTIONS_CHANNEL = "subscriptions"
+OUTBOX_CHANNEL = "notification_outbox"
+
+
+def publish(session, channel, payload):
+    """
+    Queues a NOTIFY on the session's transaction.
+
+    PostgreSQL delivers it to listeners only when the transaction commits.
+    """
+    session.execute(
+        text("SELECT pg_notify(:channel, :payload)"),
+        {"channel": channel, "payload": json.dumps(payload)},
+    )
+
+
+class PgListener(threading.Thread):
+    """
+    Background thread that holds one LISTEN connection and passes every
+    notification on the given channels to its handler.
+
+    Handlers receive the decoded JSON payload, or None after a reconnect so
+    they can resynchronise anything they may have missed.
+    """
+
+    def __init__(self, dsn, handlers, poll_interval=5, reconnect_delay=1):
+        super().__init__(daemon=True, name="pg-listener")
+        self.dsn = dsn
+        self.handlers = handlers
+        self.poll_interval = poll_interval
+        self.reconnect_delay = reconnect_delay
+
+    def _dispatch(self, channel, payload):
+        try:
+            self.handlers[channel](payload)
+        except Exception:
+            logger.exception("Error handling notification on %s", channel)
+
+    def _listen(self):
+        connection = psycopg2.connect(self.dsn)
+        try:
+            connection.set_isolation_level(
+                psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT
+            )
+            with connection.cursor() as cursor:
+                for channel in self.handlers:
+                    cursor.execute(f'LISTEN "{channel}"')
+
+            # Notifications may have been missed while disconnected
+            for channel in self.handlers:
+                self._dispatch(channel, None)
+
+            while True:
+                readable, _, _ = select.select([connection], [], [], self.poll_interval)
+                if not readable:
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    notify = connection.notifies.pop(0)
+                    self._dispatch(notify.channel, json.loads(notify.payload))
+        finally:
+            connection.close()
+
+    def run(self):
+        while True:
+            try:
+                self._listen()
+            except Exception as e:
+                logger.warning("Listener connection lost: %s", e)
+            time.sleep(self.reconnect_delay)
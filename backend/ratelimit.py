@@ -0,0 +1,271 @@
+import os
+import time
+import fcntl
+import struct
+import hashlib
+import tempfile
+import threading
+from shm import open_shared_map
+
+# Shared limiter state; one file per host, like the response cache counters
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_SLOTS = int(os.getenv("RATE_LIMIT_SLOTS", "65536"))
+RATE_LIMIT_SHM_PATH = os.getenv(
+    "RATE_LIMIT_SHM_PATH",
+    os.path.join(
+        "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+        "allo_guru_ratelimit",
+    ),
+)
+
+# Slots tried for a key before the stalest one is reused
+PROBE_LIMIT = 8
+
+# Key hash, window number, hits in that window, hits in the window before,
+# and the window length in seconds, which keys of different limits differ in
+SLOT = struct.Struct("<QqIId")
+
+
+class Limit:
+    __slots__ = ("count", "window")
+
+    def __init__(self, count, window):
+        self.count = count
+        self.window = window
+
+    def __repr__(self):
+        return f"<Limit {self.count}/{self.window}s>"
+
+
+def parse_limit(value):
+    """
+    Parses "count/seconds", e.g. "10/60". Empty or zero disables the limit.
+    """
+    if not value or value.strip() in ("0", "off"):
+        return None
+    count, window = value.split("/")
+    return Limit(int(count), float(window))
+
+
+# Limits per route and key. Twilio posts every SMS webhook from its own
+# addresses, so /api/sms is limited by phone number rather than IP. Every
+# login attempt counts against the client, but only failed ones count
+# against the account, which is locked once they reach the limit.
+RATE_LIMITS = {
+    "subscribe": {
+        "ip": parse_limit(os.getenv("RATE_LIMIT_SUBSCRIBE_IP", "10/60")),
+        "email": parse_limit(os.getenv("RATE_LIMIT_SUBSCRIBE_EMAIL", "3/3600")),
+        "global": parse_limit(os.getenv("RATE_LIMIT_SUBSCRIBE_GLOBAL", "50/1")),
+    },
+    "sms": {
+        "ip": parse_limit(os.getenv("RATE_LIMIT_SMS_IP", "")),
+        "phone": parse_limit(os.getenv("RATE_LIMIT_SMS_PHONE", "5/3600")),
+        "global": parse_limit(os.getenv("RATE_LIMIT_SMS_GLOBAL", "50/1")),
+    },
+    "login": {
+        "ip": parse_limit(os.getenv("RATE_LIMIT_LOGIN_IP", "20/60")),
+    },
+    "login_failures": {
+        "account": parse_limit(os.getenv("RATE_LIMIT_LOGIN_ACCOUNT", "5/900")),
+    },
+}
+
+
+def key_hash(key):
+    digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+    # Zero marks an empty slot
+    return int.from_bytes(digest, "little") or 1
+
+
+class SlidingWindowLimiter:
+    """
+    Sliding-window rate limiter whose counters live in a memory-mapped file
+    shared by every worker on the host.
+
+    Each key keeps hit counts for the current and previous fixed windows;
+    the previous count is weighted by how much of it still overlaps the
+    sliding window. Keys hash into a fixed table, so memory stays bounded
+    and the oldest keys are evicted under pressure.
+    """
+
+    def __init__(self, path, slots=RATE_LIMIT_SLOTS, clock=time.time):
+        self.path = path
+        self.slots = slots
+        self.size = SLOT.size * slots
+        self.clock = clock
+        self.fd = None
+        self.buffer = None
+        # flock only excludes other processes, so threads also take this lock
+        self.lock = threading.Lock()
+
+    def _map(self):
+        # Mapped lazily so each forked worker gets its own mapping
+        if self.buffer is None:
+            with self.lock:
+                if self.buffer is None:
+                    self.fd, self.buffer = open_shared_map(self.path, self.size)
+        return self.buffer
+
+    def _find(self, buffer, hashed, now, limit=None):
+        """
+        Returns the offset of the key's slot, claiming one for `limit` if it
+        has none, or None if it has none and no limit is given.
+        """
+        start = hashed % self.slots
+        offsets = [SLOT.size * ((start + i) % self.slots) for i in range(PROBE_LIMIT)]
+        for offset in offsets:
+            if SLOT.unpack_from(buffer, offset)[0] == hashed:
+                return offset
+        if limit is None:
+            return None
+
+        # Empty slots, and slots idle for two of their own windows, carry no
+        # state; otherwise the slot that would become idle soonest is reused
+        victim = None
+        victim_expiry = None
+        for offset in offsets:
+            slot_key, slot_window, _, _, slot_length = SLOT.unpack_from(buffer, offset)
+            expiry = (slot_window + 2) * slot_length
+            if slot_key == 0 or expiry <= now:
+                victim = offset
+                break
+            if victim is None or expiry < victim_expiry:
+                victim, victim_expiry = offset, expiry
+
+        SLOT.pack_into(
+            buffer, victim, hashed, int(now // limit.window), 0, 0, limit.window
+        )
+        return victim
+
+    def _estimate(self, buffer, offset, limit, now):
+        """
+        Returns (estimate, current, previous, window_number) for a slot,
+        rolling its windows forward to now.
+        """
+        window_number = int(now // limit.window)
+        _, slot_window, current, previous, _ = SLOT.unpack_from(buffer, offset)
+        if slot_window == window_number - 1:
+            current, previous = 0, current
+        elif slot_window != window_number:
+            current, previous = 0, 0
+
+        elapsed = (now % limit.window) / limit.window
+        return previous * (1 - elapsed) + current, current, previous, window_number
+
+    def _retry_after(self, limit, now, current, previous):
+        elapsed = (now % limit.window) / limit.window
+        if current + 1 > limit.count or not previous:
+            return limit.window * (1 - elapsed)
+        # Wait until the previous window's weight has decayed enough
+        needed = 1 - (limit.count - 1 - current) / previous
+        return max(0.0, (needed - elapsed) * limit.window)
+
+    def hit(self, checks, count=True):
+        """
+        Counts one hit against every (key, limit) pair, all or nothing.
+
+        Returns 0 if the hit is allowed, otherwise the number of seconds
+        until it would be, in which case nothing is counted. With count
+        false the hit is only evaluated, never counted.
+        """
+        buffer = self._map()
+        now = self.clock()
+
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                slots = []
+                retry_after = 0.0
+                for key, limit in checks:
+                    hashed = key_hash(key)
+                    offset = self._find(buffer, hashed, now, limit if count else None)
+                    if offset is None:
+                        continue
+                    estimate, current, previous, window_number = self._estimate(
+                        buffer, offset, limit, now
+                    )
+                    if estimate + 1 > limit.count:
+                        retry_after = max(
+                            retry_after,
+                            self._retry_after(limit, now, current, previous),
+                            0.001,
+                        )
+                    slots.append(
+                        (offset, hashed, window_number, current, previous, limit)
+                    )
+
+                if retry_after or not count:
+                    return retry_after
+
+                for offset, hashed, window_number, current, previous, limit in slots:
+                    SLOT.pack_into(
+                        buffer,
+                        offset,
+                        hashed,
+                        window_number,
+                        current + 1,
+                        previous,
+                        limit.window,
+                    )
+                return 0.0
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def clear(self, keys):
+        """
+        Forgets every hit counted against the given keys.
+        """
+        buffer = self._map()
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                for key in keys:
+                    hashed = key_hash(key)
+                    offset = self._find(buffer, hashed, 0)
+                    if offset is not None:
+                        _, slot_window, _, _, length = SLOT.unpack_from(buffer, offset)
+                        SLOT.pack_into(
+                            buffer, offset, hashed, slot_window, 0, 0, length
+                        )
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def _checks(self, route, identities):
+        checks = []
+        for name, limit in RATE_LIMITS[route].items():
+            if limit is None:
+                continue
+            if name == "global":
+                checks.append((f"{route}:global", limit))
+            elif identities.get(name):
+                checks.append((f"{route}:{name}:{identities[name]}", limit))
+        return checks
+
+    def check(self, route, **identities):
+        """
+        Applies the configured limits for a route.
+
+        Identities name the caller, e.g. ip="203.0.113.7" or email=<hash>;
+        the global limit needs none. Returns 0 if allowed, otherwise the
+        seconds to wait.
+        """
+        if not RATE_LIMIT_ENABLED:
+            return 0.0
+        checks = self._checks(route, identities)
+        return self.hit(checks) if checks else 0.0
+
+    def exceeded(self, route, **identities):
+        """
+        Like check(), but without counting a hit.
+        """
+        if not RATE_LIMIT_ENABLED:
+            return 0.0
+        checks = self._checks(route, identities)
+        return self.hit(checks, count=False) if checks else 0.0
+
+    def reset(self, route, **identities):
+        """
+        Forgets the hits counted against a route's identities.
+        """
+        if RATE_LIMIT_ENABLED:
+            self.clear(key for key, _ in self._checks(route, identities))
@@ -0,0 +1,82 @@
+import argparse
+from config import SessionLocal
+from encryption import Encryptor
+from sqlalchemy import bindparam, update
+from models import EmailSubscription, SMSSubscription
+
+encryptor = Encryptor()
+
+
+def reencrypt_table(model, column, batch_size, processes=None):
+    """
+    Re-encrypts one column under the primary key.
+
+    Rows are walked in primary key order and each batch is committed on its
+    own, so only the rows of the current batch are ever locked.
+    """
+    table = model.__table__
+    statement = (
+        update(table)
+        .where(table.c.id == bindparam("row_id"))
+        .values({column.key: bindparam("value")})
+    )
+
+    last_id = 0
+    total = 0
+    while True:
+        session = SessionLocal()
+        try:
+            rows = (
+                session.query(model.id, column)
+                .filter(model.id > last_id)
+                .order_by(model.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                break
+
+            rotated = encryptor.rotate_many(
+                [value for _, value in rows], processes=processes
+            )
+            session.execute(
+                statement,
+                [
+                    {"row_id": row_id, "value": value}
+                    for (row_id, _), value in zip(rows, rotated)
+                ],
+            )
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+        last_id = rows[-1][0]
+        total += len(rows)
+        print(f"Re-encrypted {total} rows of {table.name}")
+
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Re-encrypt subscriber contact details under the newest key."
+    )
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    reencrypt_table(
+        EmailSubscription,
+        EmailSubscription.encrypted_email,
+        args.batch_size,
+        args.processes,
+    )
+    reencrypt_table(
+        SMSSubscription,
+        SMSSubscription.encrypted_phone,
+        args.batch_size,
+        args.processes,
+    )
@@ -0,0 +1,128 @@
+import threading
+
+
+def wipe(address):
+    # Overwrite the decrypted address in place so it does not linger in memory
+    address[:] = bytes(len(address))
+
+
+class Roster:
+    """
+    Compact in-memory list of decrypted recipients for one channel.
+
+    Recipients live in parallel arrays indexed by slot, with addresses kept
+    as bytearrays so they can be wiped when a subscriber leaves. Freed slots
+    are reused by later subscribers.
+    """
+
+    __slots__ = ("channel", "tokens", "addresses", "links", "slots", "free", "lock")
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.tokens = []
+        self.addresses = []
+        self.links = []
+        self.slots = {}
+        self.free = []
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.slots)
+
+    def _add(self, token, address, link):
+        address = bytearray(address.encode())
+        slot = self.slots.get(token)
+        if slot is not None:
+            wipe(self.addresses[slot])
+        elif self.free:
+            slot = self.free.pop()
+        else:
+            slot = len(self.tokens)
+            self.tokens.append(None)
+            self.addresses.append(None)
+            self.links.append(None)
+
+        self.tokens[slot] = token
+        self.addresses[slot] = address
+        self.links[slot] = link
+        self.slots[token] = slot
+
+    def add(self, token, address, link=None):
+        """
+        Adds or replaces a recipient.
+        """
+        with self.lock:
+            self._add(token, address, link)
+
+    def get(self, token):
+        """
+        Returns (address, link) for a recipient, or None if it is not listed.
+        """
+        with self.lock:
+            slot = self.slots.get(token)
+            if slot is None:
+                return None
+            return self.addresses[slot], self.links[slot]
+
+    def remove(self, token):
+        """
+        Removes a recipient and wipes its address.
+        """
+        with self.lock:
+            slot = self.slots.pop(token, None)
+            if slot is None:
+                return
+            wipe(self.addresses[slot])
+            self.tokens[slot] = self.addresses[slot] = self.links[slot] = None
+            self.free.append(slot)
+
+    def clear(self):
+        """
+        Removes every recipient and wipes every address.
+        """
+        with self.lock:
+            for address in self.addresses:
+                if address is not None:
+                    wipe(address)
+            self.tokens, self.addresses, self.links = [], [], []
+            self.slots, self.free = {}, []
+
+    def rebuild(self, batches):
+        """
+        Replaces the roster with recipients read from the database.
+
+        `batches` yields lists of (token, address, link) tuples. Changes
+        applied while the rebuild runs are lost, so callers start listening
+        for changes before rebuilding and replay them afterwards.
+        """
+        fresh = Roster(self.channel)
+        for batch in batches:
+            for token, address, link in batch:
+                fresh._add(token, address, link)
+
+        with self.lock:
+            old_addresses = self.addresses
+            self.tokens, self.addresses, self.links = (
+                fresh.tokens,
+                fresh.addresses,
+                fresh.links,
+            )
+            self.slots, self.free = fresh.slots, fresh.free
+
+        for address in old_addresses:
+            if address is not None:
+                wipe(address)
+
+    def snapshot(self):
+        """
+        Returns the current recipients as (token, address, link) tuples.
+
+        Addresses are shared with the roster, so a recipient removed while
+        an alert is in flight shows up as an all-zero address.
+        """
+        with self.lock:
+            return [
+                recipient
+                for recipient in zip(self.tokens, self.addresses, self.links)
+                if recipient[0] is not None
+            ]
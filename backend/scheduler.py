@@ -0,0 +1,37 @@
+import logging
+import asyncio
+from metrics import LOOP_DRIFT, MISSED_TICKS
+
+logger = logging.getLogger(__name__)
+
+
+async def run_every(name, interval, callback):
+    """
+    Awaits callback() on a fixed cadence of start + k * interval.
+
+    Ticks are scheduled from the start time rather than from the end of the
+    previous run, so the period never stretches by the time the callback
+    takes. Ticks that pass while a run is still in progress are skipped and
+    reported instead of being run late back to back.
+    """
+    loop = asyncio.get_running_loop()
+    next_run = loop.time()
+
+    while True:
+        delay = next_run - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        LOOP_DRIFT.labels(name).observe(max(loop.time() - next_run, 0))
+
+        try:
+            await callback()
+        except Exception:
+            logger.exception("Error running %s", name)
+
+        next_run += interval
+        now = loop.time()
+        if now > next_run:
+            missed = int((now - next_run) // interval) + 1
+            next_run += missed * interval
+            MISSED_TICKS.labels(name).inc(missed)
+            logger.warning("Missed %d tick(s) of %s", missed, name)
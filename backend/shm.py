@@ -0,0 +1,19 @@
+import os
+import mmap
+import fcntl
+
+
+def open_shared_map(path, size):
+    """
+    Opens the file at path, growing it to at least size bytes, and maps it
+    shared. Returns (fd, buffer); callers flock the fd to serialize writes.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    # Locked so two processes creating the file do not both truncate it
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    try:
+        if os.fstat(fd).st_size < size:
+            os.ftruncate(fd, size)
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    return fd, mmap.mmap(fd, size)
@@ -0,0 +1,257 @@
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Consecutive failed or successful probe ticks before an endpoint changes state
+DOWN_THRESHOLD = int(os.getenv("DOWN_THRESHOLD", "3"))
+UP_THRESHOLD = int(os.getenv("UP_THRESHOLD", "2"))
+
+# Number of endpoints that must be down for the ISP to be down; a majority
+# of the monitored endpoints when unset
+DOWN_QUORUM = int(os.getenv("DOWN_QUORUM", "0")) or None
+
+# Flap suppression: every transition adds a penalty that decays exponentially.
+# Notifications stop once the penalty reaches the suppress limit and resume
+# when it has decayed below the reuse limit.
+FLAP_PENALTY = float(os.getenv("FLAP_PENALTY", "1000"))
+FLAP_SUPPRESS_LIMIT = float(os.getenv("FLAP_SUPPRESS_LIMIT", "2500"))
+FLAP_REUSE_LIMIT = float(os.getenv("FLAP_REUSE_LIMIT", "750"))
+FLAP_HALF_LIFE = float(os.getenv("FLAP_HALF_LIFE", "900"))
+
+
+class EndpointState:
+    """
+    Hysteresis for one endpoint: it only flips after enough consecutive
+    probe ticks disagree with its current state.
+    """
+
+    __slots__ = ("up", "failures", "successes")
+
+    def __init__(self, up=True, failures=0, successes=0):
+        self.up = up
+        self.failures = failures
+        self.successes = successes
+
+    def observe(self, success, down_threshold, up_threshold):
+        if success:
+            self.successes += 1
+            self.failures = 0
+            if not self.up and self.successes >= up_threshold:
+                self.up = True
+        else:
+            self.failures += 1
+            self.successes = 0
+            if self.up and self.failures >= down_threshold:
+                self.up = False
+
+
+class StateEngine:
+    """
+    Combines per-endpoint hysteresis, a k-of-n quorum and exponential flap
+    suppression into the ISP state and the notifications it should trigger.
+    """
+
+    def __init__(
+        self,
+        down_threshold=DOWN_THRESHOLD,
+        up_threshold=UP_THRESHOLD,
+        quorum=DOWN_QUORUM,
+        clock=time.time,
+    ):
+        self.down_threshold = down_threshold
+        self.up_threshold = up_threshold
+        self.quorum = quorum
+        self.clock = clock
+        self.endpoints = {}
+        self.state = None  # True when online, None until first evaluated
+        self.notified_state = None  # Last state subscribers were told about
+        self.penalty = 0.0
+        self.penalty_at = clock()
+        self.suppressed = False
+
+    def observe(self, address, success):
+        endpoint = self.endpoints.get(address)
+        if endpoint is None:
+            endpoint = self.endpoints[address] = EndpointState()
+        endpoint.observe(success, self.down_threshold, self.up_threshold)
+
+    def forget(self, address):
+        self.endpoints.pop(address, None)
+
+    def seed(self, address, values):
+        """
+        Takes an endpoint's [up, failures, successes] as reported by the
+        monitor worker that probes it.
+        """
+        self.endpoints[address] = EndpointState(*values)
+
+    def report(self, addresses):
+        return {
+            address: [endpoint.up, endpoint.failures, endpoint.successes]
+            for address, endpoint in self.endpoints.items()
+            if address in addresses
+        }
+
+    def _decay(self, now):
+        elapsed = max(now - self.penalty_at, 0)
+        self.penalty *= 0.5 ** (elapsed / FLAP_HALF_LIFE)
+        self.penalty_at = now
+
+    def evaluate(self):
+        """
+        Updates the ISP state from the endpoint states.
+
+        Returns (changed, notify): whether the state changed, and the state
+        subscribers should now be told about, or None if they should not be
+        notified.
+        """
+        now = self.clock()
+        self._decay(now)
+
+        changed = False
+        if self.endpoints:
+            quorum = self.quorum or len(self.endpoints) // 2 + 1
+            down = sum(not endpoint.up for endpoint in self.endpoints.values())
+            state = down < min(quorum, len(self.endpoints))
+            if state != self.state:
+                if self.state is not None:
+                    self.penalty += FLAP_PENALTY
+                self.state = state
+                changed = True
+
+        if self.suppressed and self.penalty < FLAP_REUSE_LIMIT:
+            self.suppressed = False
+        elif not self.suppressed and self.penalty >= FLAP_SUPPRESS_LIMIT:
+            self.suppressed = True
+            logger.warning("ISP state is flapping, suppressing notifications")
+
+        notify = None
+        if (
+            self.state is not None
+            and not self.suppressed
+            and self.state != self.notified_state
+        ):
+            # The very first known state is adopted silently, not announced
+            if self.notified_state is not None:
+                notify = self.state
+            self.notified_state = self.state
+        return changed, notify
+
+    def to_dict(self):
+        return {
+            "state": self.state,
+            "notified_state": self.notified_state,
+            "penalty": self.penalty,
+            "penalty_at": self.penalty_at,
+            "suppressed": self.suppressed,
+            "endpoints": self.report(self.endpoints),
+        }
+
+    def rollback(self, data):
+        """
+        Takes the ISP state back to `data`, as saved by to_dict(), keeping
+        the endpoint states observed since.
+        """
+        self.state = data.get("state")
+        self.notified_state = data.get("notified_state")
+        self.penalty = data.get("penalty", 0.0)
+        self.penalty_at = data.get("penalty_at", self.clock())
+        self.suppressed = data.get("suppressed", False)
+
+    def restore(self, data):
+        self.rollback(data)
+        self.endpoints = {
+            address: EndpointState(*values)
+            for address, values in data.get("endpoints", {}).items()
+        }
+
+
+class AreaStates:
+    """
+    One StateEngine per service area, so each area's state is decided by
+    its own endpoints and an outage in one area only alerts that area.
+    """
+
+    def __init__(self, default_area, factory=StateEngine):
+        self.default_area = default_area
+        self.factory = factory
+        self.areas = {}
+
+    def engine(self, area):
+        engine = self.areas.get(area)
+        if engine is None:
+            engine = self.areas[area] = self.factory()
+        return engine
+
+    def observe(self, area, address, success):
+        self.engine(area).observe(address, success)
+
+    def seed(self, area, address, values):
+        self.engine(area).seed(address, values)
+
+    def report(self, addresses):
+        report = {}
+        for engine in self.areas.values():
+            report.update(engine.report(addresses))
+        return report
+
+    def prune(self, endpoints):
+        """
+        Forgets endpoints that are gone or moved to another area, and areas
+        left without endpoints. `endpoints` maps addresses to ProbeSpecs.
+        """
+        for area in list(self.areas):
+            engine = self.areas[area]
+            for address in list(engine.endpoints):
+                spec = endpoints.get(address)
+                if spec is None or spec.area != area:
+                    engine.forget(address)
+
+        areas = {spec.area for spec in endpoints.values()}
+        for area in list(self.areas):
+            if area not in areas:
+                del self.areas[area]
+
+    def evaluate(self):
+        """
+        Returns (area, changed, notify) for every area, as
+        StateEngine.evaluate() does for one.
+        """
+        return [
+            (area, *engine.evaluate()) for area, engine in sorted(self.areas.items())
+        ]
+
+    def adopt(self, statuses):
+        """
+        Takes each area's published status, "online" or "offline", as
+        already announced.
+        """
+        for area, status in statuses.items():
+            engine = self.engine(area)
+            engine.state = engine.notified_state = status == "online"
+
+    def to_dict(self):
+        return {
+            "areas": {area: engine.to_dict() for area, engine in self.areas.items()}
+        }
+
+    def rollback(self, data):
+        """
+        Takes the state of every area back to `data`, as saved by
+        to_dict(), so transitions that were not committed are evaluated
+        and announced again. Areas added since start over as new engines.
+        """
+        for area, engine in self.areas.items():
+            area_data = data["areas"].get(area)
+            if area_data is None:
+                area_data = self.factory().to_dict()
+            engine.rollback(area_data)
+
+    def restore(self, data):
+        # State saved before areas existed belongs to the default area
+        areas = data["areas"] if "areas" in data else {self.default_area: data}
+        self.areas = {}
+        for area, area_data in areas.items():
+            self.engine(area).restore(area_data)
@@ -1,5 +1,5 @@
 import pytest
-from app import app  # Replace 'app' with the actual name of your Flask app module if different
+from app import app, parse_areas, parse_sms_command  # Replace 'app' with the actual name of your Flask app module if different
 
 @pytest.fixture
 def client():
@@ -35,14 +35,15 @@ def test_sms_reply_subscribe(client):
     mock_from_number = '+1234567890'
     response = client.post('/api/sms', data={'Body': mock_body_subscribe, 'From': mock_from_number})
     assert response.status_code == 200
-    # Assert the response contains the subscription confirmation message
+    assert b'Thank you for subscribing' in response.data or b'already subscribed' in response.data
 
 def test_sms_reply_unsubscribe(client):
     mock_body_unsubscribe = 'UNSUBSCRIBE'
     mock_from_number = '+1234567890'
     response = client.post('/api/sms', data={'Body': mock_body_unsubscribe, 'From': mock_from_number})
     assert response.status_code == 200
-    # Assert the response contains the unsubscription confirmation message
+    # UNSUBSCRIBE must not be taken for SUBSCRIBE
+    assert b'subscribed from SMS alerts' in response.data or b'were not subscribed' in response.data
 
 def test_sms_reply_invalid_command(client):
     mock_body_invalid = 'INVALID_COMMAND'
@@ -51,4 +52,39 @@ def test_sms_reply_invalid_command(client):
     assert response.status_code == 200
     # Assert the response contains a message for unrecognized commands
 
+# The command is the first word, so UNSUBSCRIBE is not read as SUBSCRIBE
+def test_parse_sms_command():
+    assert parse_sms_command(' unsubscribe ') == ('UNSUBSCRIBE', '')
+    assert parse_sms_command('Subscribe north, south') == ('SUBSCRIBE', 'north, south')
+    assert parse_sms_command('') == ('', '')
+
+# The /internal/ routes answer local peers only, whatever X-Forwarded-For says
+def test_internal_routes_are_local_only(client):
+    assert client.get('/internal/metrics').status_code == 200
+    remote = {'REMOTE_ADDR': '203.0.113.7'}
+    response = client.get('/internal/metrics', environ_base=remote)
+    assert response.status_code == 404
+    response = client.get('/internal/metrics', environ_base=remote, headers={'X-Forwarded-For': '127.0.0.1'})
+    assert response.status_code == 404
+
+# Only areas other than the default are looked up, and only those asked for
+def test_parse_areas_queries_requested_names():
+    class Session:
+        queries = 0
+        def query(self, column):
+            self.queries += 1
+            return self
+        def filter(self, criterion):
+            self.names = set(criterion.right.value)
+            return self
+        def distinct(self):
+            return [('north',)] if 'north' in self.names else []
+
+    session = Session()
+    assert parse_areas(session, '') == (['default'], [])
+    assert parse_areas(session, 'Default') == (['default'], [])
+    assert session.queries == 0
+    assert parse_areas(session, 'north, mars') == (['north'], ['mars'])
+    assert session.queries == 1 and session.names == {'north', 'mars'}
+
 # Additional tests can be added here
@@ -0,0 +1,69 @@
+from cache import IdentityCache, SharedCounters, ResponseCache
+
+
+def make_cache(tmp_path, ttl=60):
+    counters = SharedCounters(str(tmp_path / "counters"), ["status"])
+    return ResponseCache(counters, ttl=ttl), counters
+
+
+# Hits are served without calling the loader again
+def test_response_cache_reads_through(tmp_path):
+    cache, _ = make_cache(tmp_path)
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return '{"message": "ok"}', None
+
+    first = cache.get("status", loader)
+    second = cache.get("status", loader)
+
+    assert first is second
+    assert len(calls) == 1
+
+
+# A bump from another process invalidates the local entry
+def test_response_cache_invalidated_by_shared_counter(tmp_path):
+    cache, counters = make_cache(tmp_path)
+    other_process = SharedCounters(counters.path, ["status"])
+    bodies = iter(['{"message": "up"}', '{"message": "down"}'])
+
+    first = cache.get("status", lambda: (next(bodies), None))
+    other_process.bump("status")
+    second = cache.get("status", lambda: (next(bodies), None))
+
+    assert first.body != second.body
+    assert first.etag != second.etag
+
+
+# Entries expire after the TTL even without an invalidation
+def test_response_cache_expires(tmp_path):
+    cache, _ = make_cache(tmp_path, ttl=0)
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return "{}", None
+
+    cache.get("status", loader)
+    cache.get("status", loader)
+
+    assert len(calls) == 2
+
+
+# Identities are forgotten when any process invalidates them, and the least
+# recently used one is evicted first
+def test_identity_cache(tmp_path):
+    counters = SharedCounters(str(tmp_path / "counters"), ["superusers"])
+    cache = IdentityCache(counters, "superusers", ttl=60, size=2)
+
+    known, generation = cache.lookup("admin")
+    assert not known
+    cache.add("admin", generation)
+    cache.add("ops", generation)
+    assert cache.lookup("admin")[0]
+    cache.add("audit", generation)
+    assert cache.lookup("admin")[0] and not cache.lookup("ops")[0]
+
+    SharedCounters(counters.path, ["superusers"]).bump("superusers")
+    assert not cache.lookup("admin")[0]
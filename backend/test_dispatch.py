@@ -0,0 +1,71 @@
+import time
+import asyncio
+from dispatch import backoff, dispatch, TokenBucket
+
+
+def slow_send(batch):
+    # Stand-in for a provider call that takes a fixed amount of time
+    time.sleep(0.1)
+    return [(recipient_id, None) for recipient_id, _ in batch]
+
+
+# Throughput scales with the number of workers
+def test_dispatch_runs_batches_concurrently():
+    recipients = [(f"token-{i}", f"user-{i}") for i in range(8)]
+    bucket = TokenBucket(1000)
+
+    start = time.perf_counter()
+    report = asyncio.run(dispatch("test", recipients, slow_send, bucket, concurrency=8))
+    elapsed = time.perf_counter() - start
+
+    assert sorted(report.sent) == sorted(token for token, _ in recipients)
+    assert report.failed == []
+    assert elapsed < 0.5
+
+
+# Failures are recorded per recipient, including exceptions raised by the sender
+def test_dispatch_records_failures():
+    def send(batch):
+        if batch[0][0] == "boom":
+            raise RuntimeError("provider down")
+        return [(recipient_id, "rejected") for recipient_id, _ in batch]
+
+    bucket = TokenBucket(1000)
+    report = asyncio.run(
+        dispatch("test", [("boom", None), ("nope", None)], send, bucket)
+    )
+
+    assert report.sent == []
+    assert sorted(report.failed) == [("boom", "provider down"), ("nope", "rejected")]
+
+
+# The token bucket holds sends to the configured rate
+def test_token_bucket_limits_rate():
+    async def drain():
+        bucket = TokenBucket(10, capacity=1)
+        start = time.perf_counter()
+        for _ in range(4):
+            await bucket.acquire()
+        return time.perf_counter() - start
+
+    assert asyncio.run(drain()) >= 0.25
+
+
+# A batch larger than the bucket is charged in full, not just its capacity
+def test_token_bucket_charges_large_batches():
+    async def drain():
+        bucket = TokenBucket(100, capacity=10)
+        start = time.perf_counter()
+        await bucket.acquire(50)
+        await bucket.acquire(10)
+        return time.perf_counter() - start
+
+    assert asyncio.run(drain()) >= 0.5
+
+
+# Retry delays grow exponentially up to the cap and are jittered below it
+def test_backoff_is_capped_and_jittered():
+    assert backoff(1, 10, 1800, rng=lambda: 1.0) == 10
+    assert backoff(4, 10, 1800, rng=lambda: 1.0) == 80
+    assert backoff(20, 10, 1800, rng=lambda: 1.0) == 1800
+    assert backoff(4, 10, 1800, rng=lambda: 0.5) == 40
@@ -0,0 +1,59 @@
+from endpoints import EndpointProvider, ProbeSpec
+
+
+def loaded_provider(endpoints, version):
+    # Provider as left by a load, without a database
+    provider = EndpointProvider(None, default_interval=30)
+    provider.endpoints = dict(endpoints)
+    provider.version = version
+    provider.stale = False
+    return provider
+
+
+# Consecutive diffs are applied in place, leaving other endpoints untouched
+def test_diffs_apply_incrementally():
+    provider = loaded_provider(
+        {"10.0.0.1": ProbeSpec(30), "10.0.0.2": ProbeSpec(60)}, version=4
+    )
+    before = provider.endpoints
+
+    provider.on_change(
+        {
+            "version": 5,
+            "added": {
+                "10.0.0.3": {
+                    "area": "north",
+                    "type": "tcp",
+                    "params": {"port": 443},
+                    "slo": 0.1,
+                },
+                "10.0.0.2": {"interval": 10},
+            },
+            "removed": [],
+        }
+    )
+    provider.on_change({"version": 6, "added": {}, "removed": ["10.0.0.1"]})
+
+    assert provider.endpoints == {
+        "10.0.0.2": ProbeSpec(10),
+        "10.0.0.3": ProbeSpec(30, "tcp", {"port": 443}, slo=0.1, area="north"),
+    }
+    assert provider.version == 6 and not provider.stale
+    assert before == {"10.0.0.1": ProbeSpec(30), "10.0.0.2": ProbeSpec(60)}
+
+
+# A missed version, a reload or a reconnect forces a reload; versions a
+# reload already covered are ignored
+def test_gaps_mark_the_set_stale():
+    provider = loaded_provider({"10.0.0.1": ProbeSpec(30)}, version=4)
+    provider.on_change({"version": 4, "added": {"10.0.0.9": {}}, "removed": []})
+    assert not provider.stale and "10.0.0.9" not in provider.endpoints
+
+    for payload in [
+        {"version": 6, "added": {}, "removed": []},
+        {"version": 5, "reload": True},
+        None,
+    ]:
+        provider.stale = False
+        provider.on_change(payload)
+        assert provider.stale
@@ -0,0 +1,36 @@
+from collections import Counter
+from hashring import HashRing
+
+ADDRESSES = [f"10.0.{i // 256}.{i % 256}" for i in range(2000)]
+
+
+# Every worker builds the same ring from the same membership
+def test_ring_is_deterministic():
+    first = HashRing(["worker-a", "worker-b", "worker-c"])
+    second = HashRing(["worker-c", "worker-a", "worker-b"])
+
+    assert [first.owner(a) for a in ADDRESSES] == [second.owner(a) for a in ADDRESSES]
+
+
+# Endpoints are spread roughly evenly over the workers
+def test_ring_balances_endpoints():
+    ring = HashRing(["worker-a", "worker-b", "worker-c", "worker-d"])
+
+    counts = Counter(ring.owner(a) for a in ADDRESSES)
+    assert set(counts) == {"worker-a", "worker-b", "worker-c", "worker-d"}
+    assert min(counts.values()) > len(ADDRESSES) / 4 * 0.6
+
+
+# A joining worker only takes endpoints over; none move between the others
+def test_joining_worker_moves_few_endpoints():
+    before = HashRing(["worker-a", "worker-b", "worker-c"])
+    after = HashRing(["worker-a", "worker-b", "worker-c", "worker-d"])
+
+    moved = [a for a in ADDRESSES if before.owner(a) != after.owner(a)]
+    assert all(after.owner(a) == "worker-d" for a in moved)
+    assert len(moved) < len(ADDRESSES) / 2
+
+
+# An empty ring owns nothing
+def test_empty_ring():
+    assert HashRing([]).owner("10.0.0.1") is None
@@ -0,0 +1,40 @@
+import history
+from datetime import datetime, timedelta, timezone
+from history import HistoryWriter
+
+
+class FailingSession:
+    # Database that rejects every write
+    def execute(self, statement, params=None):
+        raise RuntimeError("connection lost")
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# A failed flush keeps its samples for the next one, merged with those
+# recorded since and bounded in number
+def test_failed_flush_is_retried(monkeypatch):
+    monkeypatch.setattr(history, "HISTORY_MAX_PENDING", 3)
+    writer = HistoryWriter(FailingSession)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    writer.record("a", start, 0.004)
+    writer.record("a", start + timedelta(seconds=1), None)
+    writer.flush()
+    writer.record("a", start + timedelta(seconds=2), 0.004)
+
+    assert [result["probed_at"].second for result in writer.results] == [0, 1, 2]
+    minute = writer.rollups[("a", "minute", start)]
+    assert (minute["probes"], minute["successes"]) == (3, 2)
+
+    writer.flush()
+    writer.record("a", start + timedelta(hours=2), 0.004)
+    writer.flush()
+
+    assert writer.results[0]["probed_at"].second == 1
+    assert len(writer.results) == 3 and len(writer.rollups) == 3
+    assert ("a", "minute", start + timedelta(hours=2)) in writer.rollups
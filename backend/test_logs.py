@@ -0,0 +1,87 @@
+import json
+import queue
+import logging
+from logs import (
+    ContextFilter,
+    DroppingQueueHandler,
+    JsonFormatter,
+    RateLimitFilter,
+    SamplingFilter,
+    correlation,
+    redact,
+)
+
+
+def make_record(msg, *args, **extra):
+    record = logging.LogRecord("test", logging.WARNING, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+class Clock:
+    # Manually advanced clock for rate limit windows
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+# Contact details are redacted, endpoint addresses and timestamps are not
+def test_redact():
+    text = redact(
+        "Unable to create record: +15551234567 and jane.doe@example.com "
+        "via 216.75.112.220 at 2024-05-01 12:00:00"
+    )
+    assert "+15551234567" not in text and "jane.doe@example.com" not in text
+    assert "[phone]" in text and "[email]" in text
+    assert "216.75.112.220" in text and "2024-05-01 12:00:00" in text
+
+
+# Repeats beyond the limit are dropped and counted in the next window
+def test_rate_limit_repeated_errors():
+    clock = Clock()
+    limiter = RateLimitFilter(limit=2, window=60, clock=clock)
+
+    kept = [limiter.filter(make_record("Error for %s", i)) for i in range(5)]
+    assert kept == [True, True, False, False, False]
+
+    clock.now += 60
+    record = make_record("Error for %s", 5)
+    assert limiter.filter(record) and record.suppressed == 3
+
+    # Other messages have windows of their own
+    assert limiter.filter(make_record("Another error"))
+
+
+# Only a share of the records marked for sampling is kept
+def test_sampling():
+    draws = iter([0.5, 0.001])
+    sampler = SamplingFilter(rate=0.01, rng=lambda: next(draws))
+
+    assert sampler.filter(make_record("Not sampled"))
+    assert not sampler.filter(make_record("Detail", sample=True))
+    record = make_record("Detail", sample=True)
+    assert sampler.filter(record) and record.sample == 0.01
+
+
+# Records carry the correlation id of the context they were logged in
+def test_json_records_carry_correlation_id():
+    with correlation("abc123"):
+        record = make_record("SMS to %s failed", "+15551234567", area="north")
+        ContextFilter().filter(record)
+
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["correlation_id"] == "abc123"
+    assert entry["area"] == "north"
+    assert entry["message"] == "SMS to [phone] failed"
+
+
+# A full queue drops records instead of blocking the caller
+def test_full_queue_drops_records():
+    handler = DroppingQueueHandler(queue.Queue(1))
+    handler.handle(make_record("first"))
+    handler.handle(make_record("second"))
+
+    assert handler.queue.qsize() == 1
+    assert handler.queue.get_nowait().getMessage() == "first"
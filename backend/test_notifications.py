@@ -0,0 +1,139 @@
+import os
+import asyncio
+from datetime import datetime, timezone
+from collections import namedtuple
+from cryptography.fernet import Fernet
+
+# notifications builds its encryptor on import
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode())
+
+import pytest  # noqa: E402
+import outbox  # noqa: E402
+import notifications  # noqa: E402
+from roster import Roster, wipe  # noqa: E402
+from dispatch import TokenBucket  # noqa: E402
+from outbox import OUTBOX_MAX_ATTEMPTS  # noqa: E402
+from benchmarks.common import StubProviders  # noqa: E402
+
+Row = namedtuple("Row", "id token attempts subject message created_at correlation_id")
+
+
+class Session:
+    # Delivery only needs the session to reach complete() and close it
+    def __init__(self):
+        self.executed = []
+
+    def execute(self, statement, params=None):
+        self.executed.append((str(statement), params))
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def message(message_id, token, attempts=0):
+    return Row(
+        message_id,
+        token,
+        attempts,
+        "ISP Status Update",
+        "Allo is down!",
+        datetime.now(timezone.utc),
+        "c0ffee",
+    )
+
+
+@pytest.fixture
+def delivery(monkeypatch):
+    """
+    Points delivery at a stub Twilio server, a fresh roster and a fake
+    subscriptions table, and returns a function delivering one claim.
+    """
+    stub = StubProviders().start()
+    monkeypatch.setattr(notifications, "TWILIO_BASE_URL", stub.url)
+    monkeypatch.setattr(notifications, "TWILIO_ACCOUNT_SID", "AC" + "0" * 32)
+    monkeypatch.setattr(notifications, "TWILIO_AUTH_TOKEN", "test")
+    monkeypatch.setattr(notifications, "twilio_client", None)
+    monkeypatch.setattr(notifications, "twilio_bucket", TokenBucket(1000))
+    monkeypatch.setattr(notifications, "sms_roster", Roster("sms"))
+
+    # Subscribers in the database, whether or not the roster has them
+    database = {}
+    monkeypatch.setattr(
+        notifications,
+        "load_recipients",
+        lambda session, channel, tokens: {
+            token: (bytearray(database[token].encode()), None)
+            for token in tokens
+            if token in database
+        },
+    )
+    monkeypatch.setattr(
+        notifications,
+        "subscribed_tokens",
+        lambda session, channel, tokens: set(tokens) & set(database),
+    )
+
+    outcomes = {}
+
+    def complete(session, sent, skipped, failed):
+        outcomes.update(sent=set(sent), skipped=skipped, failed=failed)
+        return outbox.complete(session, sent, skipped, failed)
+
+    monkeypatch.setattr(notifications, "complete", complete)
+    monkeypatch.setattr(notifications, "SessionLocal", Session)
+
+    def deliver(rows, failure_rate=0.0):
+        stub.failure_rate = failure_rate
+        monkeypatch.setattr(notifications, "claim", lambda session, channel: rows)
+        dead = []
+        monkeypatch.setattr(
+            notifications.NOTIFICATION_DEAD_LETTERS.labels("sms"), "inc", dead.append
+        )
+        asyncio.run(notifications.deliver_batch("sms"))
+        return outcomes, sum(dead)
+
+    deliver.stub = stub
+    deliver.database = database
+    yield deliver
+    stub.stop()
+
+
+# Listed and newly subscribed recipients are sent to; only subscribers
+# that are gone from the database are skipped
+def test_sent_and_skipped(delivery):
+    delivery.database.update({"listed": "+15550000001", "new": "+15550000002"})
+    notifications.sms_roster.add("listed", "+15550000001")
+
+    outcomes, dead = delivery(
+        [message(1, "listed"), message(2, "new"), message(3, "gone")]
+    )
+
+    assert outcomes["sent"] == {1, 2}
+    assert outcomes["skipped"] == [3]
+    assert outcomes["failed"] == [] and dead == 0
+    assert delivery.stub.sms == 2
+
+
+# Provider errors are retried until the attempt limit, then dead-lettered;
+# a subscriber wiped from the roster by a rebuild mid-batch is retried too
+def test_retry_and_dead_letter(delivery):
+    delivery.database.update({"a": "+15550000001", "b": "+15550000002"})
+    notifications.sms_roster.add("a", "+15550000001")
+    notifications.sms_roster.add("b", "+15550000002")
+
+    outcomes, dead = delivery(
+        [message(1, "a"), message(2, "b", attempts=OUTBOX_MAX_ATTEMPTS - 1)],
+        failure_rate=1.0,
+    )
+
+    assert outcomes["sent"] == set() and outcomes["skipped"] == []
+    failed = [(message_id, attempts) for message_id, attempts, _ in outcomes["failed"]]
+    assert failed == [(1, 0), (2, OUTBOX_MAX_ATTEMPTS - 1)]
+    assert dead == 1
+
+    wipe(notifications.sms_roster.get("a")[0])
+    outcomes, dead = delivery([message(4, "a")])
+    assert outcomes["failed"][0][0] == 4 and outcomes["skipped"] == []
@@ -0,0 +1,40 @@
+import outbox
+from outbox import complete, OUTBOX_MAX_ATTEMPTS
+
+
+class RecordingSession:
+    # Keeps the statements complete() runs instead of sending them
+    def __init__(self):
+        self.executed = []
+        self.committed = False
+
+    def execute(self, statement, params=None):
+        self.executed.append((str(statement), params))
+
+    def commit(self):
+        self.committed = True
+
+
+# Failures are retried with backoff until the attempt limit, then
+# dead-lettered, all in the same commit as the sent and skipped messages
+def test_failures_retry_then_dead_letter(monkeypatch):
+    monkeypatch.setattr(outbox, "backoff", lambda attempts, base, cap: attempts)
+    session = RecordingSession()
+
+    dead = complete(
+        session,
+        [1],
+        [2],
+        [(3, 0, "Throttled"), (4, OUTBOX_MAX_ATTEMPTS - 1, "Throttled")],
+    )
+
+    assert dead == 1 and session.committed
+    statements = [statement for statement, params in session.executed]
+    assert [params for _, params in session.executed] == [
+        None,
+        None,
+        [{"message_id": 3, "error": "Throttled", "delay": 1}],
+        [{"message_id": 4, "error": "Throttled"}],
+    ]
+    assert "next_attempt_at" in statements[2] and "state" not in statements[2]
+    assert "state" in statements[3] and "next_attempt_at" not in statements[3]
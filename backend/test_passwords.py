@@ -0,0 +1,35 @@
+import pytest
+import passwords
+import threading
+
+
+# Hashes made under another cost are flagged for an upgrade
+def test_needs_rehash():
+    current = passwords.hash_password("secret")
+
+    assert passwords.check_password(current, "secret")
+    assert not passwords.needs_rehash(current)
+    assert passwords.needs_rehash(
+        current.replace(passwords.PASSWORD_HASH_METHOD, "pbkdf2:sha256:1000", 1)
+    )
+
+
+# Checks beyond the queue are refused rather than left to pile up
+def test_hashing_is_bounded(monkeypatch):
+    monkeypatch.setattr(passwords, "slots", threading.BoundedSemaphore(1))
+    release = threading.Event()
+    started = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait()
+
+    worker = threading.Thread(target=passwords.run, args=(slow,))
+    worker.start()
+    started.wait()
+    try:
+        with pytest.raises(passwords.HashingBusy):
+            passwords.hash_password("secret")
+    finally:
+        release.set()
+        worker.join()
@@ -0,0 +1,182 @@
+import socket
+import struct
+import asyncio
+import probing
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def run_probe(probe_type, address, params, timeout=1):
+    # Runs one probe in a fresh loop, closing the shared HTTP session after
+    async def probe():
+        try:
+            return await probing.probe_endpoint(
+                address, asyncio.Semaphore(1), timeout, probe_type, params
+            )
+        finally:
+            await probing.close()
+
+    return asyncio.run(probe())
+
+
+# TCP probes time the handshake, and a refused connection is a failure
+def test_tcp_probe():
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+    port = listener.getsockname()[1]
+    try:
+        assert run_probe("tcp", "127.0.0.1", {"port": port}) is not None
+    finally:
+        listener.close()
+
+    assert run_probe("tcp", "127.0.0.1", {"port": port}) is None
+
+
+# HTTP probes reuse one connection and fail on error statuses
+def test_http_probe_reuses_connections():
+    connections = []
+    statuses = iter([200, 204, 503])
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            connections.append(1)
+            super().setup()
+
+        def do_HEAD(self):
+            self.send_response(next(statuses))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/health"
+
+    async def probe_three_times():
+        semaphore = asyncio.Semaphore(1)
+        try:
+            return [
+                await probing.probe_endpoint("stub", semaphore, 1, "http", {"url": url})
+                for _ in range(3)
+            ]
+        finally:
+            await probing.close()
+
+    try:
+        rtts = asyncio.run(probe_three_times())
+    finally:
+        server.shutdown()
+
+    assert rtts[0] is not None and rtts[1] is not None and rtts[2] is None
+    assert len(connections) == 1
+
+
+# DNS probes need an answer to their own query without an error code
+def test_dns_probe():
+    class StubResolver(asyncio.DatagramProtocol):
+        def __init__(self, rcode, answers):
+            self.rcode = rcode
+            self.answers = answers
+
+        def connection_made(self, transport):
+            self.transport = transport
+
+        def datagram_received(self, data, addr):
+            query_id, _ = struct.unpack_from("!HH", data)
+            header = struct.pack(
+                "!HHHHHH", query_id, 0x8180 | self.rcode, 1, self.answers, 0, 0
+            )
+            self.transport.sendto(header + data[12:], addr)
+
+    async def probe(rcode, answers):
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: StubResolver(rcode, answers), local_addr=("127.0.0.1", 0)
+        )
+        port = transport.get_extra_info("sockname")[1]
+        try:
+            return await probing.probe_endpoint(
+                "127.0.0.1", asyncio.Semaphore(1), 1, "dns", {"port": port}
+            )
+        finally:
+            transport.close()
+
+    assert asyncio.run(probe(0, 1)) is not None
+    assert asyncio.run(probe(3, 0)) is None
+
+
+# Answers slower than the latency SLO count as failures
+def test_within_slo():
+    assert probing.within_slo("10.0.0.1", 0.05, None)
+    assert probing.within_slo("10.0.0.1", 0.05, 0.1)
+    assert not probing.within_slo("10.0.0.1", 0.5, 0.1)
+    assert not probing.within_slo("10.0.0.1", None, 0.1)
+
+
+# DNS names that could not be encoded into a query are rejected on save
+def test_validate_dns_name():
+    assert probing.validate_probe("dns", {"name": "example.com."}) is None
+    assert probing.validate_probe("dns", {}) is None
+    for name in ["", "a..b", "x" * 64 + ".com", 42]:
+        assert probing.validate_probe("dns", {"name": name}) is not None
+
+
+# Ports and statuses must be real integers in range, not strings or booleans
+def test_validate_numeric_params():
+    assert probing.validate_probe("tcp", {"port": 443}) is None
+    assert probing.validate_probe("http", {"max_status": 499}) is None
+    assert probing.validate_probe("dns", {"port": 5353}) is None
+    for probe_type, params in [
+        ("tcp", {"port": True}),
+        ("tcp", {"port": "443"}),
+        ("http", {"max_status": "399"}),
+        ("http", {"max_status": False}),
+        ("http", {"max_status": 600}),
+        ("dns", {"port": "53"}),
+        ("dns", {"port": 0}),
+    ]:
+        assert probing.validate_probe(probe_type, params) is not None
+
+
+# A probe raising an unexpected error counts as a failed probe
+def test_unexpected_probe_errors_fail_the_probe(monkeypatch):
+    async def broken(address, params, timeout):
+        raise TypeError("'>' not supported")
+
+    monkeypatch.setitem(probing.PROBES, "http", broken)
+    rtt = asyncio.run(
+        probing.probe_endpoint("10.0.0.1", asyncio.Semaphore(1), 1, "http")
+    )
+    assert rtt is None
+
+
+# Failures are counted apart by reason, so a fast 5xx is not a timeout
+def test_probe_failures_by_reason(monkeypatch):
+    async def slow(address, params, timeout):
+        raise asyncio.TimeoutError
+
+    async def refused(address, params, timeout):
+        raise ConnectionRefusedError
+
+    async def server_error(address, params, timeout):
+        return None
+
+    def failures(reason):
+        return probing.PROBE_FAILURES.labels("10.0.0.2", reason)._value.get()
+
+    for probe, reason in [
+        (slow, "timeout"),
+        (refused, "error"),
+        (server_error, "bad_response"),
+    ]:
+        monkeypatch.setitem(probing.PROBES, "http", probe)
+        before = failures(reason)
+        rtt = asyncio.run(
+            probing.probe_endpoint("10.0.0.2", asyncio.Semaphore(1), 1, "http")
+        )
+        assert rtt is None and failures(reason) == before + 1
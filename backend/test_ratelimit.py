@@ -0,0 +1,86 @@
+import ratelimit
+from ratelimit import Limit, SlidingWindowLimiter
+
+
+class Clock:
+    # Manually advanced wall clock
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+# The previous window still counts in proportion to its overlap
+def test_sliding_window(tmp_path):
+    clock = Clock()
+    limiter = SlidingWindowLimiter(str(tmp_path / "limits"), slots=64, clock=clock)
+    limit = Limit(3, 10)
+
+    assert [limiter.hit([("ip:a", limit)]) for _ in range(4)][-1] > 0
+
+    # Halfway through the next window, 3 * 0.5 hits still count
+    clock.now += 15
+    assert limiter.hit([("ip:a", limit)]) == 0
+    assert limiter.hit([("ip:a", limit)]) > 0
+
+    clock.now += 20
+    assert limiter.hit([("ip:a", limit)]) == 0
+
+
+# A request rejected by one key is not counted against the others
+def test_hits_are_all_or_nothing(tmp_path):
+    limiter = SlidingWindowLimiter(str(tmp_path / "limits"), slots=64, clock=Clock())
+    loose, tight = Limit(10, 60), Limit(1, 60)
+
+    assert limiter.hit([("global", loose), ("email:x", tight)]) == 0
+    assert limiter.hit([("global", loose), ("email:x", tight)]) > 0
+    for _ in range(9):
+        assert limiter.hit([("global", loose)]) == 0
+    assert limiter.hit([("global", loose)]) > 0
+
+
+# Separate limiter instances, like separate workers, share the counters
+def test_counters_are_shared(tmp_path):
+    clock = Clock()
+    path = str(tmp_path / "limits")
+    first = SlidingWindowLimiter(path, slots=64, clock=clock)
+    second = SlidingWindowLimiter(path, slots=64, clock=clock)
+
+    assert first.hit([("ip:a", Limit(1, 60))]) == 0
+    assert second.hit([("ip:a", Limit(1, 60))]) > 0
+
+
+# Failures lock an account without the lock check itself counting, and a
+# reset unlocks it
+def test_lockout_and_reset(tmp_path, monkeypatch):
+    monkeypatch.setitem(
+        ratelimit.RATE_LIMITS, "login_failures", {"account": Limit(2, 900)}
+    )
+    limiter = SlidingWindowLimiter(str(tmp_path / "limits"), slots=64, clock=Clock())
+
+    for _ in range(3):
+        assert limiter.exceeded("login_failures", account="a") == 0
+    limiter.check("login_failures", account="a")
+    limiter.check("login_failures", account="a")
+    assert limiter.exceeded("login_failures", account="a") > 0
+    assert limiter.exceeded("login_failures", account="b") == 0
+
+    limiter.reset("login_failures", account="a")
+    assert limiter.exceeded("login_failures", account="a") == 0
+
+
+# Keys of limits with different windows sharing a tiny table keep their
+# counts; a short window does not make a long one look idle
+def test_colliding_keys_with_different_windows(tmp_path):
+    clock = Clock()
+    limiter = SlidingWindowLimiter(str(tmp_path / "limits"), slots=2, clock=clock)
+    hourly, per_second = Limit(3, 3600), Limit(50, 1)
+
+    for _ in range(3):
+        assert limiter.hit([("email:x", hourly)]) == 0
+    for key in ["global", "ip:a", "ip:b", "global"]:
+        clock.now += 1.5
+        limiter.hit([(key, per_second)])
+
+    assert limiter.hit([("email:x", hourly)]) > 0
@@ -0,0 +1,31 @@
+from roster import Roster
+
+
+# Removing a recipient wipes its address and frees the slot for reuse
+def test_remove_wipes_and_reuses_slot():
+    roster = Roster("email")
+    roster.add("a", "a@example.com", "link-a")
+    roster.add("b", "b@example.com", "link-b")
+    _, address, _ = roster.snapshot()[0]
+
+    roster.remove("a")
+    assert not any(address)
+    assert [token for token, _, _ in roster.snapshot()] == ["b"]
+
+    roster.add("c", "c@example.com")
+    assert len(roster.tokens) == 2
+    assert len(roster) == 2
+
+
+# A rebuild replaces every entry, and replaying a change already seen is harmless
+def test_rebuild_is_idempotent_with_replayed_changes():
+    roster = Roster("sms")
+    roster.add("old", "+15550000000")
+    roster.rebuild([[("a", "+15550000001", None)], [("b", "+15550000002", None)]])
+
+    roster.add("a", "+15550000001")
+    roster.remove("old")
+
+    assert sorted(
+        (token, address.decode()) for token, address, _ in roster.snapshot()
+    ) == [("a", "+15550000001"), ("b", "+15550000002")]
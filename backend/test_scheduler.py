@@ -0,0 +1,33 @@
+import asyncio
+from scheduler import run_every
+
+
+async def run_for(seconds, interval, duration):
+    # Records the loop time of every tick while the schedule runs
+    loop = asyncio.get_running_loop()
+    ticks = []
+
+    async def callback():
+        ticks.append(loop.time())
+        await asyncio.sleep(duration)
+
+    task = asyncio.create_task(run_every("test", interval, callback))
+    await asyncio.sleep(seconds)
+    task.cancel()
+    return ticks
+
+
+# The cadence does not stretch by the time each run takes
+def test_run_every_is_drift_free():
+    ticks = asyncio.run(run_for(0.55, 0.1, 0.05))
+
+    assert len(ticks) == 6
+    assert abs((ticks[-1] - ticks[0]) - 0.5) < 0.05
+
+
+# Overrunning ticks are skipped rather than run back to back
+def test_run_every_skips_missed_ticks():
+    ticks = asyncio.run(run_for(0.65, 0.1, 0.15))
+
+    assert len(ticks) == 4
+    assert all(abs((b - a) - 0.2) < 0.05 for a, b in zip(ticks, ticks[1:]))
@@ -0,0 +1,184 @@
+import state_engine
+from endpoints import ProbeSpec
+from state_engine import AreaStates, StateEngine
+
+
+class Clock:
+    # Manually advanced clock for the flap penalty decay
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_engine(**kwargs):
+    kwargs.setdefault("down_threshold", 3)
+    kwargs.setdefault("up_threshold", 2)
+    engine = StateEngine(clock=Clock(), **kwargs)
+    engine.state = engine.notified_state = True
+    return engine
+
+
+def tick(engine, results):
+    # One probe tick per endpoint followed by a state check
+    for address, success in results.items():
+        engine.observe(address, success)
+    return engine.evaluate()
+
+
+# A single dropped probe never flips the state
+def test_single_failure_is_ignored():
+    engine = make_engine()
+
+    assert tick(engine, {"a": False, "b": True, "c": True}) == (False, None)
+    assert tick(engine, {"a": True, "b": True, "c": True}) == (False, None)
+
+
+# The ISP goes down only once a quorum of endpoints is down
+def test_quorum_of_endpoints_required():
+    engine = make_engine(quorum=2)
+
+    for _ in range(3):
+        changed, notify = tick(engine, {"a": False, "b": True, "c": True})
+    assert (changed, notify) == (False, None)
+
+    for _ in range(2):
+        changed, notify = tick(engine, {"a": False, "b": False, "c": True})
+    assert engine.state is True
+
+    changed, notify = tick(engine, {"a": False, "b": False, "c": True})
+    assert (changed, notify) == (True, False)
+
+
+# Recovery needs the up threshold of consecutive successes
+def test_hysteresis_on_recovery():
+    engine = make_engine(quorum=1)
+    for _ in range(3):
+        tick(engine, {"a": False})
+    assert engine.state is False
+
+    assert tick(engine, {"a": True}) == (False, None)
+    assert tick(engine, {"a": True}) == (True, True)
+
+
+# Repeated transitions suppress notifications until the penalty decays
+def test_flapping_is_suppressed(monkeypatch):
+    monkeypatch.setattr(state_engine, "FLAP_SUPPRESS_LIMIT", 2500)
+    monkeypatch.setattr(state_engine, "FLAP_REUSE_LIMIT", 750)
+    engine = make_engine(quorum=1, down_threshold=1, up_threshold=1)
+
+    notifications = [tick(engine, {"a": i % 2 == 1})[1] for i in range(5)]
+    assert notifications[:2] == [False, True]
+    assert notifications[-1] is None
+    assert engine.suppressed
+
+    # After enough half-lives the settled state is announced once
+    engine.clock.now += 10 * state_engine.FLAP_HALF_LIFE
+    assert tick(engine, {"a": False}) == (False, False)
+
+
+# Persisted state restores without re-alerting
+def test_restore_round_trip():
+    engine = make_engine(quorum=1)
+    for _ in range(3):
+        tick(engine, {"a": False})
+
+    restored = StateEngine(clock=Clock())
+    restored.restore(engine.to_dict())
+
+    assert restored.state is False
+    assert restored.evaluate() == (False, None)
+
+
+# A worker taking an endpoint over carries on from the reported streaks
+def test_seed_from_report():
+    engine = make_engine(quorum=1)
+    tick(engine, {"a": False, "b": True})
+    tick(engine, {"a": False, "b": True})
+
+    report = engine.report({"a"})
+    assert list(report) == ["a"]
+
+    taken_over = make_engine(quorum=1)
+    taken_over.seed("a", report["a"])
+    taken_over.observe("a", False)
+    assert taken_over.evaluate() == (True, False)
+
+
+def make_areas():
+    return AreaStates("default", factory=lambda: make_engine(quorum=1))
+
+
+# An outage in one area leaves the others, and their subscribers, alone
+def test_areas_are_decided_independently():
+    areas = make_areas()
+    areas.observe("north", "a", True)
+    areas.observe("south", "b", True)
+    assert areas.evaluate() == [("north", False, None), ("south", False, None)]
+
+    for _ in range(3):
+        areas.observe("north", "a", False)
+        areas.observe("south", "b", True)
+    assert areas.evaluate() == [("north", True, False), ("south", False, None)]
+
+
+# Endpoints moved or removed are forgotten, and so are areas left empty
+def test_prune_follows_the_endpoint_set():
+    areas = make_areas()
+    areas.observe("north", "a", True)
+    areas.observe("north", "b", True)
+    areas.observe("south", "c", True)
+
+    areas.prune({"a": ProbeSpec(30, area="north"), "b": ProbeSpec(30, area="east")})
+
+    assert list(areas.areas) == ["north"]
+    assert list(areas.areas["north"].endpoints) == ["a"]
+
+
+# State saved before areas existed is restored into the default area
+def test_restore_legacy_state():
+    engine = make_engine()
+    tick(engine, {"a": True})
+
+    areas = make_areas()
+    areas.restore(engine.to_dict())
+    assert list(areas.areas) == ["default"]
+    assert areas.report({"a"}) == {"a": [True, 0, 1]}
+
+    restored = make_areas()
+    restored.restore(areas.to_dict())
+    assert restored.areas["default"].state is True
+
+
+# A transition rolled back after a failed save is announced again
+def test_rollback_announces_again():
+    areas = make_areas()
+    areas.observe("north", "a", True)
+    areas.evaluate()
+
+    checkpoint = areas.to_dict()
+    for _ in range(3):
+        areas.observe("north", "a", False)
+    assert areas.evaluate() == [("north", True, False)]
+
+    areas.rollback(checkpoint)
+    assert areas.report({"a"}) == {"a": [False, 3, 0]}
+    assert areas.evaluate() == [("north", True, False)]
+
+
+# An area that appeared after the checkpoint is reset too, not left with
+# the state whose save failed
+def test_rollback_resets_new_areas():
+    areas = make_areas()
+    areas.observe("north", "a", True)
+    areas.evaluate()
+
+    checkpoint = areas.to_dict()
+    for _ in range(3):
+        areas.observe("south", "b", False)
+    assert areas.evaluate() == [("north", False, None), ("south", True, False)]
+
+    areas.rollback(checkpoint)
+    assert areas.report({"b"}) == {"b": [False, 3, 0]}
+    assert areas.evaluate() == [("north", False, None), ("south", True, False)]
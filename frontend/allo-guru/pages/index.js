@@ -8,6 +8,9 @@ export default function Status({ serviceStatus }) {
   const [emailError, setEmailError] = useState('');
   const [submitMessage, setSubmitMessage] = useState('');
 
+  // Live status message, updated from the status stream
+  const [statusMessage, setStatusMessage] = useState(serviceStatus.message);
+
   // New state hook for tracking if the logo has loaded
   const [logoLoaded, setLogoLoaded] = useState(false);
 
@@ -66,6 +69,17 @@ export default function Status({ serviceStatus }) {
     }
   };
 
+  useEffect(() => {
+    // Subscribe to status changes pushed by the server
+    const source = new EventSource('https://www.allo.guru/api/status/stream');
+    source.onmessage = (event) => {
+      setStatusMessage(JSON.parse(event.data).message);
+    };
+
+    // Close the stream when the page unmounts
+    return () => source.close();
+  }, []);
+
   useEffect(() => {
     const calculateWidth = () => {
       if (inputRef.current && buttonRef.current) {
@@ -104,7 +118,7 @@ export default function Status({ serviceStatus }) {
 
       <div className="marquee-wrapper" style={{ width: marqueeWidth }}>
         <div className="marquee-container">
-          <p className="serviceMessage">{serviceStatus.message}</p>
+          <p className="serviceMessage">{statusMessage}</p>
         </div>
       </div>
 
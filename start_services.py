@@ -1,6 +1,14 @@
 import subprocess
 import signal
+import shutil
 import sys
+import os
+
+# Gunicorn workers share Prometheus metrics through files in this directory
+METRICS_DIR = "/tmp/allo_guru_metrics"
+
+# Monitor processes sharing the endpoints; one of them is elected leader
+MONITOR_WORKERS = int(os.getenv("MONITOR_WORKERS", "1"))
 
 def run_command(command, cwd=None, background=False):
     if background:
@@ -8,14 +16,27 @@ def run_command(command, cwd=None, background=False):
     else:
         return subprocess.run(command, cwd=cwd, shell=True)
 
+def init_database():
+    # Schema and default rows are set up once, before any worker imports the app
+    result = run_command("python3 manage.py init", cwd="/usr/src/app/backend")
+    if result.returncode != 0:
+        sys.exit(result.returncode)
+
 def start_flask_app():
-    return run_command("gunicorn -w 4 -b 0.0.0.0:8000 app:app --log-level info", cwd="/usr/src/app/backend", background=True)
+    shutil.rmtree(METRICS_DIR, ignore_errors=True)
+    os.makedirs(METRICS_DIR)
+    # Uvicorn workers serve status reads and streams natively and the other Flask routes in a thread pool
+    return run_command(f"PROMETHEUS_MULTIPROC_DIR={METRICS_DIR} gunicorn -c gunicorn.conf.py -w 4 -k uvicorn_worker.UvicornWorker -b 0.0.0.0:8000 asgi:app --log-level info", cwd="/usr/src/app/backend", background=True)
 
 def start_next_js_app():
     return run_command("npm start", cwd="/usr/src/app/frontend", background=True)
 
 def start_asynchronous_tasks():
-    return run_command("python3 asyncio_script.py", cwd="/usr/src/app/backend", background=True)
+    processes = [run_command("python3 asyncio_script.py", cwd="/usr/src/app/backend", background=True)]
+    # Extra workers skip 9101, where the notifier serves its metrics
+    for i in range(1, MONITOR_WORKERS):
+        processes.append(run_command(f"MONITOR_METRICS_PORT={9101 + i} python3 asyncio_script.py", cwd="/usr/src/app/backend", background=True))
+    return processes
 
 def start_nginx():
     # Run Nginx in the foreground
@@ -31,10 +52,12 @@ if __name__ == "__main__":
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
 
+    init_database()
+
     background_processes = [
         start_flask_app(),
         start_next_js_app(),
-        start_asynchronous_tasks()
+        *start_asynchronous_tasks()
     ]
 
     # Nginx is run last and in the foreground to keep the script alive.